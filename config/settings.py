@@ -23,6 +23,17 @@ FLASK_HOST = '0.0.0.0'
 FLASK_PORT = 5025
 FLASK_DEBUG = False
 
+# 生产服务器配置（python web_main.py --production）
+SERVER_MODE = os.environ.get('SERVER_MODE', 'development')  # 'development' 或 'production'
+SERVER_WORKERS = int(os.environ.get('SERVER_WORKERS', 1))  # worker进程数（gunicorn）
+SERVER_THREADS = int(os.environ.get('SERVER_THREADS', 8))  # 每个worker的线程数
+SERVER_KEEPALIVE = int(os.environ.get('SERVER_KEEPALIVE', 5))  # keep-alive秒数
+SERVER_GRACEFUL_TIMEOUT = int(os.environ.get('SERVER_GRACEFUL_TIMEOUT', 30))  # 优雅退出等待秒数
+SERVER_TIMEOUT = int(os.environ.get('SERVER_TIMEOUT', 600))  # 单请求超时秒数（仅gunicorn，批量生成耗时较长）
+# 会话、后台任务队列与进度事件都保存在进程内存中，多个worker进程之间不共享。
+# 仅当已配置粘性路由（同一用户固定落到同一进程）或共享后端时设为True，否则SERVER_WORKERS > 1 时拒绝启动
+SERVER_SHARED_STATE = os.environ.get('SERVER_SHARED_STATE', 'False').lower() == 'true'
+
 # 数据库配置
 DATABASE_URL = os.environ.get('DATABASE_URL', f'sqlite:///{PROJECT_ROOT}/eduagent.db')
 SECRET_KEY = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
@@ -41,17 +52,125 @@ MAIL_CONFIG = {
     'MAIL_ASCII_ATTACHMENTS': os.environ.get('MAIL_ASCII_ATTACHMENTS', 'False').lower() == 'true'
 }
 
+# 用户会话配置（每个用户独立的教案生成状态）
+SESSION_MAX_LIVE = int(os.environ.get('SESSION_MAX_LIVE', 200))  # 内存中保留的最大会话数（LRU）
+SESSION_IDLE_TIMEOUT = int(os.environ.get('SESSION_IDLE_TIMEOUT', 2 * 3600))  # 空闲多少秒后移出内存
+SESSION_PERSISTENCE = os.environ.get('SESSION_PERSISTENCE', 'False').lower() == 'true'  # 是否用SQLite持久化会话
+SESSION_DB_PATH = PROJECT_ROOT / 'cache' / 'sessions.db'
+
 # 文件上传配置
 MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB
 UPLOAD_FOLDER = PROJECT_ROOT / 'uploads'
 EXPORT_FOLDER = PROJECT_ROOT / 'exports'
+# 标签模式导出多份教案时并行渲染的进程数（0 或 1 表示在当前进程中逐个渲染）
+EXPORT_RENDER_WORKERS = int(os.environ.get('EXPORT_RENDER_WORKERS', min(4, os.cpu_count() or 1)))
 
 # 模型配置
 LLM_MODEL_OUTLINE = 'qwen-plus'  # 大纲生成使用最好的模型
 LLM_MODEL_LESSON = 'qwen-turbo'  # 教案生成使用快速模型
 VLM_MODEL = 'qwen-vl-plus'  # 视觉模型
 
+# LLM调用策略（超时、重试、熔断），按模型名覆盖默认值
+# timeout: 单次调用截止时间（秒）；max_retries: 可重试错误（超时/限流/5xx/网络）的最大重试次数
+# backoff_base/backoff_max: 指数退避（带随机抖动）的基数与上限（秒）
+# breaker_threshold: 连续失败多少次后熔断；breaker_reset: 熔断后多少秒放行一次试探请求
+LLM_CALL_POLICY_DEFAULT = {
+    'timeout': float(os.environ.get('LLM_CALL_TIMEOUT', 120)),
+    'max_retries': int(os.environ.get('LLM_CALL_MAX_RETRIES', 3)),
+    'backoff_base': 1.0,
+    'backoff_max': 20.0,
+    'breaker_threshold': int(os.environ.get('LLM_BREAKER_THRESHOLD', 5)),
+    'breaker_reset': float(os.environ.get('LLM_BREAKER_RESET', 60)),
+}
+LLM_CALL_POLICIES = {
+    'qwen-plus': {'timeout': 180},  # 大纲生成输出较长
+    'qwen-turbo': {'timeout': 120},
+    'qwen-vl-plus': {'timeout': 180, 'max_retries': 2},  # 多图分析耗时较长
+}
+
+# 客户端限流（按模型，进程内所有Agent共享），请按DashScope账号配额调整
+# rpm: 每分钟请求数；tpm: 每分钟token数（输入+输出）；max_concurrency: 同时进行的请求数
+LLM_RATE_LIMIT_ENABLED = os.environ.get('LLM_RATE_LIMIT_ENABLED', 'True').lower() == 'true'
+LLM_RATE_LIMITS = {
+    'qwen-plus': {'rpm': 600, 'tpm': 1000000, 'max_concurrency': 8},
+    'qwen-turbo': {'rpm': 1200, 'tpm': 1000000, 'max_concurrency': 16},
+    'qwen-vl-plus': {'rpm': 60, 'tpm': 100000, 'max_concurrency': 4},
+}
+LLM_EXPECTED_COMPLETION_TOKENS = 1500  # 调用前为输出预留的token数，返回后按实际用量校正
+
+# 批量生成教案时同时进行的LLM请求数（1 表示逐个生成）
+LESSON_GENERATION_CONCURRENCY = int(os.environ.get('LESSON_GENERATION_CONCURRENCY', 4))
+# 文本模式教案生成使用精简提示词（模板字段清单按模板只提取一次），默认发送完整模板结构；
+# 精简提示词省略了模板结构JSON中的示例与说明，开启前请对比生成质量
+LESSON_PROMPT_COMPACT = os.environ.get('LESSON_PROMPT_COMPACT', 'False').lower() == 'true'
+# 教案提示词将同一课程共用的部分（课程信息、模板结构、规则）放在前面、本次课信息放在最后，
+# 使同一课程各课次的提示词拥有相同前缀，便于命中服务端的上下文缓存
+LESSON_PROMPT_PREFIX_LAYOUT = os.environ.get('LESSON_PROMPT_PREFIX_LAYOUT', 'True').lower() == 'true'
+# @高级生成时同时进行的占位符生成请求数
+ADVANCED_GENERATION_CONCURRENCY = int(os.environ.get('ADVANCED_GENERATION_CONCURRENCY', 8))
+# @高级生成时是否将同一教学环节/分组的占位符合并为一次JSON请求
+ADVANCED_GENERATION_BATCH_MODE = os.environ.get('ADVANCED_GENERATION_BATCH_MODE', 'False').lower() == 'true'
+# 共享后台事件循环的默认线程池大小（ChatTongyi.ainvoke 在该线程池中执行同步HTTP调用）
+ASYNC_LOOP_EXECUTOR_WORKERS = int(os.environ.get('ASYNC_LOOP_EXECUTOR_WORKERS', 32))
+
+# 缓存目录
+CACHE_FOLDER = PROJECT_ROOT / 'cache'
+
+# 模板分析缓存配置（按文件内容SHA-256缓存模板解析结果，避免重复的视觉模型调用）
+TEMPLATE_CACHE_ENABLED = os.environ.get('TEMPLATE_CACHE_ENABLED', 'True').lower() == 'true'
+TEMPLATE_CACHE_DIR = CACHE_FOLDER / 'templates'
+TEMPLATE_CACHE_MAX_BYTES = int(os.environ.get('TEMPLATE_CACHE_MAX_BYTES', 64 * 1024 * 1024))  # 64MB
+# 导出时预编译的docxtpl模板缓存数量（按路径+修改时间，每个进程独立）
+DOCX_TEMPLATE_CACHE_SIZE = int(os.environ.get('DOCX_TEMPLATE_CACHE_SIZE', 8))
+# 模板页面渲染（Aspose）配置：多页模板按页码区间分配到进程池并行渲染，1 表示在当前进程逐页渲染
+TEMPLATE_RENDER_WORKERS = int(os.environ.get('TEMPLATE_RENDER_WORKERS', min(4, os.cpu_count() or 1)))
+TEMPLATE_RENDER_DPI = int(os.environ.get('TEMPLATE_RENDER_DPI', 300))
+# 每次解析的页面图片写入此目录下的独立子目录，解析结束后删除；异常退出遗留的子目录超过保留时间后清理
+TEMPLATE_RENDER_DIR = CACHE_FOLDER / 'render'
+TEMPLATE_RENDER_DIR_MAX_AGE = int(os.environ.get('TEMPLATE_RENDER_DIR_MAX_AGE', 3600))  # 秒
+# 页面图片发送给视觉模型前按模型的有效输入分辨率缩小并重新编码，每页只编码一次，两步分析共用
+# qwen-vl 默认会把图片缩放到约 1280*28*28 像素以内，更大的图片只会增加上传体积和耗时
+VLM_IMAGE_MAX_PIXELS = int(os.environ.get('VLM_IMAGE_MAX_PIXELS', 1280 * 28 * 28))
+# 编码格式: 'jpeg'、'webp'、'png'（灰度PNG）或 'original'（原样上传）
+VLM_IMAGE_FORMAT = os.environ.get('VLM_IMAGE_FORMAT', 'jpeg').lower()
+VLM_IMAGE_QUALITY = int(os.environ.get('VLM_IMAGE_QUALITY', 85))  # JPEG/WebP质量
+# 模板视觉分析方式: 'single'（一次调用直接输出JSON，提取失败时自动改用两步）或 'two_step'（先描述再提取JSON）
+# 各方式的耗时与成功率见 /api/status 的 latency.template_analysis
+TEMPLATE_ANALYSIS_MODE = os.environ.get('TEMPLATE_ANALYSIS_MODE', 'single').lower()
+# 无标签的.docx模板先直接读取表格结构（行标题、合并单元格、分节行）生成模板结构，
+# 置信度低于阈值时才转换为图片交给视觉模型分析
+TEMPLATE_STRUCTURE_ANALYSIS_ENABLED = os.environ.get('TEMPLATE_STRUCTURE_ANALYSIS_ENABLED', 'True').lower() == 'true'
+TEMPLATE_STRUCTURE_MIN_CONFIDENCE = float(os.environ.get('TEMPLATE_STRUCTURE_MIN_CONFIDENCE', 0.75))
+
+# LLM响应缓存配置（模型名 + 消息内容哈希作为键）
+# 后端可选: 'memory'（进程内LRU）、'sqlite'（磁盘持久化）、'none'（关闭）
+LLM_CACHE_BACKEND = os.environ.get('LLM_CACHE_BACKEND', 'memory').lower()
+LLM_CACHE_TTL = int(os.environ.get('LLM_CACHE_TTL', 24 * 3600))  # 秒
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get('LLM_CACHE_MAX_ENTRIES', 2000))
+LLM_CACHE_PATH = CACHE_FOLDER / 'llm_cache.db'
+
+# 后台任务队列配置（批量生成教案等耗时任务）
+JOB_MAX_WORKERS = int(os.environ.get('JOB_MAX_WORKERS', 2))  # 同时执行的任务数
+JOB_MAX_QUEUED = int(os.environ.get('JOB_MAX_QUEUED', 16))  # 排队等待的最大任务数，超出时拒绝提交
+JOB_RESULT_TTL = int(os.environ.get('JOB_RESULT_TTL', 24 * 3600))  # 已结束任务结果保留秒数
+JOB_RESULTS_DIR = CACHE_FOLDER / 'jobs'
+# 每个任务的token预算（0表示不限制），超出后的处理: 'abort'（终止任务）或 'downgrade'（切换到更便宜的模型）
+JOB_TOKEN_BUDGET = int(os.environ.get('JOB_TOKEN_BUDGET', 0))
+JOB_BUDGET_ACTION = os.environ.get('JOB_BUDGET_ACTION', 'abort')
+# 预算超出时的降级模型，未配置降级模型的调用直接终止
+LLM_BUDGET_FALLBACK_MODELS = {
+    'qwen-plus': 'qwen-turbo',
+}
+
+# 任务进度推送配置（Server-Sent Events）
+PROGRESS_EVENT_BUFFER = int(os.environ.get('PROGRESS_EVENT_BUFFER', 500))  # 每个任务保留的最近事件数（断线续传）
+PROGRESS_STREAM_RETENTION = int(os.environ.get('PROGRESS_STREAM_RETENTION', 3600))  # 任务结束后事件流保留秒数
+PROGRESS_SSE_HEARTBEAT = int(os.environ.get('PROGRESS_SSE_HEARTBEAT', 15))  # 心跳间隔秒数，防止代理断开空闲连接
+
 # 确保必要的目录存在
 UPLOAD_FOLDER.mkdir(parents=True, exist_ok=True)
 EXPORT_FOLDER.mkdir(parents=True, exist_ok=True)
+CACHE_FOLDER.mkdir(parents=True, exist_ok=True)
+JOB_RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+TEMPLATE_RENDER_DIR.mkdir(parents=True, exist_ok=True)
 
@@ -12,6 +12,13 @@ from docx.shared import Pt, RGBColor
 from docx.enum.text import WD_ALIGN_PARAGRAPH
 import asyncio
 
+from langchain_core.messages import HumanMessage
+
+from config.settings import ADVANCED_GENERATION_CONCURRENCY, ADVANCED_GENERATION_BATCH_MODE
+from utils.json_parser import extract_json_from_response
+from utils.docx_scanner import scan_docx_placeholders
+from utils.token_usage import TokenBudgetExceededError
+
 
 class AdvancedLessonGenerator:
     """高级教案生成器"""
@@ -96,18 +103,33 @@ class AdvancedLessonGenerator:
         'homework_student': '作业学生活动（学生的完成、提交）',
     }
     
-    def __init__(self, agent=None, progress_callback=None):
+    # 作为其他字段上下文的字段（按依赖顺序排列，后者依赖前者）
+    CONTEXT_FIELDS = ['course_name', 'chapter_section']
+    
+    # 教学环节字段的列后缀，同一环节的这些字段在批量模式下合并为一次请求
+    PHASE_SUFFIXES = ['_content', '_teacher', '_student', '_intention']
+    
+    def __init__(self, agent=None, progress_callback=None, max_concurrency: int = None,
+                 batch_mode: bool = None):
         """
         初始化高级生成器
         
         Args:
             agent: UniversityCourseAgent实例，用于调用AI生成内容
             progress_callback: 进度回调函数 callback(progress, status, log_message)
+            max_concurrency: 同时进行的占位符生成请求数上限，默认读取
+                             ADVANCED_GENERATION_CONCURRENCY
+            batch_mode: 是否将同组占位符合并为一次JSON请求，默认读取
+                        ADVANCED_GENERATION_BATCH_MODE
         """
         self.agent = agent
         self.template_path = None
         self.progress_callback = progress_callback
         self.placeholders = []
+        if max_concurrency is None:
+            max_concurrency = ADVANCED_GENERATION_CONCURRENCY
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.batch_mode = ADVANCED_GENERATION_BATCH_MODE if batch_mode is None else batch_mode
     
     def _log_progress(self, progress, status, message):
         """记录进度"""
@@ -131,21 +153,11 @@ class AdvancedLessonGenerator:
             raise FileNotFoundError(f"模板文件不存在: {template_path}")
         
         self.template_path = template_path
-        doc = Document(template_path)
-        placeholders = set()
-        
-        # 扫描段落
-        for para in doc.paragraphs:
-            matches = re.findall(r'\{\{([^}]+)\}\}', para.text)
-            placeholders.update(matches)
-        
-        # 扫描表格
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    for para in cell.paragraphs:
-                        matches = re.findall(r'\{\{([^}]+)\}\}', para.text)
-                        placeholders.update(matches)
+        
+        # 直接流式扫描正文、页眉和页脚的XML（跨run拆分的占位符同样能识别），
+        # 保留花括号内的原始写法，以便fill_template按原文精确替换
+        scan = scan_docx_placeholders(template_path)
+        placeholders = {location['raw'] for location in scan['locations']}
         
         self.placeholders = sorted(list(placeholders))
         
@@ -153,6 +165,47 @@ class AdvancedLessonGenerator:
         
         return self.placeholders
     
+    # 超短字段：姓名、班级等基本信息
+    VERY_SHORT_FIELDS = ['teacher_name', 'class_name', 'course_name', 'chapter_section']
+    # 短字段：方法、资源等
+    SHORT_FIELDS = ['teaching_methods', 'learning_methods', 'teaching_resources', 
+                    'teaching_focus', 'teaching_difficulty', 'ideological_elements']
+    # 中等字段：目标、措施等
+    MEDIUM_FIELDS = ['knowledge_goals', 'ability_goals', 'ideological_goals',
+                     'focus_solutions', 'difficulty_solutions']
+    
+    def _get_length_requirement(self, placeholder: str) -> str:
+        """根据字段类型确定长度要求"""
+        if placeholder in self.VERY_SHORT_FIELDS:
+            if placeholder == 'chapter_section':
+                return "直接生成章节名称，例如：'第三章 数据结构' 或 '2.3 函数式编程'，不超过15字，不要用列表"
+            elif placeholder == 'course_name':
+                return "直接生成课程名称，例如：'Python程序设计' 或 '数据库原理'，不超过10字，不要用列表，不要加编号"
+            else:
+                return "直接生成具体内容，不超过10个字，不要解释，不要用列表"
+        elif placeholder in self.SHORT_FIELDS:
+            return "用1-2句话简要说明，总共不超过30字"
+        elif placeholder in self.MEDIUM_FIELDS:
+            return "如果是列表，列出3-4条，每条不超过25字；如果是段落，不超过80字"
+        else:
+            return "如果是列表，列出2-3条，每条不超过30字；如果是段落，控制在60-100字"
+    
+    @staticmethod
+    def _format_context(context: Dict[str, str] = None) -> str:
+        """将上下文字段格式化为提示词片段，保持各字段内容一致"""
+        text = ""
+        if context:
+            if 'course_name' in context:
+                text += f"\n课程名称：{context['course_name']}"
+            if 'chapter_section' in context:
+                text += f"\n授课章节：{context['chapter_section']}"
+        return text
+    
+    async def _invoke_llm(self, prompt: str) -> str:
+        """使用教案生成的LLM（速度较快）生成内容"""
+        response = await self.agent.llm_lesson.ainvoke([HumanMessage(content=prompt)])
+        return response.content.strip()
+    
     async def generate_content_for_placeholder(
         self, 
         placeholder: str, 
@@ -171,36 +224,12 @@ class AdvancedLessonGenerator:
             生成的内容
         """
         description = self.PLACEHOLDER_DESCRIPTIONS.get(placeholder, placeholder)
-        
-        # 根据字段类型确定长度要求
-        # 超短字段：姓名、班级等基本信息
-        very_short_fields = ['teacher_name', 'class_name', 'course_name', 'chapter_section']
-        # 短字段：方法、资源等
-        short_fields = ['teaching_methods', 'learning_methods', 'teaching_resources', 
-                       'teaching_focus', 'teaching_difficulty', 'ideological_elements']
-        # 中等字段：目标、措施等
-        medium_fields = ['knowledge_goals', 'ability_goals', 'ideological_goals',
-                        'focus_solutions', 'difficulty_solutions']
-        
-        # 设置长度要求
-        if placeholder in very_short_fields:
-            if placeholder == 'chapter_section':
-                length_req = "直接生成章节名称，例如：'第三章 数据结构' 或 '2.3 函数式编程'，不超过15字，不要用列表"
-            elif placeholder == 'course_name':
-                length_req = "直接生成课程名称，例如：'Python程序设计' 或 '数据库原理'，不超过10字，不要用列表，不要加编号"
-            else:
-                length_req = "直接生成具体内容，不超过10个字，不要解释，不要用列表"
-        elif placeholder in short_fields:
-            length_req = "用1-2句话简要说明，总共不超过30字"
-        elif placeholder in medium_fields:
-            length_req = "如果是列表，列出3-4条，每条不超过25字；如果是段落，不超过80字"
-        else:
-            length_req = "如果是列表，列出2-3条，每条不超过30字；如果是段落，控制在60-100字"
+        length_req = self._get_length_requirement(placeholder)
         
         # 构建提示词
         # 对于简短字段，强调不要用列表
         list_instruction = ""
-        if placeholder in very_short_fields:
+        if placeholder in self.VERY_SHORT_FIELDS:
             list_instruction = "5. 不要使用列表格式，直接输出内容本身"
         else:
             list_instruction = "5. 如需列表，用数字编号（1. 2. 3.）"
@@ -220,32 +249,143 @@ class AdvancedLessonGenerator:
 """
         
         # 如果有上下文，添加到提示词中以保持一致性
-        if context:
-            if 'course_name' in context:
-                prompt += f"\n课程名称：{context['course_name']}"
-            if 'chapter_section' in context:
-                prompt += f"\n授课章节：{context['chapter_section']}"
+        prompt += self._format_context(context)
         
         prompt += f"\n\n请直接生成「{description}」的内容，不要包含字段名称："
         
         # 使用AI生成内容
         if self.agent:
             try:
-                # 使用教案生成的LLM（速度较快）
-                from langchain.schema import HumanMessage
-                response = await self.agent.llm_lesson.ainvoke([HumanMessage(content=prompt)])
-                content = response.content.strip()
-                return content
+                return await self._invoke_llm(prompt)
+            except TokenBudgetExceededError:
+                # 预算耗尽时终止整个生成，而不是用占位文本填满剩余字段
+                raise
             except Exception as e:
                 print(f"⚠️  生成 {placeholder} 时出错: {e}")
                 return f"[待填充: {description}]"
         else:
             return f"[待填充: {description}]"
     
+    async def generate_content_for_batch(
+        self,
+        placeholders: List[str],
+        topic: str,
+        context: Dict[str, str] = None
+    ) -> Dict[str, str]:
+        """
+        用一次结构化JSON请求为多个占位符生成内容
+        
+        Args:
+            placeholders: 占位符名称列表
+            topic: 教案主题
+            context: 已生成的其他内容（用于保持一致性）
+            
+        Returns:
+            成功解析的占位符到内容的映射（回复中缺失的字段不包含在内）
+        """
+        if not self.agent:
+            return {}
+        
+        field_lines = []
+        for i, placeholder in enumerate(placeholders, 1):
+            description = self.PLACEHOLDER_DESCRIPTIONS.get(placeholder, placeholder)
+            field_lines.append(
+                f"{i}. 字段名称：{placeholder}\n"
+                f"   字段说明：{description}\n"
+                f"   长度要求：{self._get_length_requirement(placeholder)}"
+            )
+        example = ", ".join(f'"{p}": "..."' for p in placeholders)
+        
+        prompt = f"""请为教案主题「{topic}」一次性生成以下 {len(placeholders)} 个字段的内容：
+
+{chr(10).join(field_lines)}
+
+要求：
+1. 内容要专业、简洁、具体
+2. 符合高等教育教学规范
+3. 与主题紧密相关，各字段之间相互呼应
+4. 如需列表，在字段值内用数字编号（1. 2. 3.）并换行分隔
+
+"""
+        prompt += self._format_context(context)
+        prompt += f"""
+
+请只返回JSON对象，键为上述字段名称，值为对应内容的字符串，不要添加markdown代码块标记或其他说明文字：
+{{{example}}}"""
+        
+        try:
+            response_text = await self._invoke_llm(prompt)
+        except TokenBudgetExceededError:
+            raise
+        except Exception as e:
+            print(f"⚠️  批量生成 {placeholders} 时出错: {e}")
+            return {}
+        
+        data = extract_json_from_response(response_text)
+        results = {}
+        for placeholder in placeholders:
+            value = data.get(placeholder) if isinstance(data, dict) else None
+            if isinstance(value, list):
+                value = "\n".join(f"{i}. {item}" for i, item in enumerate(value, 1))
+            if isinstance(value, (int, float)):
+                value = str(value)
+            if isinstance(value, str) and value.strip():
+                results[placeholder] = value.strip()
+        return results
+    
+    def _plan_units(self, fields: List[str], groups: List[List[str]]) -> List[List[str]]:
+        """
+        将字段划分为生成单元
+        
+        非批量模式下每个字段一个单元；批量模式下同一教学环节的
+        *_content/_teacher/_student/_intention 字段、以及同一分组（目标与重难点、
+        方法与资源）的字段各合并为一个单元，上下文字段始终单独生成
+        """
+        if not self.batch_mode:
+            return [[field] for field in fields]
+        
+        units = []
+        assigned = set(self.CONTEXT_FIELDS)
+        units.extend([field] for field in self.CONTEXT_FIELDS if field in fields)
+        
+        for group in groups:
+            members = [f for f in group if f in fields and f not in assigned]
+            if members:
+                units.append(members)
+                assigned.update(members)
+        
+        phases: Dict[str, List[str]] = {}
+        for field in fields:
+            if field in assigned:
+                continue
+            for suffix in self.PHASE_SUFFIXES:
+                if field.endswith(suffix):
+                    phases.setdefault(field[:-len(suffix)], []).append(field)
+                    break
+            else:
+                phases.setdefault(field, []).append(field)
+        units.extend(phases.values())
+        return units
+    
+    def _get_dependencies(self, field: str) -> List[str]:
+        """
+        获取字段生成前必须完成的上下文字段
+        
+        上下文字段之间按 CONTEXT_FIELDS 顺序依赖，其余字段依赖全部上下文字段
+        """
+        if field in self.CONTEXT_FIELDS:
+            deps = self.CONTEXT_FIELDS[:self.CONTEXT_FIELDS.index(field)]
+        else:
+            deps = self.CONTEXT_FIELDS
+        return [dep for dep in deps if dep in self.placeholders]
+    
     async def generate_all_content(self, topic: str) -> Dict[str, str]:
         """
         为所有占位符生成内容
         
+        基本信息中的上下文字段（课程名称、授课章节）先生成，其余字段在其完成后
+        并发生成，同时进行的请求数受 max_concurrency 限制
+        
         Args:
             topic: 教案主题
             
@@ -253,12 +393,10 @@ class AdvancedLessonGenerator:
             占位符到内容的映射字典
         """
         print(f"\n🤖 开始为主题「{topic}」生成内容...")
-        print(f"📝 需要生成 {len(self.placeholders)} 个字段的内容\n")
+        print(f"📝 需要生成 {len(self.placeholders)} 个字段的内容（并发数: {self.max_concurrency}）\n")
         
         self._log_progress(30, 'generating', f'🤖 开始生成内容，共需生成 {len(self.placeholders)} 个字段')
         
-        content_dict = {}
-        
         # 按优先级分组
         # 第一组：基本信息（先生成，其他内容会参考这些）
         basic_fields = ['course_name', 'chapter_section', 'class_name', 'teacher_name']
@@ -274,54 +412,169 @@ class AdvancedLessonGenerator:
         process_fields = [p for p in self.placeholders 
                          if p not in basic_fields + goals_fields + method_fields]
         
-        # 按组顺序生成
-        all_groups = [
-            ("基本信息", basic_fields),
-            ("教学目标与重难点", goals_fields),
-            ("教学方法与资源", method_fields),
-            ("教学过程", process_fields)
+        # 输出顺序与分组顺序保持一致
+        ordered_fields = [
+            field for field in basic_fields + goals_fields + method_fields + process_fields
+            if field in self.placeholders
         ]
         
-        total_fields = len(self.placeholders)
+        total_fields = len(ordered_fields)
         completed_fields = 0
-        
-        for group_name, fields in all_groups:
-            print(f"📌 生成 {group_name}...")
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        units = self._plan_units(ordered_fields, [goals_fields, method_fields])
+        unit_of: Dict[str, int] = {}
+        for index, unit in enumerate(units):
+            for field in unit:
+                unit_of[field] = index
+        futures: List[asyncio.Future] = []
+        
+        def report(field: str):
+            nonlocal completed_fields
+            # 事件循环单线程执行，计数与进度回报之间不会被打断，进度保持单调递增
+            completed_fields += 1
+            field_desc = self.PLACEHOLDER_DESCRIPTIONS.get(field, field)
             self._log_progress(
                 30 + int((completed_fields / total_fields) * 55),
                 'generating',
-                f'📌 正在生成{group_name}...'
+                f'✓ 已生成「{field_desc}」({completed_fields}/{total_fields})'
             )
+        
+        async def generate_single(field: str, context: Dict[str, str]) -> str:
+            async with semaphore:
+                content = await self.generate_content_for_placeholder(field, topic, context)
+            print(f"   ✓ {field} ({len(content)} 字符)")
+            report(field)
+            return content
+        
+        async def generate_unit(unit: List[str]) -> Dict[str, str]:
+            # 等待依赖的上下文字段生成完成（同一单元内字段的依赖相同）
+            context = {}
+            for dep in self._get_dependencies(unit[0]):
+                context[dep] = (await futures[unit_of[dep]])[dep]
             
-            for field in fields:
-                if field not in self.placeholders:
-                    continue
-                
-                field_desc = self.PLACEHOLDER_DESCRIPTIONS.get(field, field)
-                print(f"   • 生成 {field}...", end=" ")
-                
-                content = await self.generate_content_for_placeholder(
-                    field, topic, content_dict
-                )
-                
-                content_dict[field] = content
-                completed_fields += 1
-                
-                progress = 30 + int((completed_fields / total_fields) * 55)
-                print(f"✓ ({len(content)} 字符)")
-                self._log_progress(
-                    progress,
-                    'generating',
-                    f'✓ 已生成「{field_desc}」({completed_fields}/{total_fields})'
-                )
+            if len(unit) == 1:
+                return {unit[0]: await generate_single(unit[0], context)}
             
-            print()
-        
-        print(f"✅ 所有内容生成完成！")
+            async with semaphore:
+                results = await self.generate_content_for_batch(unit, topic, context)
+            for field in unit:
+                if field in results:
+                    print(f"   ✓ {field} ({len(results[field])} 字符，批量)")
+                    report(field)
+            
+            # 回复中缺失的字段回退为单字段请求
+            missing = [field for field in unit if field not in results]
+            if missing:
+                print(f"   ↻ 批量回复缺少 {missing}，回退为单字段生成")
+                contents = await asyncio.gather(*(generate_single(f, context) for f in missing))
+                results.update(zip(missing, contents))
+            return results
+        
+        print(f"📌 生成 基本信息...")
+        self._log_progress(30, 'generating', '📌 正在生成基本信息...')
+        
+        # 先创建全部任务再开始等待，保证依赖查找时对应的 future 已存在
+        for unit in units:
+            futures.append(asyncio.ensure_future(generate_unit(unit)))
+        
+        context_futures = {futures[unit_of[f]] for f in self.CONTEXT_FIELDS if f in unit_of}
+        try:
+            if context_futures:
+                await asyncio.gather(*context_futures)
+            
+            print(f"📌 并发生成其余字段（{len(units)} 个生成单元）...")
+            self._log_progress(
+                30 + int((completed_fields / total_fields) * 55) if total_fields else 30,
+                'generating',
+                '📌 正在并发生成教学目标、方法资源与教学过程...'
+            )
+            
+            await asyncio.gather(*futures)
+        finally:
+            for future in futures:
+                if not future.done():
+                    future.cancel()
+        
+        generated = {}
+        for future in futures:
+            generated.update(future.result())
+        content_dict = {field: generated[field] for field in ordered_fields}
+        
+        print(f"\n✅ 所有内容生成完成！")
         self._log_progress(85, 'filling', '✅ 所有内容生成完成！开始填充模板...')
         
         return content_dict
     
+    @classmethod
+    def _iter_table_paragraphs(cls, table):
+        """遍历表格（含嵌套表格）中的段落；合并单元格在row.cells中会重复出现，只访问一次"""
+        visited = set()
+        for row in table.rows:
+            for cell in row.cells:
+                if cell._tc in visited:
+                    continue
+                visited.add(cell._tc)
+                yield from cell.paragraphs
+                for nested in cell.tables:
+                    yield from cls._iter_table_paragraphs(nested)
+    
+    @staticmethod
+    def _iter_header_footer_parts(doc):
+        """遍历各节中实际定义的页眉页脚（链接到上一节的不重复处理）"""
+        seen = set()
+        for section in doc.sections:
+            for part in (section.header, section.first_page_header, section.even_page_header,
+                         section.footer, section.first_page_footer, section.even_page_footer):
+                if part.is_linked_to_previous:
+                    continue
+                element = part._element
+                if element in seen:
+                    continue
+                seen.add(element)
+                yield part
+    
+    @staticmethod
+    def _replace_in_paragraph(para, pattern, content_dict: Dict[str, str], location: str) -> int:
+        """
+        替换段落中的占位符，返回替换次数
+        
+        有替换时清空段落的所有run，用第一个run（保留字体、字号）写入新文本并设为黑色
+        """
+        original_text = para.text
+        if '{{' not in original_text:
+            return 0
+        
+        replaced = []
+        
+        def substitute(match):
+            replaced.append(match.group(1))
+            return content_dict[match.group(1)]
+        
+        new_text = pattern.sub(substitute, original_text)
+        if not replaced:
+            return 0
+        for placeholder in replaced:
+            print(f"   ✓ 替换{location}中的 {{{{{placeholder}}}}}")
+        
+        # 保存第一个run的格式（字体、大小等，但不包括颜色）
+        first_run = para.runs[0] if para.runs else None
+        
+        # 清空所有runs
+        for run in para.runs:
+            run.text = ''
+        
+        # 写入新文本
+        if first_run is not None:
+            first_run.text = new_text
+            # 明确设置为黑色字体
+            if first_run.font.color.rgb is not None:
+                first_run.font.color.rgb = RGBColor(0, 0, 0)
+        else:
+            new_run = para.add_run(new_text)
+            # 设置为黑色字体
+            new_run.font.color.rgb = RGBColor(0, 0, 0)
+        return len(replaced)
+    
     def fill_template(
         self, 
         content_dict: Dict[str, str], 
@@ -347,74 +600,30 @@ class AdvancedLessonGenerator:
         
         replacements_made = 0
         
-        # 替换段落中的占位符
-        for para in doc.paragraphs:
-            original_text = para.text
-            new_text = original_text
+        # 所有占位符合并为一个预编译的正则，每个段落只扫描一次，按匹配到的名称查表替换
+        pattern = None
+        if content_dict:
+            pattern = re.compile(
+                r'\{\{(' + '|'.join(re.escape(placeholder) for placeholder in content_dict) + r')\}\}'
+            )
+        
+        if pattern is not None:
+            # 替换段落中的占位符
+            for para in doc.paragraphs:
+                replacements_made += self._replace_in_paragraph(para, pattern, content_dict, '段落')
             
-            # 对每个占位符进行替换
-            for placeholder, content in content_dict.items():
-                pattern = r'\{\{' + re.escape(placeholder) + r'\}\}'
-                if re.search(pattern, new_text):
-                    new_text = re.sub(pattern, content, new_text)
-                    replacements_made += 1
-                    print(f"   ✓ 替换段落中的 {{{{{placeholder}}}}}")
+            # 替换表格中的占位符
+            for table in doc.tables:
+                for para in self._iter_table_paragraphs(table):
+                    replacements_made += self._replace_in_paragraph(para, pattern, content_dict, '表格')
             
-            # 如果文本有变化，清空段落并重新写入
-            if new_text != original_text:
-                # 保存第一个run的格式（字体、大小等，但不包括颜色）
-                first_run = para.runs[0] if para.runs else None
-                
-                # 清空所有runs
-                for run in para.runs:
-                    run.text = ''
-                
-                # 写入新文本
-                if first_run is not None:
-                    first_run.text = new_text
-                    # 明确设置为黑色字体
-                    if first_run.font.color.rgb is not None:
-                        first_run.font.color.rgb = RGBColor(0, 0, 0)
-                else:
-                    new_run = para.add_run(new_text)
-                    # 设置为黑色字体
-                    new_run.font.color.rgb = RGBColor(0, 0, 0)
-        
-        # 替换表格中的占位符
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    for para in cell.paragraphs:
-                        original_text = para.text
-                        new_text = original_text
-                        
-                        # 对每个占位符进行替换
-                        for placeholder, content in content_dict.items():
-                            pattern = r'\{\{' + re.escape(placeholder) + r'\}\}'
-                            if re.search(pattern, new_text):
-                                new_text = re.sub(pattern, content, new_text)
-                                replacements_made += 1
-                                print(f"   ✓ 替换表格中的 {{{{{placeholder}}}}}")
-                        
-                        # 如果文本有变化，清空段落并重新写入
-                        if new_text != original_text:
-                            # 保存第一个run的格式（字体、大小等，但不包括颜色）
-                            first_run = para.runs[0] if para.runs else None
-                            
-                            # 清空所有runs
-                            for run in para.runs:
-                                run.text = ''
-                            
-                            # 写入新文本
-                            if first_run is not None:
-                                first_run.text = new_text
-                                # 明确设置为黑色字体
-                                if first_run.font.color.rgb is not None:
-                                    first_run.font.color.rgb = RGBColor(0, 0, 0)
-                            else:
-                                new_run = para.add_run(new_text)
-                                # 设置为黑色字体
-                                new_run.font.color.rgb = RGBColor(0, 0, 0)
+            # 替换页眉页脚中的占位符（analyze_template同样会扫描页眉页脚）
+            for part in self._iter_header_footer_parts(doc):
+                for para in part.paragraphs:
+                    replacements_made += self._replace_in_paragraph(para, pattern, content_dict, '页眉页脚')
+                for table in part.tables:
+                    for para in self._iter_table_paragraphs(table):
+                        replacements_made += self._replace_in_paragraph(para, pattern, content_dict, '页眉页脚')
         
         # 保存文件
         doc.save(output_path)
@@ -476,8 +685,8 @@ class AdvancedLessonGenerator:
             
             self._log_progress(10, 'uploading', f'📤 开始分析模板: {os.path.basename(template_path)}')
             
-            # 步骤1：分析模板
-            self.analyze_template(template_path)
+            # 步骤1：分析模板（同步的文档解析放到线程中执行，避免阻塞共享事件循环）
+            await asyncio.to_thread(self.analyze_template, template_path)
             self._log_progress(20, 'analyzing', f'🔍 模板分析完成，发现 {len(self.placeholders)} 个占位符')
             
             # 步骤2：生成所有内容
@@ -485,7 +694,7 @@ class AdvancedLessonGenerator:
             
             # 步骤3：填充模板
             self._log_progress(85, 'filling', '⚙️ 正在将内容填充到模板...')
-            final_path = self.fill_template(content_dict, str(output_path))
+            final_path = await asyncio.to_thread(self.fill_template, content_dict, str(output_path))
             
             print()
             print("=" * 80)
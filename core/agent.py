@@ -1,44 +1,53 @@
 """Core agent for university course planning - 修复版本"""
 
 import json
-import base64
+import hashlib
 import re
-from typing import Dict, List
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import ExitStack
+from typing import AsyncIterator, Dict, List, Optional
 from pathlib import Path
 
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
 from langchain_community.chat_models import ChatTongyi
 
 from config import DEFAULT_TEMPLATE_STRUCTURE
+from config.settings import (
+    LESSON_GENERATION_CONCURRENCY, LESSON_PROMPT_COMPACT, LESSON_PROMPT_PREFIX_LAYOUT, TEMPLATE_CACHE_ENABLED,
+    TEMPLATE_ANALYSIS_MODE, TEMPLATE_STRUCTURE_ANALYSIS_ENABLED, TEMPLATE_STRUCTURE_MIN_CONFIDENCE
+)
 from utils.template_converter import TemplateConverter
+from utils.docx_structure_analyzer import analyze_docx_structure
+from utils.template_cache import TemplateAnalysisCache
+from utils.llm_cache import CachedChatModel, get_llm_cache
+from utils.llm_policy import ResilientChatModel, provider_request_timeout
 from utils.json_parser import extract_json_from_response
+from utils.latency_stats import record_latency
+from utils.token_counter import estimate_text_tokens
+from utils.vlm_image import prepare_vlm_images
+from utils.async_runner import run_async
 
 
 class UniversityCourseAgent:
     """Main agent for university lesson plan generation"""
     
+    # 模板分析提示词版本，修改VLM提示词或分析流程时需递增以使模板缓存失效
+    TEMPLATE_PROMPT_VERSION = "v2"
+    # 视觉分析方式: single（单次调用，失败时改用两步）/ two_step（先描述再提取JSON）
+    TEMPLATE_ANALYSIS_MODES = ("single", "two_step")
+    
     def __init__(self, api_key: str):
         """Initialize the university course agent"""
         self.api_key = api_key
         # 大纲生成使用最好的模型
-        self.llm_outline = ChatTongyi(
-            dashscope_api_key=api_key,
-            model_name="qwen-plus"
-        )
+        self.llm_outline = self._create_llm("qwen-plus")
         # 教案生成使用快速的模型
-        self.llm_lesson = ChatTongyi(
-            dashscope_api_key=api_key,
-            model_name="qwen-turbo"
-        )
+        self.llm_lesson = self._create_llm("qwen-turbo")
         # 通用对话使用中等模型
-        self.llm_chat = ChatTongyi(
-            dashscope_api_key=api_key,
-            model_name="qwen-turbo"
-        )
-        self.vlm = ChatTongyi(
-            dashscope_api_key=api_key,
-            model_name="qwen-vl-plus"
-        )
+        self.llm_chat = self._create_llm("qwen-turbo")
+        self.vlm = self._create_llm("qwen-vl-plus")
         self.conversation_history = []
         self.template_keywords = {}
         self.course_outline = None
@@ -48,14 +57,110 @@ class UniversityCourseAgent:
         self.template_mode = "text"  # "text" 或 "tags"
         self.template_file_path = None
         self.detected_tags = []
+        self.template_analysis_mode = TEMPLATE_ANALYSIS_MODE
+        # 模板分析结果缓存（按文件内容SHA-256 + 提示词版本）
+        self.template_cache = TemplateAnalysisCache() if TEMPLATE_CACHE_ENABLED else None
+        # 精简提示词使用的模板字段清单（按模板结构摘要LRU缓存，同一模板的所有课次复用）
+        self._template_schemas: "OrderedDict[str, Dict]" = OrderedDict()
+
+    def _create_llm(self, model_name: str):
+        """创建模型客户端：统一套用调用策略（超时/重试/熔断），启用响应缓存时再包装为CachedChatModel"""
+        llm = ChatTongyi(
+            dashscope_api_key=self.api_key,
+            model_name=model_name,
+            max_retries=1,  # 重试由ResilientChatModel统一控制，避免与SDK内置重试叠加
+            # SDK请求与调用策略使用同样的超时，超时后执行器线程随之返回而不是一直占用
+            model_kwargs={'request_timeout': provider_request_timeout(model_name)}
+        )
+        llm = ResilientChatModel(llm)
+        cache = get_llm_cache()
+        return CachedChatModel(llm, cache) if cache is not None else llm
+
+    def _load_cached_template(self, file_path: str, digest: str) -> Dict:
+        """从模板缓存恢复解析结果，未命中时返回None"""
+        if not self.template_cache or not digest:
+            return None
+        
+        entry = self.template_cache.get(digest, self.TEMPLATE_PROMPT_VERSION)
+        if not entry:
+            return None
+        
+        print(f"⚡ 命中模板缓存: {digest[:12]}（跳过转换与视觉分析）")
+        result = entry.get('template_structure')
+        if entry.get('mode') == 'tags':
+            self.template_mode = "tags"
+            self.template_file_path = file_path
+            self.detected_tags = entry.get('tag_info', {}).get('recognized_tags', [])
+            result['tag_info'] = entry.get('tag_info', {})
+        else:
+            self.template_mode = "text"
+            self.template_keywords = {k: v for k, v in result.items() if k != 'mode'}
+        return result
+
+    def _store_cached_template(self, digest: str, mode: str, template_structure: Dict,
+                               tag_info: Dict = None):
+        """将解析结果写入模板缓存（写入失败不影响解析流程）"""
+        if not self.template_cache or not digest:
+            return
+        try:
+            self.template_cache.put(digest, self.TEMPLATE_PROMPT_VERSION, {
+                'mode': mode,
+                'template_structure': template_structure,
+                'tag_info': tag_info or {}
+            })
+        except Exception as e:
+            print(f"⚠️  模板缓存写入失败: {e}")
 
-    def extract_template_keywords(self, file_path: str) -> Dict:
-        """Extract template keywords using VLM (supports DOC/DOCX conversion)"""
+    # 模板解析的进度步骤: 标签检测、结构化分析、转换图片、视觉分析
+    TEMPLATE_PARSE_STEPS = 4
+    # 精简提示词字段清单的缓存数量（每个Agent通常只使用少数几个模板）
+    TEMPLATE_SCHEMA_CACHE_SIZE = 8
+    
+    def extract_template_keywords(self, file_path: str, analysis_mode: str = None) -> Dict:
+        """
+        Extract template keywords using VLM (supports DOC/DOCX conversion)
+        
+        Synchronous wrapper of aextract_template_keywords for non-async callers;
+        runs on the shared background loop, so it must not be called from
+        inside that loop.
+        
+        analysis_mode: "single" or "two_step", defaults to TEMPLATE_ANALYSIS_MODE
+        """
+        return run_async(self.aextract_template_keywords(file_path, analysis_mode))
+    
+    async def aextract_template_keywords(self, file_path: str, analysis_mode: str = None,
+                                         progress_callback=None) -> Dict:
+        """
+        Extract template keywords without blocking the event loop
+        
+        File hashing, tag detection, structural analysis and rasterization run
+        in worker threads (asyncio.to_thread); VLM calls use ainvoke.
+        
+        Args:
+            file_path: Template file path
+            analysis_mode: "single" or "two_step", defaults to TEMPLATE_ANALYSIS_MODE
+            progress_callback: callback(current, total, message) per parsing step
+        """
+        def report(step: int, message: str):
+            if progress_callback:
+                progress_callback(step, self.TEMPLATE_PARSE_STEPS, message)
+        
+        # 渲染出的页面图片只在本次解析中使用，结束后（含异常）删除
+        render_dirs = ExitStack()
         try:
             # Check file type
             file_extension = Path(file_path).suffix.lower()
             image_paths = []
             
+            # 相同内容的模板直接复用缓存结果
+            digest = None
+            if self.template_cache:
+                digest = await asyncio.to_thread(TemplateAnalysisCache.file_digest, file_path)
+                cached = await asyncio.to_thread(self._load_cached_template, file_path, digest)
+                if cached is not None:
+                    report(self.TEMPLATE_PARSE_STEPS, '命中模板缓存')
+                    return cached
+            
             if file_extension in ['.doc', '.docx']:
                 print(f"🔍 检测到Word文档，开始检测模板类型...")
                 print(f"   文件路径: {file_path}")
@@ -65,7 +170,8 @@ class UniversityCourseAgent:
                 try:
                     from utils.template_filler import WordTemplateFiller
                     filler = WordTemplateFiller()
-                    tag_info = filler.check_template_tags(file_path)
+                    report(1, '检测模板标签')
+                    tag_info = await asyncio.to_thread(filler.check_template_tags, file_path)
                     
                     if tag_info.get('success') and tag_info.get('has_tags'):
                         # 发现XML标签
@@ -81,6 +187,12 @@ class UniversityCourseAgent:
                             print(f"   ⚠️  未识别标签: {tag_info.get('unrecognized_tags')[:5]}")
                         
                         # 返回标签信息作为模板结构
+                        await asyncio.to_thread(self._store_cached_template, digest, 'tags', {
+                            'template_type': 'xml_tags',
+                            'mode': 'tags',
+                            'tags': self.detected_tags
+                        }, tag_info)
+                        report(self.TEMPLATE_PARSE_STEPS, '检测到标签模板')
                         return {
                             'template_type': 'xml_tags',
                             'mode': 'tags',
@@ -88,7 +200,7 @@ class UniversityCourseAgent:
                             'tag_info': tag_info
                         }
                     else:
-                        print(f"📝 未检测到XML标签，使用传统视觉识别方式")
+                        print(f"📝 未检测到XML标签，按文本模板分析")
                         self.template_mode = "text"
                 except Exception as tag_error:
                     import traceback
@@ -100,14 +212,22 @@ class UniversityCourseAgent:
                         print(f"   💡 建议: 用Microsoft Word或WPS重新保存为.docx")
                     self.template_mode = "text"
                 
+                # ========== 结构化分析：直接读取表格结构，置信度足够时跳过视觉模型 ==========
+                if file_extension == '.docx' and TEMPLATE_STRUCTURE_ANALYSIS_ENABLED:
+                    report(2, '分析表格结构')
+                    result = await asyncio.to_thread(self._analyze_docx_structure, file_path)
+                    if result is not None:
+                        await asyncio.to_thread(self._store_cached_template, digest, 'text', result)
+                        report(self.TEMPLATE_PARSE_STEPS, '已从表格结构解析模板')
+                        return result
+                
                 # ========== 传统视觉识别方式 ==========
                 print(f"🖼️  转换为图片进行视觉分析...")
-                image_paths = TemplateConverter.convert_to_images(file_path)
-                
-                # 修改点1: 正确保存图片路径列表
-                with open("image_paths.txt", "w", encoding="utf-8") as file:
-                    for path in image_paths:
-                        file.write(f"{str(path)}\n")  # 确保每个路径单独写入
+                report(3, '转换为图片')
+                render_dir = render_dirs.enter_context(TemplateConverter.render_job_dir())
+                image_paths = await asyncio.to_thread(
+                    TemplateConverter.convert_to_images, file_path, output_dir=render_dir
+                )
                 
                 if not image_paths:
                     print("Document conversion failed, returning default template structure")
@@ -123,8 +243,14 @@ class UniversityCourseAgent:
             
             # 修改点2: 分析所有页面图片
             if image_paths:
-                result = self._analyze_all_template_images(image_paths)
+                report(4, '视觉模型分析模板')
+                result = await self._aanalyze_all_template_images(image_paths, analysis_mode)
+                if result is DEFAULT_TEMPLATE_STRUCTURE:
+                    # 分析失败时不缓存，也不修改共享的默认结构
+                    return result
                 result['mode'] = 'text'  # 标记为文本模式
+                await asyncio.to_thread(self._store_cached_template, digest, 'text', result)
+                report(self.TEMPLATE_PARSE_STEPS, '模板解析完成')
                 return result
             else:
                 return DEFAULT_TEMPLATE_STRUCTURE
@@ -133,40 +259,95 @@ class UniversityCourseAgent:
             print(f"Template parsing error: {e}")
             self.template_mode = "text"
             return DEFAULT_TEMPLATE_STRUCTURE
+        finally:
+            # 删除本次渲染的页面图片（文件很少，取消时也要执行，直接在当前线程完成）
+            render_dirs.close()
     
-    def _analyze_all_template_images(self, image_paths: List[str]) -> Dict:
+    def _analyze_docx_structure(self, file_path: str) -> Optional[Dict]:
+        """从.docx的表格结构生成模板结构，置信度低于TEMPLATE_STRUCTURE_MIN_CONFIDENCE时返回None"""
+        started = time.perf_counter()
+        try:
+            analysis = analyze_docx_structure(file_path)
+        except Exception as e:
+            print(f"⚠️  结构化分析失败，使用视觉识别: {e}")
+            analysis = None
+        elapsed = time.perf_counter() - started
+        
+        confident = analysis is not None and analysis['confidence'] >= TEMPLATE_STRUCTURE_MIN_CONFIDENCE
+        record_latency('template_analysis', 'structure', elapsed, success=confident)
+        if analysis is None:
+            return None
+        
+        signals = analysis['signals']
+        print(f"📐 结构化分析: 置信度 {analysis['confidence']:.2f}（{signals['rows_recognized']}/{signals['rows']} 行已识别，"
+              f"{signals['phases']} 个教学阶段、{signals['stages']} 个环节，{elapsed:.2f}s）")
+        if not confident:
+            print(f"   置信度低于 {TEMPLATE_STRUCTURE_MIN_CONFIDENCE}，改用视觉识别")
+            return None
+        
+        result = analysis['template_structure']
+        self.template_mode = "text"
+        self.template_keywords = dict(result)
+        result['mode'] = 'text'  # 标记为文本模式
+        return result
+    
+    def _analyze_all_template_images(self, image_paths: List[str], analysis_mode: str = None) -> Dict:
+        """同步调用 _aanalyze_all_template_images（不能在后台事件循环内调用）"""
+        return run_async(self._aanalyze_all_template_images(image_paths, analysis_mode))
+    
+    async def _aanalyze_all_template_images(self, image_paths: List[str], analysis_mode: str = None) -> Dict:
         """
-        修改点3: 新方法 - 分析所有模板图片页面（两步提示法）
+        修改点3: 新方法 - 分析所有模板图片页面
         分析多页模板图片，综合提取完整结构信息
+        
+        analysis_mode:
+            'single'   - 一次调用直接输出结构化JSON，JSON提取失败时自动改用两步分析
+            'two_step' - 先让VLM描述模板内容，再基于描述输出JSON（两次调用）
+            默认使用 self.template_analysis_mode（TEMPLATE_ANALYSIS_MODE）
         """
         try:
-            # 准备所有图片的base64数据
-            images_data = []
-            for i, image_path in enumerate(image_paths):
-                try:
-                    with open(image_path, "rb") as f:
-                        image_data = base64.b64encode(f.read()).decode()
-                        images_data.append({
-                            "page": i + 1,
-                            "data": image_data
-                        })
-                    print(f"成功读取第 {i+1} 页图片")
-                except Exception as e:
-                    print(f"读取第 {i+1} 页图片失败: {e}")
-                    continue
+            # 按视觉模型的输入分辨率缩小并重新编码，每页只编码一次，两步分析共用同一份图片内容
+            images_data = await asyncio.to_thread(prepare_vlm_images, image_paths)
             
             if not images_data:
                 print("没有成功读取任何图片，使用默认模板")
                 return DEFAULT_TEMPLATE_STRUCTURE
             
+            original_kb = sum(img['original_bytes'] for img in images_data) / 1024
+            prepared_kb = sum(img['bytes'] for img in images_data) / 1024
+            print(f"🗜️  图片预处理: {original_kb:.0f} KB → {prepared_kb:.0f} KB")
+            
             # 构建包含所有图片的消息内容
-            message_content_base = []
-            for img_data in images_data:
-                message_content_base.append({
-                    "image": f"data:image/png;base64,{img_data['data']}"
-                })
+            message_content_base = [{"image": img['data_url']} for img in images_data]
+            
+            system_msg = SystemMessage(content="""你是一个专业的教案模板分析专家。
+            请仔细观察表格的每一个单元格，包括：
+            - 表格的行标题和列标题
+            - 单元格中的文字内容和示例
+            - 时间标注（如"5分钟"、"X分钟"）
+            - 环节的层级关系（主环节和子环节）
+            
+            描述时要详细、准确，不要遗漏任何字段。""")
+            
+            mode = analysis_mode or self.template_analysis_mode
             
-            # 【可选】步骤1：先让VLM详细描述看到的内容（增强理解）
+            # 单次调用：直接要求结构化JSON，只有JSON提取失败时才改用两步分析
+            if mode == 'single':
+                print(f"正在使用VLM分析 {len(images_data)} 页模板图片（单次调用）...")
+                started = time.perf_counter()
+                result = await self._aextract_template_json(system_msg, message_content_base, len(images_data))
+                elapsed = time.perf_counter() - started
+                record_latency('template_analysis', 'single', elapsed, success=result is not None)
+                single_elapsed = elapsed
+                if result is not None:
+                    print(f"成功分析模板（单次调用 {elapsed:.1f}s），提取了 {len(result.keys())} 个结构字段")
+                    self.template_keywords = result
+                    return result
+                print(f"⚠️  单次调用未得到有效JSON（{elapsed:.1f}s），改用两步分析")
+            
+            started = time.perf_counter()
+            
+            # 步骤1：先让VLM详细描述看到的内容（增强理解）
             print("步骤1: 让VLM详细描述模板结构...")
             description_prompt = f"""
             请详细描述这{len(images_data)}页教案模板图片中的内容：
@@ -189,31 +370,72 @@ class UniversityCourseAgent:
             请用文字详细描述，不要遗漏任何字段名称。
             """
             
-            from langchain_core.messages import SystemMessage
-            system_msg = SystemMessage(content="""你是一个专业的教案模板分析专家。
-            请仔细观察表格的每一个单元格，包括：
-            - 表格的行标题和列标题
-            - 单元格中的文字内容和示例
-            - 时间标注（如"5分钟"、"X分钟"）
-            - 环节的层级关系（主环节和子环节）
-            
-            描述时要详细、准确，不要遗漏任何字段。""")
-            
             message_content_step1 = [{"text": description_prompt}] + message_content_base
-            description_response = self.vlm.invoke([system_msg, HumanMessage(content=message_content_step1)])
+            description_response = await self.vlm.ainvoke([system_msg, HumanMessage(content=message_content_step1)])
             
             print(f"VLM描述结果: {description_response.content[:500]}...")
             
-            # 保存描述结果
-            with open("vlm_description.txt", "w", encoding="utf-8") as file:
-                file.write(str(description_response.content))
-            
             # 步骤2：基于描述结果，要求结构化输出
             print("步骤2: 要求VLM输出结构化JSON...")
+            result = await self._aextract_template_json(system_msg, message_content_base, len(images_data),
+                                                        description=str(description_response.content))
+            elapsed = time.perf_counter() - started
+            record_latency('template_analysis', 'two_step', elapsed, success=result is not None)
+            if mode == 'single':
+                # 单次调用失败后回退的总耗时（两次尝试合计）
+                record_latency('template_analysis', 'single_fallback', single_elapsed + elapsed,
+                               success=result is not None)
+            
+            if result is not None:
+                print(f"成功分析模板（两步分析 {elapsed:.1f}s），提取了 {len(result.keys())} 个结构字段")
+                self.template_keywords = result
+                return result
+            else:
+                print("JSON提取失败，使用默认模板")
+                return DEFAULT_TEMPLATE_STRUCTURE
             
-            # 构建包含所有页面的详细分析提示
-            prompt = f"""
-            请仔细分析这个大学教案模板的所有{len(images_data)}页图片。这是一个表格式教案模板，请按照表格中的实际字段和层级结构提取信息。
+        except Exception as e:
+            print(f"Image analysis error: {e}")
+            import traceback
+            traceback.print_exc()  # 打印详细错误堆栈
+            return DEFAULT_TEMPLATE_STRUCTURE
+    
+    async def _aextract_template_json(self, system_msg: SystemMessage, image_content: List[Dict],
+                                      page_count: int, description: str = None) -> Optional[Dict]:
+        """请求VLM输出模板结构JSON，JSON提取失败时返回None"""
+        prompt = self._build_template_json_prompt(page_count, description)
+        
+        # 构建包含所有图片的消息内容
+        message_content = [{"text": prompt}] + image_content
+        
+        print(f"正在使用VLM分析 {page_count} 页模板图片（结构化输出）...")
+        response = await self.vlm.ainvoke([system_msg, HumanMessage(content=message_content)])
+        
+        # 提取JSON结果（提取失败时解析器返回默认模板结构）
+        result = extract_json_from_response(response.content)
+        if not isinstance(result, dict) or not result or result is DEFAULT_TEMPLATE_STRUCTURE:
+            print(f"VLM响应中未能提取JSON: {str(response.content)[:500]}...")
+            return None
+        return result
+    
+    @staticmethod
+    def _build_template_json_prompt(page_count: int, description: str = None) -> str:
+        """
+        模板结构JSON提取提示词
+        
+        Args:
+            page_count: 模板页数
+            description: 两步分析中第一步的描述结果；单次调用时为None，改为在提示词中列出核对要点
+        """
+        if description:
+            reference = f"""**参考刚才的描述结果**：
+            {description[:1000]}"""
+        else:
+            reference = """**分析时请逐页核对**：封面上的所有字段；表格的主要部分、每部分的标题和子环节、列标题；
+            教学过程各阶段及其环节和时间标注；思政、AI助教/智慧课堂等特殊字段；教学目标的分类。"""
+        
+        return f"""
+            请仔细分析这个大学教案模板的所有{page_count}页图片。这是一个表格式教案模板，请按照表格中的实际字段和层级结构提取信息。
 
             **分析要求**：
             1. 仔细观察表格的每一行，提取所有字段名称
@@ -229,7 +451,7 @@ class UniversityCourseAgent:
                     "institution": "学校名称（从页眉或LOGO识别）",
                     "template_type": "教案类型",
                     "academic_year": "学年学期信息",
-                    "pages_analyzed": {len(images_data)}
+                    "pages_analyzed": {page_count}
                 }},
                 
                 "cover_page": {{
@@ -407,8 +629,7 @@ class UniversityCourseAgent:
                 ]
             }}
             
-            **参考刚才的描述结果**：
-            {description_response.content[:1000]}
+            {reference}
             
             **重要提示**：
             1. 请严格按照表格中的实际字段名称提取，不要改动或简化
@@ -420,33 +641,6 @@ class UniversityCourseAgent:
             7. 如果某些字段不清晰，请在对应位置注明"待确认"
             8. 只返回JSON，不要添加markdown代码块标记或其他说明文字
             """
-            
-            # 构建包含所有图片的消息内容
-            message_content_step2 = [{"text": prompt}] + message_content_base
-            
-            print(f"正在使用VLM分析 {len(images_data)} 页模板图片（结构化输出）...")
-            response = self.vlm.invoke([system_msg, HumanMessage(content=message_content_step2)])
-            
-            # 修改点4: 确保响应内容正确保存
-            with open("vlm_response.txt", "w", encoding="utf-8") as file:
-                file.write(str(response.content))  # 使用str()确保是字符串
-            
-            # 提取JSON结果
-            result = extract_json_from_response(response.content)
-            
-            if result:
-                print(f"成功分析模板，提取了 {len(result.keys())} 个结构字段")
-                self.template_keywords = result
-                return result
-            else:
-                print("JSON提取失败，使用默认模板")
-                return DEFAULT_TEMPLATE_STRUCTURE
-            
-        except Exception as e:
-            print(f"Image analysis error: {e}")
-            import traceback
-            traceback.print_exc()  # 打印详细错误堆栈
-            return DEFAULT_TEMPLATE_STRUCTURE
     
     def _analyze_template_image(self, image_path: str) -> Dict:
         """
@@ -551,7 +745,7 @@ class UniversityCourseAgent:
         """
         print(f"📊 使用标签模式生成教案（检测到 {len(detected_tags)} 个标签）")
         
-        prompt = f"""
+        header = f"""
 请根据以下信息生成一份完整的大学教案内容，以JSON格式返回。
 
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -560,15 +754,9 @@ class UniversityCourseAgent:
 课程名称：{self.course_outline.get('course_info', {}).get('course_name', '')}
 课程性质：{self.course_outline.get('course_info', {}).get('course_type', '')}
 授课对象：{self.course_outline.get('course_info', {}).get('target_students', '')}
-
-【本次课信息】
-章节标题：{lesson_info.get('title', '')}
-课程类型：{lesson_info.get('type', '')}
-学时：{lesson_info.get('hours', 2)}学时
-知识点：{', '.join(lesson_info.get('knowledge_points', []))}
-教学重点：{', '.join(lesson_info.get('key_points', []))}
-教学难点：{', '.join(lesson_info.get('difficult_points', []))}
-
+"""
+        lesson_block = self._format_lesson_info(lesson_info)
+        shared = f"""
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 【二、需要填充的标签列表】
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -622,9 +810,12 @@ class UniversityCourseAgent:
 5. 教学过程要分阶段、有时间安排
 6. 思政元素要自然融入，不生硬
 7. 不包含具体学校名称和教师姓名
-
-现在请生成JSON：
 """
+        if LESSON_PROMPT_PREFIX_LAYOUT:
+            # 课程共用部分在前、本次课信息在后，同一课程各课次的提示词前缀一致
+            prompt = f"{header}{shared}\n{lesson_block}\n现在请生成JSON：\n"
+        else:
+            prompt = f"{header}\n{lesson_block}{shared}\n现在请生成JSON：\n"
         
         response = await self.llm_lesson.ainvoke([HumanMessage(content=prompt)])
         
@@ -645,9 +836,200 @@ class UniversityCourseAgent:
             print(f"响应内容: {response.content[:500]}")
             return {"error": f"教案生成失败: {str(e)}"}
     
+    @staticmethod
+    def _format_lesson_info(lesson_info: Dict) -> str:
+        """本次课信息（提示词中随课次变化的部分）"""
+        return f"""【本次课信息】
+章节标题：{lesson_info.get('title', '')}
+课程类型：{lesson_info.get('type', '')}
+学时：{lesson_info.get('hours', 2)}学时
+知识点：{', '.join(lesson_info.get('knowledge_points', []))}
+教学重点：{', '.join(lesson_info.get('key_points', []))}
+教学难点：{', '.join(lesson_info.get('difficult_points', []))}
+"""
+
     async def generate_university_lesson_plan(self, lesson_info: Dict, template_structure: Dict, 
                                         additional_requirements: str = "") -> str:
         """Generate university lesson plan with dynamic template adaptation - 动态适配版"""
+        prompt = self._build_university_lesson_prompt(lesson_info, template_structure, additional_requirements)
+        response = await self.llm_lesson.ainvoke([HumanMessage(content=prompt)])
+        return response.content
+
+    async def stream_university_lesson_plan(self, lesson_info: Dict, template_structure: Dict,
+                                            additional_requirements: str = "") -> AsyncIterator[str]:
+        """流式生成教案，逐段产出模型输出的文本片段（与generate_university_lesson_plan使用相同提示词）"""
+        prompt = self._build_university_lesson_prompt(lesson_info, template_structure, additional_requirements)
+        async for chunk in self.llm_lesson.astream([HumanMessage(content=prompt)]):
+            if chunk.content:
+                yield chunk.content
+
+    def _build_university_lesson_prompt(self, lesson_info: Dict, template_structure: Dict,
+                                        additional_requirements: str = "") -> str:
+        """构建教案生成提示词（LESSON_PROMPT_COMPACT开启时使用精简版）"""
+        if LESSON_PROMPT_COMPACT:
+            return self._build_compact_lesson_prompt(lesson_info, template_structure, additional_requirements)
+        return self._build_full_lesson_prompt(lesson_info, template_structure, additional_requirements)
+
+    @staticmethod
+    def _extract_process_columns(process_section: Dict) -> List[str]:
+        """自动提取教学过程表格的列结构"""
+        columns = []
+        
+        for key, phase in process_section.items():
+            if not isinstance(phase, dict):
+                continue
+            
+            stages = [stage for stage in phase.values() if isinstance(stage, dict)]
+            if isinstance(phase.get('stages'), list):
+                stages.extend(phase['stages'])
+            
+            for stage in stages:
+                if isinstance(stage, dict):
+                    for column in stage.get('columns', []):
+                        if column not in columns:
+                            columns.append(column)
+        
+        return columns or ['教学内容', '教师活动', '学生活动', '设计意图']
+
+    @staticmethod
+    def _summarize_section_fields(section: Dict) -> str:
+        """将模板中某一部分的结构压缩为字段名清单（去掉示例和说明文字）"""
+        names = []
+        for key, value in (section or {}).items():
+            if key == 'section_name' or any(word in key for word in ('example', 'description', 'format')):
+                continue
+            if isinstance(value, dict):
+                name = value.get('field_name') or value.get('section_name') or value.get('name') or key
+                columns = value.get('columns')
+                names.append(f"{name}[{'|'.join(columns)}]" if columns else name)
+            elif isinstance(value, list):
+                for item in value:
+                    if isinstance(item, dict) and item.get('name'):
+                        names.append(item['name'])
+                    elif isinstance(item, str):
+                        names.append(item)
+        return '；'.join(names)
+
+    def _derive_template_schema(self, template_structure: Dict) -> Dict:
+        """
+        从模板结构中提取精简的字段清单，每个模板只计算一次
+
+        Returns:
+            {'text': 字段清单文本, 'columns': 教学过程表格列}
+        """
+        digest = hashlib.sha256(
+            json.dumps(template_structure, ensure_ascii=False, sort_keys=True, default=str).encode('utf-8')
+        ).hexdigest()
+        schema = self._template_schemas.get(digest)
+        if schema is not None:
+            self._template_schemas.move_to_end(digest)
+            return schema
+        
+        main_table = template_structure.get('main_table_structure', {})
+        objectives_section = main_table.get('teaching_objectives_section', {})
+        process_section = main_table.get('teaching_process_section', {})
+        columns = self._extract_process_columns(process_section)
+        
+        lines = []
+        template_type = template_structure.get('template_metadata', {}).get('template_type')
+        if template_type:
+            lines.append(f"模板类型：{template_type}")
+        cover_fields = template_structure.get('cover_page', {}).get('basic_fields', [])
+        lines.append(f"封面字段：{'、'.join(cover_fields) if cover_fields else '按常规填写'}（须包含章节标题）")
+        
+        categories = objectives_section.get('objective_categories', {})
+        if categories:
+            objectives = '、'.join(str(v) for v in categories.values())
+            if objectives_section.get('has_ideological_elements'):
+                objectives += f"（含{objectives_section.get('ideological_section_name') or '思政元素'}）"
+            lines.append(f"教学目标：{objectives}")
+        
+        for title, key in (('教学重难点', 'key_difficult_section'),
+                           ('教学方法与资源', 'method_resource_section'),
+                           ('教学反思', 'teaching_reflection_section')):
+            fields = self._summarize_section_fields(main_table.get(key, {}))
+            if fields:
+                lines.append(f"{title}：{fields}")
+        
+        # 教学过程：阶段 > 环节（时间）
+        phases = []
+        for key in sorted(process_section.keys()):
+            phase = process_section[key]
+            if not key.startswith('phase_') or not isinstance(phase, dict):
+                continue
+            stages = [phase[k] for k in sorted(phase.keys()) if k.startswith('stage_')]
+            if isinstance(phase.get('stages'), list):
+                stages.extend(phase['stages'])
+            stage_names = []
+            for i, stage in enumerate(stages, 1):
+                if not isinstance(stage, dict):
+                    continue
+                name = stage.get('stage_name', f'环节{i}')
+                minutes = stage.get('time_minutes', '')
+                stage_names.append(f"{name}（{minutes}）" if minutes and minutes != 'X' else name)
+            phases.append(f"  - {phase.get('phase_name', '未命名阶段')}：{'、'.join(stage_names)}")
+        if phases:
+            lines.append("教学过程（阶段：环节）：\n" + "\n".join(phases))
+        else:
+            lines.append("教学过程：模板未定义，按常规教学流程设计")
+        
+        schema = {'text': "\n".join(lines), 'columns': columns}
+        self._template_schemas[digest] = schema
+        while len(self._template_schemas) > self.TEMPLATE_SCHEMA_CACHE_SIZE:
+            self._template_schemas.popitem(last=False)
+        return schema
+
+    def _build_compact_lesson_prompt(self, lesson_info: Dict, template_structure: Dict,
+                                     additional_requirements: str = "") -> str:
+        """构建精简版教案提示词：只保留模板字段清单和必要规则，避免每次课重复发送完整的模板结构JSON"""
+        template_structure = template_structure or {}
+        schema = self._derive_template_schema(template_structure)
+        columns = schema['columns']
+        course_info = (self.course_outline or {}).get('course_info', {})
+        
+        header = f"""请为以下大学课程的本次课生成完整教案（Markdown），严格遵循模板结构。
+
+【课程】{course_info.get('course_name', '')}｜{course_info.get('course_type', '')}｜授课对象：{course_info.get('target_students', '')}
+"""
+        lesson_block = f"""【本次课】{lesson_info.get('title', '')}｜{lesson_info.get('type', '')}｜{lesson_info.get('hours', 2)}学时
+知识点：{', '.join(lesson_info.get('knowledge_points', []))}
+教学重点：{', '.join(lesson_info.get('key_points', []))}
+教学难点：{', '.join(lesson_info.get('difficult_points', []))}
+"""
+        shared = f"""
+【模板结构】
+{schema['text']}
+
+【附加要求】{additional_requirements if additional_requirements else "无"}
+
+【规则】
+1. 严格按模板结构的章节、阶段、环节顺序生成，不增删环节，不改写字段名
+2. 教学过程每个环节用Markdown表格，列依次为：{' | '.join(columns)}；时间按模板标注合理分配
+3. 内容具体可操作，教师活动与学生活动对应，设计意图说明教学法依据
+4. 不包含具体学校、教师姓名；术语准确，逻辑清晰
+5. 依次输出：一、封面信息 二、教学目标 三、教学重难点 四、教学方法与资源 五、教学过程（### 阶段 / #### 环节名称（X分钟）+表格） 六、教学反思
+"""
+        ending = f"\n以\"# 教案标题：{lesson_info.get('title', '')}\"开头输出教案。\n"
+        if LESSON_PROMPT_PREFIX_LAYOUT:
+            prompt = f"{header}{shared}\n{lesson_block}{ending}"
+        else:
+            prompt = f"{header}{lesson_block}{shared}{ending}"
+        
+        # 每个模板字段清单首次使用时对比一次完整提示词的token数，便于评估是否开启精简提示词
+        if 'prompt_tokens' not in schema:
+            full_tokens = estimate_text_tokens(
+                self._build_full_lesson_prompt(lesson_info, template_structure, additional_requirements)
+            )
+            compact_tokens = estimate_text_tokens(prompt)
+            schema['prompt_tokens'] = {'full': full_tokens, 'compact': compact_tokens}
+            saved = (1 - compact_tokens / full_tokens) * 100 if full_tokens else 0
+            print(f"📉 教案提示词精简: 约 {full_tokens} → {compact_tokens} tokens/课次（减少 {saved:.0f}%）")
+        return prompt
+
+    def _build_full_lesson_prompt(self, lesson_info: Dict, template_structure: Dict,
+                                  additional_requirements: str = "") -> str:
+        """构建动态适配模板结构的教案生成提示词（完整版，包含模板结构JSON）"""
+        template_structure = template_structure or {}
         
         # ========== 动态提取模板结构，不依赖固定字段名 ==========
         main_table = template_structure.get('main_table_structure', {})
@@ -711,34 +1093,15 @@ class UniversityCourseAgent:
             
             return process_desc
         
-        # ========== 智能提取表格列结构 ==========
-        def extract_table_columns(process_section: Dict) -> List[str]:
-            """自动提取教学过程表格的列结构"""
-            columns_set = set()
-            
-            for key, phase in process_section.items():
-                if not isinstance(phase, dict):
-                    continue
-                
-                # 检查所有环节
-                for stage_key, stage in phase.items():
-                    if isinstance(stage, dict) and 'columns' in stage:
-                        columns_set.update(stage.get('columns', []))
-                
-                # 检查stages列表
-                if 'stages' in phase and isinstance(phase['stages'], list):
-                    for stage in phase['stages']:
-                        if isinstance(stage, dict) and 'columns' in stage:
-                            columns_set.update(stage.get('columns', []))
-            
-            return list(columns_set) if columns_set else ['教学内容', '教师活动', '学生活动', '设计意图']
-        
         # ========== 生成教学过程描述 ==========
         process_desc = analyze_process_structure(process_section)
-        table_columns = extract_table_columns(process_section)
+        table_columns = self._extract_process_columns(process_section)
+        
+        # 前缀布局下标题不写入输出框架，使本次课信息之前的内容在各课次间保持一致
+        title_line = "（本次课章节标题）" if LESSON_PROMPT_PREFIX_LAYOUT else lesson_info.get('title', '')
         
         # ========== 构建动态prompt ==========
-        prompt = f"""
+        header = f"""
     请根据以下信息生成一份完整的大学教案，**严格遵循提取的模板结构，不要预设固定格式**：
 
     ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -747,7 +1110,8 @@ class UniversityCourseAgent:
     课程名称：{self.course_outline.get('course_info', {}).get('course_name', '')}
     课程性质：{self.course_outline.get('course_info', {}).get('course_type', '')}
     授课对象：{self.course_outline.get('course_info', {}).get('target_students', '')}
-
+"""
+        lesson_block = f"""
     【本次课信息】
     章节标题：{lesson_info.get('title', '')}
     课程类型：{lesson_info.get('type', '')}
@@ -755,7 +1119,8 @@ class UniversityCourseAgent:
     知识点：{', '.join(lesson_info.get('knowledge_points', []))}
     教学重点：{', '.join(lesson_info.get('key_points', []))}
     教学难点：{', '.join(lesson_info.get('difficult_points', []))}
-
+"""
+        shared = f"""
     ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
     【二、模板结构要求（动态适配）】
     ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -818,7 +1183,7 @@ class UniversityCourseAgent:
 
     ✅ **输出结构框架：**
 
-    # 教案标题：{lesson_info.get('title', '')}
+    # 教案标题：{title_line}
 
     ## 一、封面信息
     （按模板定义的字段填写）
@@ -854,68 +1219,92 @@ class UniversityCourseAgent:
     ⚠️ 不要修改模板中定义的字段名称
     ⚠️ 表格列数和列名必须与模板完全一致
     ⚠️ 教学过程的阶段和环节顺序要与模板一致
-
-    现在请开始生成教案：
-    """
-        
-        response = await self.llm_lesson.ainvoke([HumanMessage(content=prompt)])
-        return response.content
+"""
+        ending = "\n    现在请开始生成教案：\n    "
+        if LESSON_PROMPT_PREFIX_LAYOUT:
+            return f"{header}{shared}{lesson_block}{ending}"
+        return f"{header}{lesson_block}{shared}{ending}"
 
     async def generate_all_lesson_plans(self, additional_requirements: str = "", 
-                                  progress_callback=None) -> List:
+                                  progress_callback=None, max_concurrency: int = None) -> List:
         """批量生成所有教案，支持实时预览
         
+        Args:
+            additional_requirements: 附加要求
+            progress_callback: 进度回调 callback(current, total, message)，按完成顺序回报
+            max_concurrency: 同时进行的教案生成请求数上限，默认读取
+                             LESSON_GENERATION_CONCURRENCY；为1时退化为逐个生成
+        
         Returns:
-            List: 根据模板类型返回不同格式
+            List: 根据模板类型返回不同格式（始终按大纲中的课次顺序排列）
                   - tags模式: 返回Dict列表（每个教案是字典）
                   - text模式: 返回str列表（每个教案是Markdown文本）
         """
         if not self.course_outline or not self.template_keywords:
             return ["请先上传模板并生成课程大纲"]
         
-        lesson_plans = []
         lessons = self.course_outline.get('lessons', [])
         total_lessons = len(lessons)
+        lesson_plans = [None] * total_lessons
         
         # 判断使用哪种生成模式
         is_tags_mode = (self.template_mode == "tags" and self.detected_tags)
         
+        if max_concurrency is None:
+            max_concurrency = LESSON_GENERATION_CONCURRENCY
+        max_concurrency = max(1, min(int(max_concurrency), total_lessons or 1))
+        
         if is_tags_mode:
-            print(f"🏷️  使用标签模式批量生成 {total_lessons} 个教案")
+            print(f"🏷️  使用标签模式批量生成 {total_lessons} 个教案（并发数: {max_concurrency}）")
         else:
-            print(f"📝 使用文本模式批量生成 {total_lessons} 个教案")
+            print(f"📝 使用文本模式批量生成 {total_lessons} 个教案（并发数: {max_concurrency}）")
         
-        for i, lesson in enumerate(lessons):
-            # 进度回调
-            if progress_callback:
-                progress_callback(i + 1, total_lessons, 
-                    f"正在生成第 {i+1}/{total_lessons} 次课教案: {lesson.get('title', '')}")
-            
-            # ========== 根据模板类型选择生成方法 ==========
-            if is_tags_mode:
-                # 标签模式：生成结构化JSON数据
-                lesson_plan = await self.generate_lesson_plan_for_tags(
-                    lesson, self.detected_tags, additional_requirements
-                )
-            else:
-                # 文本模式：生成Markdown文本
-                lesson_plan = await self.generate_university_lesson_plan(
-                    lesson, self.template_keywords, additional_requirements
-                )
-            
-            lesson_plans.append(lesson_plan)
-            
-            # 每生成一份教案后立即回调显示预览
-            if progress_callback:
+        semaphore = asyncio.Semaphore(max_concurrency)
+        completed = 0
+        
+        async def generate_one(i: int, lesson: Dict):
+            async with semaphore:
+                # 进度回调（开始生成）
+                if progress_callback:
+                    progress_callback(completed, total_lessons,
+                        f"正在生成第 {i+1}/{total_lessons} 次课教案: {lesson.get('title', '')}")
+                
+                # ========== 根据模板类型选择生成方法 ==========
                 if is_tags_mode:
-                    # JSON数据预览
-                    preview = f"\n\n---\n\n## 第 {i+1} 次课教案预览（结构化数据）\n\n"
-                    preview += f"生成字段: {list(lesson_plan.keys())[:10]}\n"
-                    preview += f"总字段数: {len(lesson_plan)}\n"
+                    # 标签模式：生成结构化JSON数据
+                    lesson_plan = await self.generate_lesson_plan_for_tags(
+                        lesson, self.detected_tags, additional_requirements
+                    )
                 else:
-                    # 文本预览
-                    preview = f"\n\n---\n\n## 第 {i+1} 次课教案预览\n\n{str(lesson_plan)[:500]}...\n\n"
-                progress_callback(i + 1, total_lessons, preview)
+                    # 文本模式：生成Markdown文本
+                    lesson_plan = await self.generate_university_lesson_plan(
+                        lesson, self.template_keywords, additional_requirements
+                    )
+            return i, lesson_plan
+        
+        tasks = [asyncio.ensure_future(generate_one(i, lesson)) for i, lesson in enumerate(lessons)]
+        try:
+            for future in asyncio.as_completed(tasks):
+                i, lesson_plan = await future
+                lesson_plans[i] = lesson_plan
+                completed += 1
+                
+                # 每完成一份教案立即回调显示预览（按完成顺序）
+                if progress_callback:
+                    if is_tags_mode:
+                        # JSON数据预览
+                        preview = f"\n\n---\n\n## 第 {i+1} 次课教案预览（结构化数据）\n\n"
+                        preview += f"生成字段: {list(lesson_plan.keys())[:10]}\n"
+                        preview += f"总字段数: {len(lesson_plan)}\n"
+                    else:
+                        # 文本预览
+                        preview = f"\n\n---\n\n## 第 {i+1} 次课教案预览\n\n{str(lesson_plan)[:500]}...\n\n"
+                    progress_callback(completed, total_lessons, preview)
+        finally:
+            # 任一教案失败时取消尚未完成的请求
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
         
         self.lesson_plans = lesson_plans
         return lesson_plans
@@ -923,15 +1312,46 @@ class UniversityCourseAgent:
     async def chat_with_user(self, user_message: str) -> str:
         """与用户进行通用对话"""
         try:
-            # 添加用户消息到对话历史
-            self.conversation_history.append({
-                "role": "user",
-                "content": user_message,
-                "timestamp": self._get_timestamp()
-            })
+            lc_messages = self._prepare_chat_messages(user_message)
+            
+            # 调用LLM（携带上下文消息）
+            response = await self.llm_chat.ainvoke(lc_messages)
+            
+            # 提取回复内容
+            assistant_reply = response.content.strip()
+            self._record_assistant_reply(assistant_reply)
+            return assistant_reply
             
-            # 构建对话上下文
-            system_prompt = """你是一个智能的大学教育助手，专门帮助教师进行教案设计和教学相关的工作。
+        except Exception as e:
+            print(f"对话处理错误: {e}")
+            return f"抱歉，处理您的消息时出现了错误：{str(e)}"
+
+    async def stream_chat_with_user(self, user_message: str) -> AsyncIterator[str]:
+        """流式对话，逐段产出回复文本；完整回复在结束后写入对话历史"""
+        lc_messages = self._prepare_chat_messages(user_message)
+        parts = []
+        try:
+            async for chunk in self.llm_chat.astream(lc_messages):
+                if chunk.content:
+                    parts.append(chunk.content)
+                    yield chunk.content
+        finally:
+            # 客户端中途断开时也保留已生成的部分，保证对话历史成对
+            reply = "".join(parts).strip()
+            if reply:
+                self._record_assistant_reply(reply)
+
+    def _prepare_chat_messages(self, user_message: str) -> List:
+        """记录用户消息，并构建携带对话上下文的消息列表"""
+        # 添加用户消息到对话历史
+        self.conversation_history.append({
+            "role": "user",
+            "content": user_message,
+            "timestamp": self._get_timestamp()
+        })
+        
+        # 构建对话上下文
+        system_prompt = """你是一个智能的大学教育助手，专门帮助教师进行教案设计和教学相关的工作。
 
 你的主要功能包括：
 1. 回答教学相关的问题
@@ -944,42 +1364,32 @@ class UniversityCourseAgent:
 
 回答要简洁明了，不超过300字。"""
 
-            # 构建消息历史（最近30条）并传入LLM，确保上下文保留
-            recent_history = self.conversation_history[-30:] if len(self.conversation_history) > 30 else self.conversation_history
+        # 构建消息历史（最近30条）并传入LLM，确保上下文保留
+        recent_history = self.conversation_history[-30:] if len(self.conversation_history) > 30 else self.conversation_history
 
-            lc_messages = [SystemMessage(content=system_prompt)]
-            for msg in recent_history:
-                role = msg.get("role")
-                content = msg.get("content", "")
-                if not content:
-                    continue
-                if role == "user":
-                    lc_messages.append(HumanMessage(content=content))
-                elif role == "assistant":
-                    lc_messages.append(AIMessage(content=content))
+        lc_messages = [SystemMessage(content=system_prompt)]
+        for msg in recent_history:
+            role = msg.get("role")
+            content = msg.get("content", "")
+            if not content:
+                continue
+            if role == "user":
+                lc_messages.append(HumanMessage(content=content))
+            elif role == "assistant":
+                lc_messages.append(AIMessage(content=content))
+        return lc_messages
 
-            # 调用LLM（携带上下文消息）
-            response = await self.llm_chat.ainvoke(lc_messages)
-            
-            # 提取回复内容
-            assistant_reply = response.content.strip()
-            
-            # 添加助手回复到对话历史
-            self.conversation_history.append({
-                "role": "assistant", 
-                "content": assistant_reply,
-                "timestamp": self._get_timestamp()
-            })
-            
-            # 保持对话历史在合理长度内（最多50条）
-            if len(self.conversation_history) > 50:
-                self.conversation_history = self.conversation_history[-50:]
-            
-            return assistant_reply
-            
-        except Exception as e:
-            print(f"对话处理错误: {e}")
-            return f"抱歉，处理您的消息时出现了错误：{str(e)}"
+    def _record_assistant_reply(self, assistant_reply: str):
+        """添加助手回复到对话历史"""
+        self.conversation_history.append({
+            "role": "assistant", 
+            "content": assistant_reply,
+            "timestamp": self._get_timestamp()
+        })
+        
+        # 保持对话历史在合理长度内（最多50条）
+        if len(self.conversation_history) > 50:
+            self.conversation_history = self.conversation_history[-50:]
 
     def _get_timestamp(self) -> str:
         """获取当前时间戳"""
@@ -0,0 +1,310 @@
+"""Background job queue for long-running generation tasks"""
+
+import concurrent.futures
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from core.progress_events import ProgressBroker, ProgressStream
+from utils.async_runner import get_event_loop_runner
+from utils.token_usage import TokenBudgetExceededError, UsageScope, usage_scope
+from config.settings import (
+    JOB_MAX_WORKERS, JOB_MAX_QUEUED, JOB_RESULT_TTL, JOB_RESULTS_DIR, JOB_TOKEN_BUDGET
+)
+
+
+class JobQueueFullError(Exception):
+    """Raised when the number of queued jobs reaches the configured limit"""
+
+
+class JobCancelledError(Exception):
+    """Raised inside a job when cancellation was requested"""
+
+
+# 任务状态
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = (COMPLETED, FAILED, CANCELLED)
+
+
+class Job:
+    """A single background job and its progress"""
+
+    def __init__(self, kind: str, owner: str, stream: ProgressStream = None,
+                 token_budget: int = None, budget_action: str = None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.owner = owner
+        self.status = QUEUED
+        self.progress = {'current': 0, 'total': 0, 'message': ''}
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel_event = threading.Event()
+        self._lock = threading.Lock()
+        self._future = None
+        self.stream = stream
+        self.usage = UsageScope(self.id, user=owner, budget=token_budget, on_exceed=budget_action)
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def update_progress(self, current: int, total: int, message: str = ''):
+        """Update progress counters (called from the job's worker thread)"""
+        self.progress = {'current': current, 'total': total, 'message': message}
+        if self.stream is not None:
+            self.stream.publish('progress', dict(self.progress, usage=self.usage.to_dict()))
+
+    def set_status(self, status: str):
+        self.status = status
+        if self.stream is not None:
+            final = status in FINISHED_STATES
+            data = {'status': status}
+            if final:
+                data['usage'] = self.usage.to_dict()
+            if status == FAILED:
+                data['error'] = self.error
+            self.stream.publish('done' if final else 'status', data, final=final)
+
+    def check_cancelled(self):
+        """Raise JobCancelledError if cancellation was requested"""
+        if self.cancel_requested:
+            raise JobCancelledError(self.id)
+
+    def run_coroutine(self, coro):
+        """
+        Run a coroutine on the shared background event loop and wait for it
+
+        The pending future is remembered so that cancel() can interrupt the
+        task at its next await point.
+        """
+        future = get_event_loop_runner().submit(coro)
+        with self._lock:
+            self._future = future
+        if self.cancel_requested:
+            future.cancel()
+        try:
+            return future.result()
+        except concurrent.futures.CancelledError:
+            raise JobCancelledError(self.id)
+        finally:
+            with self._lock:
+                self._future = None
+
+    def request_cancel(self):
+        self._cancel_event.set()
+        with self._lock:
+            if self._future is not None:
+                self._future.cancel()
+
+    def to_dict(self, include_result: bool = True) -> Dict:
+        data = {
+            'job_id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'progress': dict(self.progress),
+            'usage': self.usage.to_dict(),
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
+        if include_result:
+            data['result'] = self.result
+        return data
+
+
+class JobQueue:
+    """
+    Runs jobs on a bounded thread pool
+
+    At most ``max_workers`` jobs run at once and at most ``max_queued`` may
+    wait for a worker; further submissions raise JobQueueFullError. Finished
+    jobs are written to ``results_dir`` as JSON so their results can still be
+    fetched after the in-memory record expires (``result_ttl`` seconds) or
+    from another worker process. Status and progress changes are published
+    to a per-job stream of ``events`` under the job id.
+    """
+
+    def __init__(self, max_workers: int = None, max_queued: int = None,
+                 result_ttl: float = None, results_dir: str = None,
+                 events: ProgressBroker = None):
+        self.max_workers = max_workers or JOB_MAX_WORKERS
+        self.max_queued = JOB_MAX_QUEUED if max_queued is None else max_queued
+        self.result_ttl = JOB_RESULT_TTL if result_ttl is None else result_ttl
+        self.results_dir = Path(results_dir or JOB_RESULTS_DIR)
+        self.results_dir.mkdir(parents=True, exist_ok=True)
+        self.events = events or ProgressBroker()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='job')
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, owner: str, func: Callable[[Job], object],
+               token_budget: int = None, budget_action: str = None) -> Job:
+        """
+        Queue a job
+
+        Args:
+            kind: Job type, e.g. "generate_all_lessons"
+            owner: Session key of the submitting user
+            func: Called as ``func(job)`` in a worker thread; its return value
+                  becomes the job result
+            token_budget: Maximum total tokens of the job's LLM calls
+                          (defaults to JOB_TOKEN_BUDGET; 0 = unlimited)
+            budget_action: "abort" or "downgrade" once the budget is used up
+
+        Returns:
+            The queued Job
+        """
+        with self._lock:
+            self._purge()
+            queued = sum(1 for job in self._jobs.values() if job.status == QUEUED)
+            if queued >= self.max_queued:
+                raise JobQueueFullError(f"任务队列已满（{queued}个任务排队中），请稍后再试")
+            job = Job(kind, owner, token_budget=JOB_TOKEN_BUDGET if token_budget is None else token_budget,
+                      budget_action=budget_action)
+            job.stream = self.events.create(job.id, owner=owner)
+            job.stream.publish('status', {'status': QUEUED, 'kind': kind})
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, func)
+        print(f"📥 任务已提交: {kind} ({job.id})")
+        return job
+
+    def _run(self, job: Job, func: Callable[[Job], object]):
+        if job.cancel_requested:
+            self._finish(job, CANCELLED)
+            return
+        job.started_at = time.time()
+        job.set_status(RUNNING)
+        try:
+            # 任务内的LLM调用（包括提交到后台事件循环的协程）计入该任务的用量
+            with usage_scope(job.usage):
+                job.result = func(job)
+            self._finish(job, COMPLETED)
+        except JobCancelledError:
+            self._finish(job, CANCELLED)
+        except TokenBudgetExceededError as e:
+            job.error = f"任务因超出token预算而终止: {e}"
+            self._finish(job, FAILED)
+        except Exception as e:
+            job.error = str(e)
+            self._finish(job, FAILED)
+
+    def _finish(self, job: Job, status: str):
+        job.finished_at = time.time()
+        job.set_status(status)
+        print(f"{'✅' if status == COMPLETED else '⚠️ '} 任务结束: {job.kind} ({job.id}) - {status}")
+        self._persist(job)
+
+    def _persist(self, job: Job):
+        payload = job.to_dict()
+        payload['owner'] = job.owner
+        fd, tmp_path = tempfile.mkstemp(dir=self.results_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(payload, f, ensure_ascii=False, default=str)
+            os.replace(tmp_path, self.results_dir / f"{job.id}.json")
+        except Exception as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            print(f"⚠️  任务结果保存失败 ({job.id}): {e}")
+
+    def get(self, job_id: str, owner: str = None) -> Optional[Dict]:
+        """
+        Return a job's status (and result once finished)
+
+        Falls back to the persisted result file when the job is no longer
+        held in memory. When ``owner`` is given, jobs of other users are
+        reported as missing.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            if owner is not None and job.owner != owner:
+                return None
+            return job.to_dict(include_result=job.status in FINISHED_STATES)
+
+        path = self.results_dir / f"{os.path.basename(job_id)}.json"
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                payload = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if owner is not None and payload.pop('owner', None) != owner:
+            return None
+        return payload
+
+    def cancel(self, job_id: str, owner: str = None) -> bool:
+        """Request cancellation; returns False if the job is unknown or already finished"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None or (owner is not None and job.owner != owner):
+            return False
+        if job.status in FINISHED_STATES:
+            return False
+        job.request_cancel()
+        print(f"🛑 已请求取消任务: {job.kind} ({job.id})")
+        return True
+
+    def active_job(self, owner: str, kind: str = None) -> Optional[Job]:
+        """Return the owner's queued or running job, if any"""
+        with self._lock:
+            for job in self._jobs.values():
+                if job.owner == owner and job.status not in FINISHED_STATES \
+                        and (kind is None or job.kind == kind):
+                    return job
+        return None
+
+    def list_jobs(self, owner: str) -> List[Dict]:
+        """Return the owner's in-memory jobs, newest first"""
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if job.owner == owner]
+        jobs.sort(key=lambda job: job.created_at, reverse=True)
+        return [job.to_dict(include_result=False) for job in jobs]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+        return {
+            'max_workers': self.max_workers,
+            'max_queued': self.max_queued,
+            'jobs': counts
+        }
+
+    def _purge(self):
+        """Drop expired finished jobs from memory and disk (caller holds the lock)"""
+        if not self.result_ttl:
+            return
+        cutoff = time.time() - self.result_ttl
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.status in FINISHED_STATES and job.finished_at < cutoff]:
+            del self._jobs[job_id]
+        for path in self.results_dir.glob('*.json'):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def shutdown(self, wait: bool = True):
+        """Cancel pending jobs and stop the worker pool"""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            if job.status not in FINISHED_STATES:
+                job.request_cancel()
+        self._executor.shutdown(wait=wait)
@@ -31,6 +31,21 @@ class LessonPlannerService:
         except Exception as e:
             return False, f"API Key 配置失败：{str(e)}"
     
+    def reset_state(self):
+        """Reset session state, keeping the initialized agent and API key"""
+        api_key = self.state.api_key
+        self.state.reset()
+        self.state.api_key = api_key
+        if self.agent:
+            self.agent.clear_conversation_history()
+            self.agent.template_keywords = {}
+            self.agent.course_outline = None
+            self.agent.lesson_plans = []
+            self.agent.course_requirements = ""
+            self.agent.template_mode = "text"
+            self.agent.template_file_path = None
+            self.agent.detected_tags = []
+    
     async def process_template(self, file_path: str) -> tuple[bool, str, Dict]:
         """
         Process uploaded template file
@@ -62,7 +77,7 @@ class LessonPlannerService:
                 status_msg += f"⏳ 正在分析模板结构...\n"
             
             # Extract template keywords
-            keywords = self.agent.extract_template_keywords(file_path)
+            keywords = await self.agent.aextract_template_keywords(file_path)
             
             # Check if using default template
             if not keywords or keywords == self.agent._get_default_template_structure():
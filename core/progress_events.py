@@ -0,0 +1,143 @@
+"""Incremental progress events for background tasks (Server-Sent Events)"""
+
+import json
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+from config.settings import PROGRESS_EVENT_BUFFER, PROGRESS_STREAM_RETENTION, PROGRESS_SSE_HEARTBEAT
+
+
+def format_sse(event_id: int, event: str, data: Dict) -> str:
+    """Encode one event in the text/event-stream wire format"""
+    payload = json.dumps(data, ensure_ascii=False, default=str)
+    return f"id: {event_id}\nevent: {event}\ndata: {payload}\n\n"
+
+
+class ProgressStream:
+    """
+    Append-only event log of a single task
+
+    Every event gets a monotonically increasing id that clients send back as
+    ``Last-Event-ID`` to resume. Only the last ``max_events`` events are kept;
+    a client whose cursor has fallen out of the buffer receives a snapshot of
+    the latest state instead of the missed events.
+    """
+
+    def __init__(self, task_id: str, owner: str = None, max_events: int = None):
+        self.task_id = task_id
+        self.owner = owner
+        self.state: Dict = {}
+        self.closed = False
+        self.closed_at = None
+        self._events = deque(maxlen=max_events or PROGRESS_EVENT_BUFFER)
+        self._next_id = 1
+        self._cond = threading.Condition()
+
+    @property
+    def last_event_id(self) -> int:
+        return self._next_id - 1
+
+    def publish(self, event: str, data: Dict, final: bool = False) -> int:
+        """
+        Append an event and wake up waiting readers
+
+        Args:
+            event: Event type, e.g. "progress", "log", "done"
+            data: JSON-serializable payload; also merged into ``state``
+            final: Close the stream after this event
+
+        Returns:
+            The event id
+        """
+        with self._cond:
+            if self.closed:
+                return self.last_event_id
+            event_id = self._next_id
+            self._next_id += 1
+            self._events.append((event_id, event, data))
+            self.state.update(data)
+            if final:
+                self.closed = True
+                self.closed_at = time.time()
+            self._cond.notify_all()
+            return event_id
+
+    def read(self, last_event_id: int = 0, timeout: float = None) -> Tuple[List[tuple], bool]:
+        """
+        Return events newer than ``last_event_id``, waiting up to ``timeout``
+        seconds for one to arrive
+
+        Returns:
+            (events, missed) - events as (id, type, data) tuples; ``missed`` is
+            True when older events were already dropped from the buffer
+        """
+        with self._cond:
+            if timeout and not self.closed and last_event_id >= self.last_event_id:
+                self._cond.wait(timeout)
+            events = [e for e in self._events if e[0] > last_event_id]
+            oldest = self._events[0][0] if self._events else self._next_id
+            missed = last_event_id < oldest - 1
+            return events, missed
+
+    def snapshot(self) -> Dict:
+        with self._cond:
+            return dict(self.state, last_event_id=self.last_event_id, closed=self.closed)
+
+
+class ProgressBroker:
+    """Registry of progress streams shared by all background tasks of the process"""
+
+    def __init__(self, retention: float = None):
+        self.retention = PROGRESS_STREAM_RETENTION if retention is None else retention
+        self._streams: Dict[str, ProgressStream] = {}
+        self._lock = threading.Lock()
+
+    def create(self, task_id: str, owner: str = None) -> ProgressStream:
+        with self._lock:
+            self._purge()
+            stream = ProgressStream(task_id, owner=owner)
+            self._streams[task_id] = stream
+            return stream
+
+    def get(self, task_id: str, owner: str = None) -> Optional[ProgressStream]:
+        """Return a task's stream; streams owned by another session are reported as missing"""
+        with self._lock:
+            stream = self._streams.get(task_id)
+        if stream is None or (stream.owner is not None and owner is not None and stream.owner != owner):
+            return None
+        return stream
+
+    def _purge(self):
+        """Forget closed streams older than the retention period (caller holds the lock)"""
+        cutoff = time.time() - self.retention
+        for task_id in [task_id for task_id, stream in self._streams.items()
+                        if stream.closed and stream.closed_at < cutoff]:
+            del self._streams[task_id]
+
+    def iter_sse(self, stream: ProgressStream, last_event_id: int = 0, heartbeat: float = None):
+        """
+        Generate text/event-stream chunks for a stream until it is closed
+
+        Sends a snapshot when the client's cursor is older than the buffer and
+        a comment line every ``heartbeat`` seconds to keep proxies from
+        closing idle connections.
+        """
+        heartbeat = heartbeat or PROGRESS_SSE_HEARTBEAT
+        yield "retry: 3000\n\n"
+        cursor = last_event_id
+        while True:
+            events, missed = stream.read(cursor, timeout=heartbeat)
+            if missed:
+                yield format_sse(cursor, 'snapshot', stream.snapshot())
+            if not events:
+                if stream.closed:
+                    return
+                yield ": keep-alive\n\n"
+                continue
+            for event_id, event, data in events:
+                yield format_sse(event_id, event, data)
+                cursor = event_id
+            if stream.closed and cursor >= stream.last_event_id:
+                return
@@ -0,0 +1,171 @@
+"""Per-user session store for lesson planning services"""
+
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from core.lesson_planner import LessonPlannerService
+from config.settings import (
+    DASHSCOPE_API_KEY, SESSION_MAX_LIVE, SESSION_IDLE_TIMEOUT,
+    SESSION_PERSISTENCE, SESSION_DB_PATH
+)
+
+
+# 需要持久化的会话状态字段（SessionState）
+STATE_FIELDS = [
+    'messages', 'template_uploaded', 'template_keywords', 'course_info',
+    'requirements', 'outline_generated', 'course_outline', 'lesson_plans',
+    'current_step', 'template_file_path', 'template_path', 'template_structure',
+    'has_xml_tags', 'detected_tags', 'template_mode'
+]
+
+# 需要持久化的智能体状态字段（UniversityCourseAgent）
+AGENT_FIELDS = [
+    'conversation_history', 'template_keywords', 'course_outline', 'lesson_plans',
+    'course_requirements', 'template_mode', 'template_file_path', 'detected_tags'
+]
+
+
+class SessionStore:
+    """
+    Keeps one LessonPlannerService per user so teachers never share state
+
+    Live sessions are held in an LRU of at most ``max_sessions`` entries and
+    are dropped after ``idle_timeout`` seconds without access. When SQLite
+    persistence is enabled, a snapshot of the session and agent state is
+    written on save/eviction and restored on the next access, so sessions
+    survive evictions, restarts and multiple worker processes. API keys
+    entered by users are never persisted; restored sessions are initialized
+    with the configured DASHSCOPE_API_KEY when one is available.
+    """
+
+    def __init__(self, max_sessions: int = None, idle_timeout: float = None,
+                 db_path: str = None, persistence: bool = None):
+        self.max_sessions = max_sessions or SESSION_MAX_LIVE
+        self.idle_timeout = SESSION_IDLE_TIMEOUT if idle_timeout is None else idle_timeout
+        persistence = SESSION_PERSISTENCE if persistence is None else persistence
+        self._sessions: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._conn = None
+        if persistence:
+            self._conn = sqlite3.connect(str(db_path or SESSION_DB_PATH), check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_key TEXT PRIMARY KEY, snapshot TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+
+    def get(self, session_key: str) -> LessonPlannerService:
+        """Return the live service for a session, creating or restoring it if needed"""
+        with self._lock:
+            self.evict_idle()
+            entry = self._sessions.get(session_key)
+            if entry is None:
+                entry = {'service': self._create_service(session_key), 'last_access': time.time()}
+                self._sessions[session_key] = entry
+                while len(self._sessions) > self.max_sessions:
+                    oldest_key = next(iter(self._sessions))
+                    self._drop(oldest_key)
+            else:
+                entry['last_access'] = time.time()
+            self._sessions.move_to_end(session_key)
+            return entry['service']
+
+    def save(self, session_key: str):
+        """Persist a snapshot of a live session (no-op without persistence)"""
+        if self._conn is None:
+            return
+        with self._lock:
+            entry = self._sessions.get(session_key)
+            if entry is None:
+                return
+            snapshot = self._snapshot(entry['service'])
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO sessions (session_key, snapshot, updated_at) VALUES (?, ?, ?)",
+                    (session_key, json.dumps(snapshot, ensure_ascii=False, default=str), time.time())
+                )
+                self._conn.commit()
+            except Exception as e:
+                print(f"⚠️  会话持久化失败 ({session_key}): {e}")
+
+    def reset(self, session_key: str):
+        """Reset a session and remove its persisted snapshot"""
+        with self._lock:
+            entry = self._sessions.get(session_key)
+            if entry is not None:
+                entry['service'].reset_state()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM sessions WHERE session_key = ?", (session_key,))
+                self._conn.commit()
+
+    def evict_idle(self):
+        """Drop sessions that have not been accessed within idle_timeout"""
+        if not self.idle_timeout:
+            return
+        cutoff = time.time() - self.idle_timeout
+        with self._lock:
+            for key in [k for k, e in self._sessions.items() if e['last_access'] < cutoff]:
+                self._drop(key)
+
+    def stats(self) -> Dict:
+        """Return live session count and limits"""
+        with self._lock:
+            return {
+                'live_sessions': len(self._sessions),
+                'max_sessions': self.max_sessions,
+                'idle_timeout': self.idle_timeout,
+                'persistence': self._conn is not None
+            }
+
+    def _drop(self, session_key: str):
+        self.save(session_key)
+        self._sessions.pop(session_key, None)
+        print(f"🧹 会话已移出内存: {session_key}")
+
+    def _create_service(self, session_key: str) -> LessonPlannerService:
+        service = LessonPlannerService()
+        if DASHSCOPE_API_KEY:
+            success, message = service.initialize_agent(DASHSCOPE_API_KEY)
+            if not success:
+                print(f"⚠️  会话 {session_key} 的Agent初始化失败: {message}")
+
+        snapshot = self._load_snapshot(session_key)
+        if snapshot:
+            self._restore(service, snapshot)
+            print(f"♻️  已恢复会话: {session_key}")
+        return service
+
+    def _load_snapshot(self, session_key: str) -> Optional[Dict]:
+        if self._conn is None:
+            return None
+        row = self._conn.execute(
+            "SELECT snapshot FROM sessions WHERE session_key = ?", (session_key,)
+        ).fetchone()
+        if row is None:
+            return None
+        try:
+            return json.loads(row[0])
+        except json.JSONDecodeError:
+            return None
+
+    @staticmethod
+    def _snapshot(service: LessonPlannerService) -> Dict:
+        snapshot = {
+            'state': {f: getattr(service.state, f) for f in STATE_FIELDS if hasattr(service.state, f)},
+            'agent': None
+        }
+        if service.agent is not None:
+            snapshot['agent'] = {f: getattr(service.agent, f) for f in AGENT_FIELDS}
+        return snapshot
+
+    @staticmethod
+    def _restore(service: LessonPlannerService, snapshot: Dict):
+        for field, value in (snapshot.get('state') or {}).items():
+            setattr(service.state, field, value)
+        if service.agent is not None and snapshot.get('agent'):
+            for field, value in snapshot['agent'].items():
+                setattr(service.agent, field, value)
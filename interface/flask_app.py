@@ -12,14 +12,14 @@ University AI Lesson Planning System - Flask API
 import os
 import sys
 import json
-import asyncio
 import time
+import threading
 from pathlib import Path
 from typing import Dict, List, Optional
 from werkzeug.utils import secure_filename
-from flask import Flask, request, jsonify, send_file, render_template, Response
+from flask import Flask, request, jsonify, send_file, render_template, Response, g
 from flask_cors import CORS
-from flask_login import LoginManager
+from flask_login import LoginManager, current_user
 from flask_sqlalchemy import SQLAlchemy
 from flask_mail import Mail
 import tempfile
@@ -32,8 +32,20 @@ sys.path.insert(0, str(project_root))
 # 导入核心模块
 from core.agent import UniversityCourseAgent
 from core.lesson_planner import LessonPlannerService
+from core.session_store import SessionStore
+from core.job_queue import JobQueue, JobQueueFullError, JobCancelledError
+from core.progress_events import ProgressBroker, format_sse
 from utils.lesson_exporter import LessonExporter
-from config.settings import DASHSCOPE_API_KEY, DATABASE_URL, SECRET_KEY, MAIL_CONFIG
+from utils.llm_cache import get_llm_cache
+from utils.async_runner import get_event_loop_runner, run_async
+from utils.llm_policy import circuit_breaker_stats
+from utils.rate_limiter import rate_limiter_stats
+from utils.latency_stats import latency_stats
+from utils.token_usage import (
+    UsageScope, current_scope, get_usage_tracker, reset_usage_scope, set_usage_scope, sum_totals,
+    usage_scope
+)
+from config.settings import DASHSCOPE_API_KEY, DATABASE_URL, SECRET_KEY, MAIL_CONFIG, JOB_TOKEN_BUDGET
 
 # 导入认证模块
 from models.user import User, db
@@ -86,19 +98,35 @@ class UniversityFlaskAPI:
         # 创建上传目录
         os.makedirs(self.app.config['UPLOAD_FOLDER'], exist_ok=True)
         
-        # 初始化服务
-        self.service = LessonPlannerService()
+        # 初始化服务：每个用户拥有独立的LessonPlannerService（会话隔离）
+        self.sessions = SessionStore()
+        self.progress_events = ProgressBroker()
+        self.jobs = JobQueue(events=self.progress_events)
+        # 同一会话的任务共用一个Agent：检查是否有进行中的任务与提交新任务须在同一把锁内完成
+        self._job_submit_lock = threading.Lock()
         self.exporter = LessonExporter()
         
-        # 如果配置文件中有API Key，自动初始化agent
         if DASHSCOPE_API_KEY:
-            try:
-                print('🔑 检测到配置文件中的API Key，自动初始化Agent...')
-                self.service.initialize_agent(DASHSCOPE_API_KEY)
-                print('✅ Agent初始化成功')
-            except Exception as e:
-                print(f'⚠️  Agent自动初始化失败: {e}')
-                print('💡 您可以稍后在前端手动初始化')
+            print('🔑 检测到配置文件中的API Key，用户会话将自动初始化Agent')
+        
+        # 本次请求内的同步LLM调用计入当前用户的token用量
+        @self.app.before_request
+        def bind_usage_scope():
+            g.usage_token = set_usage_scope(UsageScope(user=self._get_session_key()))
+        
+        @self.app.teardown_request
+        def unbind_usage_scope(exc):
+            token = g.pop('usage_token', None)
+            if token is not None:
+                reset_usage_scope(token)
+        
+        # 请求结束后持久化本次访问的用户会话
+        @self.app.after_request
+        def persist_session(response):
+            session_key = g.get('session_key')
+            if session_key:
+                self.sessions.save(session_key)
+            return response
         
         # 注册蓝图
         self.app.register_blueprint(auth_bp)
@@ -110,6 +138,76 @@ class UniversityFlaskAPI:
         with self.app.app_context():
             db.create_all()
     
+    def _get_session_key(self) -> str:
+        """获取当前请求对应的会话键（按登录用户隔离）"""
+        if current_user.is_authenticated:
+            return f"user:{current_user.id}"
+        return "anonymous"
+    
+    def _get_service(self) -> LessonPlannerService:
+        """获取当前用户的LessonPlannerService"""
+        session_key = self._get_session_key()
+        g.session_key = session_key
+        return self.sessions.get(session_key)
+    
+    def _stream_tokens(self, agen, session_key: str, result_key: str) -> Response:
+        """
+        将异步文本生成器以SSE格式流式返回
+
+        事件: token {text} 逐段文本；done {result_key: 全文} 结束；error {error} 出错。
+        流结束（或客户端断开）后保存会话，因为after_request在流开始前就已执行。
+        """
+        # 流式响应在请求上下文结束后才迭代，需显式带上本次请求的用量作用域
+        scope = current_scope()
+        
+        def generate():
+            parts = []
+            event_id = 0
+            try:
+                with usage_scope(scope):
+                    for text in get_event_loop_runner().iter_async(agen):
+                        parts.append(text)
+                        event_id += 1
+                        yield format_sse(event_id, 'token', {'text': text})
+                yield format_sse(event_id + 1, 'done', {result_key: "".join(parts)})
+            except Exception as e:
+                print(f"❌ 流式生成失败: {e}")
+                yield format_sse(event_id + 1, 'error', {'error': str(e)})
+            finally:
+                self.sessions.save(session_key)
+
+        return Response(
+            generate(),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+    
+    @staticmethod
+    def _read_token_budget(data) -> tuple:
+        """
+        从请求参数中读取任务的token预算
+
+        Returns:
+            (token_budget, budget_action)，未指定时为None（使用配置默认值）
+
+        Raises:
+            ValueError: 参数不合法
+        """
+        token_budget = data.get('token_budget')
+        budget_action = data.get('budget_action') or None
+        if token_budget in (None, ''):
+            token_budget = None
+        else:
+            try:
+                token_budget = int(token_budget)
+            except (TypeError, ValueError):
+                raise ValueError('token_budget必须是整数')
+            if token_budget < 0:
+                raise ValueError('token_budget不能为负数')
+        if budget_action not in (None, 'abort', 'downgrade'):
+            raise ValueError("budget_action只能是 abort 或 downgrade")
+        return token_budget, budget_action
+    
     def _register_routes(self):
         """注册所有API路由"""
         
@@ -400,13 +498,14 @@ class UniversityFlaskAPI:
         @require_auth
         def initialize_agent():
             try:
+                service = self._get_service()
                 data = request.get_json()
                 api_key = data.get('api_key')
                 
                 if not api_key:
                     return jsonify({'error': 'API Key不能为空'}), 400
                 
-                success, message = self.service.initialize_agent(api_key)
+                success, message = service.initialize_agent(api_key)
                 
                 if success:
                     return jsonify({
@@ -427,6 +526,7 @@ class UniversityFlaskAPI:
         @self.app.route('/api/upload-template', methods=['POST'])
         def upload_template():
             try:
+                service = self._get_service()
                 if 'file' not in request.files:
                     return jsonify({'error': '没有上传文件'}), 400
                 
@@ -434,17 +534,31 @@ class UniversityFlaskAPI:
                 if file.filename == '':
                     return jsonify({'error': '没有选择文件'}), 400
                 
-                if not self.service.agent:
+                if not service.agent:
                     return jsonify({'error': '请先初始化智能体'}), 400
                 
-                # 保存文件
+                # 保存文件（按会话分目录，避免不同用户的同名模板互相覆盖）
                 filename = secure_filename(file.filename)
-                file_path = os.path.join(self.app.config['UPLOAD_FOLDER'], filename)
-                file.save(file_path)
-                
-                # 只保存文件路径，不立即解析
-                self.service.state.template_uploaded = True
-                self.service.state.template_path = file_path
+                user_dir = os.path.join(self.app.config['UPLOAD_FOLDER'], 
+                                        secure_filename(g.session_key.replace(':', '_')))
+                os.makedirs(user_dir, exist_ok=True)
+                file_path = os.path.join(user_dir, filename)
+                
+                with self._job_submit_lock:
+                    # 进行中的任务可能正在读取模板文件或稍后写回模板解析结果，完成前不允许更换模板
+                    active = self.jobs.active_job(g.session_key)
+                    if active is not None:
+                        return jsonify({
+                            'error': '已有任务在进行中，请等待其完成后再上传模板',
+                            'job_id': active.id,
+                            'kind': active.kind,
+                            'status': active.status
+                        }), 409
+                    file.save(file_path)
+                    
+                    # 只保存文件路径，不立即解析
+                    service.state.template_uploaded = True
+                    service.state.template_path = file_path
                 
                 return jsonify({
                     'success': True,
@@ -456,30 +570,78 @@ class UniversityFlaskAPI:
             except Exception as e:
                 return jsonify({'error': f'模板上传失败: {str(e)}'}), 500
         
-        # 解析模板（在需要时调用）
+        # 解析模板（在需要时调用）：作为后台任务执行，进度通过 /api/progress/<job_id>/events 推送
         @self.app.route('/api/parse-template', methods=['POST'])
         @require_auth
         def parse_template():
             try:
-                if not self.service.agent:
+                service = self._get_service()
+                if not service.agent:
                     return jsonify({'error': '请先初始化智能体'}), 400
                 
-                if not hasattr(self.service.state, 'template_path'):
+                if not hasattr(service.state, 'template_path'):
                     return jsonify({'error': '请先上传模板文件'}), 400
                 
-                # 解析模板
-                template_structure = self.service.agent.extract_template_keywords(
-                    self.service.state.template_path
-                )
+                # 可选指定视觉分析方式（single / two_step），默认使用配置
+                data = request.get_json(silent=True) or {}
+                analysis_mode = data.get('analysis_mode') or None
+                if analysis_mode and analysis_mode not in service.agent.TEMPLATE_ANALYSIS_MODES:
+                    return jsonify({'error': f'analysis_mode必须是: {", ".join(service.agent.TEMPLATE_ANALYSIS_MODES)}'}), 400
+                
+                session_key = g.session_key
+                template_path = service.state.template_path
+                
+                def run_parse(job):
+                    template_structure = job.run_coroutine(
+                        service.agent.aextract_template_keywords(
+                            template_path,
+                            analysis_mode=analysis_mode,
+                            progress_callback=job.update_progress
+                        )
+                    )
+                    
+                    # 更新状态（解析期间模板已被更换时不覆盖新模板的状态）
+                    if service.state.template_path == template_path:
+                        service.state.template_structure = template_structure
+                        self.sessions.save(session_key)
+                    
+                    return {
+                        'message': '模板解析成功',
+                        'template_structure': template_structure
+                    }
                 
-                # 更新状态
-                self.service.state.template_structure = template_structure
+                with self._job_submit_lock:
+                    # 解析会改写Agent的模板状态，会话中有任何任务在进行时都不能开始新的解析；
+                    # 同一模板已有解析任务在进行时直接返回该任务，由客户端订阅其进度
+                    active = self.jobs.active_job(session_key)
+                    if active is not None:
+                        if (active.kind != 'parse_template' or
+                                getattr(service, 'template_parse', {}).get('template_path') != template_path):
+                            return jsonify({
+                                'error': '已有任务在进行中，请等待其完成后再解析模板',
+                                'job_id': active.id,
+                                'kind': active.kind,
+                                'status': active.status
+                            }), 409
+                        return jsonify({
+                            'success': True,
+                            'message': '模板解析任务进行中',
+                            'job_id': active.id,
+                            'status': active.status
+                        }), 202
+                    
+                    try:
+                        job = self.jobs.submit('parse_template', session_key, run_parse)
+                    except JobQueueFullError as e:
+                        return jsonify({'error': str(e)}), 503
+                    service.template_parse = {'job_id': job.id, 'template_path': template_path}
                 
                 return jsonify({
                     'success': True,
-                    'message': '模板解析成功',
-                    'template_structure': template_structure
-                })
+                    'message': '模板解析任务已提交',
+                    'job_id': job.id,
+                    'status': job.status
+                }), 202
                 
             except Exception as e:
                 return jsonify({'error': f'模板解析失败: {str(e)}'}), 500
@@ -489,7 +651,8 @@ class UniversityFlaskAPI:
         @require_auth
         def chat_with_user():
             try:
-                if not self.service.agent:
+                service = self._get_service()
+                if not service.agent:
                     return jsonify({'error': '请先初始化智能体'}), 400
                 
                 data = request.get_json()
@@ -499,14 +662,9 @@ class UniversityFlaskAPI:
                     return jsonify({'error': '消息不能为空'}), 400
                 
                 # 异步对话处理
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                try:
-                    response = loop.run_until_complete(
-                        self.service.agent.chat_with_user(message)
-                    )
-                finally:
-                    loop.close()
+                response = run_async(
+                    service.agent.chat_with_user(message)
+                )
                 
                 return jsonify({
                     'success': True,
@@ -516,27 +674,47 @@ class UniversityFlaskAPI:
                 
             except Exception as e:
                 return jsonify({'error': f'对话处理失败: {str(e)}'}), 500
+        
+        # 流式对话接口（SSE，逐段返回回复文本）
+        @self.app.route('/api/chat/stream', methods=['POST'])
+        @require_auth
+        def stream_chat_with_user():
+            try:
+                service = self._get_service()
+                if not service.agent:
+                    return jsonify({'error': '请先初始化智能体'}), 400
+                
+                data = request.get_json() or {}
+                message = data.get('message', '')
+                
+                if not message:
+                    return jsonify({'error': '消息不能为空'}), 400
+                
+                return self._stream_tokens(
+                    service.agent.stream_chat_with_user(message),
+                    g.session_key,
+                    'response'
+                )
+                
+            except Exception as e:
+                return jsonify({'error': f'对话处理失败: {str(e)}'}), 500
 
         # 分析用户意图
         @self.app.route('/api/analyze-intent', methods=['POST'])
         @require_auth
         def analyze_intent():
             try:
-                if not self.service.agent:
+                service = self._get_service()
+                if not service.agent:
                     return jsonify({'error': '请先初始化智能体'}), 400
                 
                 data = request.get_json()
                 message = data.get('message', '')
                 
                 # 异步分析意图
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                try:
-                    intent = loop.run_until_complete(
-                        self.service.analyze_user_intent(message)
-                    )
-                finally:
-                    loop.close()
+                intent = run_async(
+                    service.analyze_user_intent(message)
+                )
                 
                 return jsonify({
                     'success': True,
@@ -551,10 +729,11 @@ class UniversityFlaskAPI:
         @require_auth
         def generate_outline():
             try:
-                if not self.service.agent:
+                service = self._get_service()
+                if not service.agent:
                     return jsonify({'error': '请先初始化智能体'}), 400
                 
-                if not self.service.state.template_uploaded:
+                if not service.state.template_uploaded:
                     return jsonify({'error': '请先上传模板文件'}), 400
                 
                 data = request.get_json()
@@ -562,20 +741,15 @@ class UniversityFlaskAPI:
                 requirements = data.get('requirements', '')
                 
                 # 异步生成大纲
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                try:
-                    outline = loop.run_until_complete(
-                        self.service.agent.plan_university_course_outline(course_info, requirements)
-                    )
-                finally:
-                    loop.close()
+                outline = run_async(
+                    service.agent.plan_university_course_outline(course_info, requirements)
+                )
                 
                 if 'error' in outline:
                     return jsonify({'error': outline['error']}), 500
                 
                 # 更新状态
-                self.service.state.course_outline = outline
+                service.state.course_outline = outline
                 
                 return jsonify({
                     'success': True,
@@ -591,10 +765,11 @@ class UniversityFlaskAPI:
         @require_auth
         def generate_lesson():
             try:
-                if not self.service.agent:
+                service = self._get_service()
+                if not service.agent:
                     return jsonify({'error': '请先初始化智能体'}), 400
                 
-                if not self.service.state.course_outline:
+                if not service.state.course_outline:
                     return jsonify({'error': '请先生成课程大纲'}), 400
                 
                 data = request.get_json()
@@ -602,18 +777,13 @@ class UniversityFlaskAPI:
                 additional_requirements = data.get('additional_requirements', '')
                 
                 # 异步生成教案
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                try:
-                    lesson_plan = loop.run_until_complete(
-                        self.service.agent.generate_university_lesson_plan(
-                            lesson_info, 
-                            self.service.state.template_structure,
-                            additional_requirements
-                        )
+                lesson_plan = run_async(
+                    service.agent.generate_university_lesson_plan(
+                        lesson_info, 
+                        service.state.template_structure,
+                        additional_requirements
                     )
-                finally:
-                    loop.close()
+                )
                 
                 return jsonify({
                     'success': True,
@@ -624,77 +794,191 @@ class UniversityFlaskAPI:
             except Exception as e:
                 return jsonify({'error': f'教案生成失败: {str(e)}'}), 500
         
-        # 批量生成所有教案
-        @self.app.route('/api/generate-all-lessons', methods=['POST'])
+        # 流式生成单个教案（SSE，逐段返回教案文本）
+        @self.app.route('/api/generate-lesson/stream', methods=['POST'])
         @require_auth
-        def generate_all_lessons():
+        def stream_generate_lesson():
             try:
-                if not self.service.agent:
+                service = self._get_service()
+                if not service.agent:
                     return jsonify({'error': '请先初始化智能体'}), 400
                 
-                if not self.service.state.course_outline:
+                if not service.state.course_outline:
                     return jsonify({'error': '请先生成课程大纲'}), 400
                 
-                data = request.get_json()
+                data = request.get_json() or {}
+                lesson_info = data.get('lesson_info', {})
                 additional_requirements = data.get('additional_requirements', '')
                 
-                # 进度追踪 - 保存到service对象中
-                self.service.generation_progress = {'current': 0, 'total': 0, 'message': '', 'status': 'running'}
+                return self._stream_tokens(
+                    service.agent.stream_university_lesson_plan(
+                        lesson_info,
+                        getattr(service.state, 'template_structure', None),
+                        additional_requirements
+                    ),
+                    g.session_key,
+                    'lesson_plan'
+                )
                 
-                def progress_callback(current, total, message):
-                    self.service.generation_progress = {
-                        'current': current,
-                        'total': total,
-                        'message': message,
-                        'status': 'running'
-                    }
-                    print(f"📊 进度: {current}/{total} - {message}")
+            except Exception as e:
+                return jsonify({'error': f'教案生成失败: {str(e)}'}), 500
+        
+        # 批量生成所有教案
+        @self.app.route('/api/generate-all-lessons', methods=['POST'])
+        @require_auth
+        def generate_all_lessons():
+            try:
+                service = self._get_service()
+                if not service.agent:
+                    return jsonify({'error': '请先初始化智能体'}), 400
+                
+                if not service.state.course_outline:
+                    return jsonify({'error': '请先生成课程大纲'}), 400
                 
-                # 异步批量生成教案
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
+                data = request.get_json() or {}
+                additional_requirements = data.get('additional_requirements', '')
+                session_key = g.session_key
                 try:
-                    lesson_plans = loop.run_until_complete(
-                        self.service.agent.generate_all_lesson_plans(
-                            additional_requirements,
-                            progress_callback=progress_callback
+                    token_budget, budget_action = self._read_token_budget(data)
+                except ValueError as e:
+                    return jsonify({'error': str(e)}), 400
+                
+                def run_generation(job):
+                    # 进度同时写入job和service，兼容旧的进度轮询接口
+                    service.generation_progress = {
+                        'current': 0, 'total': 0, 'message': '', 'status': 'running', 'job_id': job.id
+                    }
+                    
+                    def progress_callback(current, total, message):
+                        job.update_progress(current, total, message)
+                        service.generation_progress = {
+                            'current': current,
+                            'total': total,
+                            'message': message,
+                            'status': 'running',
+                            'job_id': job.id
+                        }
+                        print(f"📊 进度: {current}/{total} - {message}")
+                    
+                    try:
+                        lesson_plans = job.run_coroutine(
+                            service.agent.generate_all_lesson_plans(
+                                additional_requirements,
+                                progress_callback=progress_callback
+                            )
                         )
-                    )
-                finally:
-                    loop.close()
-                
-                # 保存教案到状态中，供导出使用
-                self.service.state.lesson_plans = lesson_plans
-                
-                # 更新进度为完成状态
-                self.service.generation_progress = {
-                    'current': len(lesson_plans),
-                    'total': len(lesson_plans),
-                    'message': '所有教案生成完成',
-                    'status': 'completed'
-                }
+                    except JobCancelledError:
+                        service.generation_progress = dict(
+                            service.generation_progress, status='cancelled', message='任务已取消'
+                        )
+                        raise
+                    except Exception as e:
+                        service.generation_progress = dict(
+                            service.generation_progress, status='failed', message=str(e)
+                        )
+                        raise
+                    
+                    # 保存教案到会话状态中，供导出使用
+                    service.state.lesson_plans = lesson_plans
+                    self.sessions.save(session_key)
+                    
+                    service.generation_progress = {
+                        'current': len(lesson_plans),
+                        'total': len(lesson_plans),
+                        'message': '所有教案生成完成',
+                        'status': 'completed',
+                        'job_id': job.id
+                    }
+                    print(f"✅ 成功生成 {len(lesson_plans)} 个教案")
+                    print(f"📁 教案已保存到状态，可以导出")
+                    
+                    return {
+                        'lesson_plans': lesson_plans,
+                        'total_count': len(lesson_plans)
+                    }
                 
-                # 打印调试信息
-                print(f"✅ 成功生成 {len(lesson_plans)} 个教案")
-                print(f"📁 教案已保存到状态，可以导出")
+                with self._job_submit_lock:
+                    # 同一用户同时只允许一个任务（批量生成与模板解析共用同一个Agent状态）
+                    active = self.jobs.active_job(session_key)
+                    if active is not None:
+                        return jsonify({
+                            'error': '已有任务在进行中，请等待其完成后再生成教案',
+                            'job_id': active.id,
+                            'kind': active.kind,
+                            'status': active.status
+                        }), 409
+                    
+                    previous_progress = getattr(service, 'generation_progress', None)
+                    service.generation_progress = {
+                        'current': 0, 'total': 0, 'message': '任务排队中', 'status': 'queued', 'job_id': None
+                    }
+                    try:
+                        job = self.jobs.submit('generate_all_lessons', session_key, run_generation,
+                                               token_budget=token_budget, budget_action=budget_action)
+                    except JobQueueFullError as e:
+                        service.generation_progress = previous_progress
+                        return jsonify({'error': str(e)}), 503
                 
                 return jsonify({
                     'success': True,
-                    'message': f'成功生成{len(lesson_plans)}个教案',
-                    'lesson_plans': lesson_plans,
-                    'total_count': len(lesson_plans)
-                })
+                    'message': '教案生成任务已提交',
+                    'job_id': job.id,
+                    'status': job.status
+                }), 202
                 
             except Exception as e:
                 return jsonify({'error': f'批量生成失败: {str(e)}'}), 500
         
+        # 查询后台任务状态（完成后包含结果）
+        @self.app.route('/api/jobs/<job_id>', methods=['GET'])
+        @require_auth
+        def get_job(job_id):
+            try:
+                job = self.jobs.get(job_id, owner=self._get_session_key())
+                if job is None:
+                    return jsonify({'error': '任务不存在'}), 404
+                return jsonify({'success': True, 'job': job})
+            except Exception as e:
+                return jsonify({'error': str(e)}), 500
+        
+        # 取消后台任务
+        @self.app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+        @require_auth
+        def cancel_job(job_id):
+            try:
+                if not self.jobs.cancel(job_id, owner=self._get_session_key()):
+                    return jsonify({'error': '任务不存在或已结束'}), 404
+                return jsonify({'success': True, 'message': '已请求取消任务', 'job_id': job_id})
+            except Exception as e:
+                return jsonify({'error': str(e)}), 500
+        
+        # 当前用户的token用量（按模型汇总，以及各后台任务的用量）
+        @self.app.route('/api/usage', methods=['GET'])
+        @require_auth
+        def get_usage():
+            try:
+                session_key = self._get_session_key()
+                by_model = get_usage_tracker().user_usage(session_key)
+                total = sum_totals(by_model)
+                jobs = [{'job_id': job['job_id'], 'kind': job['kind'], 'status': job['status'],
+                         'usage': job['usage']}
+                        for job in self.jobs.list_jobs(session_key)]
+                return jsonify({
+                    'success': True,
+                    'usage': {'total': total, 'by_model': by_model},
+                    'jobs': jobs
+                })
+            except Exception as e:
+                return jsonify({'error': str(e)}), 500
+        
         # 获取教案生成进度（轮询接口）
         @self.app.route('/api/lesson-generation-progress', methods=['GET'])
         @require_auth
         def get_lesson_progress():
             try:
-                if hasattr(self.service, 'generation_progress'):
-                    return jsonify(self.service.generation_progress)
+                service = self._get_service()
+                if hasattr(service, 'generation_progress'):
+                    return jsonify(service.generation_progress)
                 return jsonify({'current': 0, 'total': 0, 'message': ''})
             except Exception as e:
                 return jsonify({'error': str(e)}), 500
@@ -704,15 +988,16 @@ class UniversityFlaskAPI:
         @require_auth
         def export_lessons():
             try:
+                service = self._get_service()
                 print("=" * 50)
                 print("🔍 开始智能导出教案")
-                print(f"📊 教案状态检查: {hasattr(self.service.state, 'lesson_plans')}")
+                print(f"📊 教案状态检查: {hasattr(service.state, 'lesson_plans')}")
                 
-                if not hasattr(self.service.state, 'lesson_plans') or not self.service.state.lesson_plans:
+                if not hasattr(service.state, 'lesson_plans') or not service.state.lesson_plans:
                     print("❌ 没有找到教案数据")
                     return jsonify({'error': '没有教案可导出，请先生成教案'}), 400
                 
-                print(f"✅ 找到 {len(self.service.state.lesson_plans)} 个教案")
+                print(f"✅ 找到 {len(service.state.lesson_plans)} 个教案")
                 
                 data = request.get_json()
                 export_format = data.get('format', 'word')  # word, txt
@@ -722,16 +1007,16 @@ class UniversityFlaskAPI:
                 print(f"📁 文件名: {filename}")
                 
                 # ========== 获取模板信息 ==========
-                template_mode = getattr(self.service.agent, 'template_mode', 'text')
-                template_path = getattr(self.service.agent, 'template_file_path', None)
+                template_mode = getattr(service.agent, 'template_mode', 'text')
+                template_path = getattr(service.agent, 'template_file_path', None)
                 
                 print(f"🏷️  模板模式: {template_mode}")
                 print(f"📂 模板路径: {template_path}")
                 
                 # ========== 使用智能导出 ==========
                 file_path, success = self.exporter.smart_export(
-                    lesson_plans=self.service.state.lesson_plans,
-                    course_outline=self.service.agent.course_outline if hasattr(self.service.agent, 'course_outline') else None,
+                    lesson_plans=service.state.lesson_plans,
+                    course_outline=service.agent.course_outline if hasattr(service.agent, 'course_outline') else None,
                     template_mode=template_mode,
                     template_path=template_path,
                     export_format=export_format
@@ -780,8 +1065,11 @@ class UniversityFlaskAPI:
             请求体（multipart/form-data）:
             - file: 上传的Word模板文件（.docx）
             - topic: 教案主题
+            - token_budget: 可选，本次生成的token预算（0为不限）
+            - budget_action: 可选，超出预算时 abort 终止 / downgrade 降级模型
             """
             try:
+                service = self._get_service()
                 from core.advanced_generator import AdvancedLessonGenerator
                 import shutil
                 
@@ -790,8 +1078,13 @@ class UniversityFlaskAPI:
                 if not topic:
                     return jsonify({'error': '请提供教案主题'}), 400
                 
+                try:
+                    token_budget, budget_action = self._read_token_budget(request.form)
+                except ValueError as e:
+                    return jsonify({'error': str(e)}), 400
+                
                 # 检查agent是否已初始化
-                if not self.service.agent:
+                if not service.agent:
                     return jsonify({'error': '请先初始化AI代理'}), 400
                 
                 # 检查是使用默认模板还是上传文件
@@ -852,15 +1145,20 @@ class UniversityFlaskAPI:
                 import uuid
                 task_id = str(uuid.uuid4())
                 
-                # 初始化进度
+                # 初始化进度（日志不再累积在进度字典中，而是作为增量事件推送）
                 self.generation_progress[task_id] = {
                     'progress': 0,
                     'status': 'starting',
                     'current_step': '准备中...',
-                    'logs': [],
                     'result': None,
                     'error': None
                 }
+                stream = self.progress_events.create(task_id, owner=g.session_key)
+                usage = UsageScope(
+                    task_id, user=g.session_key,
+                    budget=JOB_TOKEN_BUDGET if token_budget is None else token_budget,
+                    on_exceed=budget_action
+                )
                 
                 # 定义进度回调函数
                 def progress_callback(progress, status, message):
@@ -868,9 +1166,12 @@ class UniversityFlaskAPI:
                         self.generation_progress[task_id]['progress'] = progress
                         self.generation_progress[task_id]['status'] = status
                         self.generation_progress[task_id]['current_step'] = message
-                        self.generation_progress[task_id]['logs'].append({
+                        stream.publish('progress', {
+                            'progress': progress,
+                            'status': status,
+                            'message': message,
                             'time': time.time(),
-                            'message': message
+                            'usage': usage.to_dict()
                         })
                         # 打印到控制台便于调试
                         print(f"[{progress}%] {message}")
@@ -883,19 +1184,15 @@ class UniversityFlaskAPI:
                         
                         # 创建生成器（带进度回调）
                         generator = AdvancedLessonGenerator(
-                            agent=self.service.agent,
+                            agent=service.agent,
                             progress_callback=progress_callback
                         )
                         
                         # 执行生成（同步包装异步调用）
-                        loop = asyncio.new_event_loop()
-                        asyncio.set_event_loop(loop)
-                        try:
-                            success, result = loop.run_until_complete(
+                        with usage_scope(usage):
+                            success, result = run_async(
                                 generator.generate(topic, template_path)
                             )
-                        finally:
-                            loop.close()
                         
                         # 清理临时文件
                         try:
@@ -909,12 +1206,18 @@ class UniversityFlaskAPI:
                             if task_id in self.generation_progress:
                                 self.generation_progress[task_id]['result'] = result
                                 self.generation_progress[task_id]['status'] = 'completed'
+                            stream.publish('done', {
+                                'status': 'completed', 'result': result, 'usage': usage.to_dict()
+                            }, final=True)
                             print(f"✅ 后台任务完成: {task_id}")
                         else:
                             # 更新进度状态
                             if task_id in self.generation_progress:
                                 self.generation_progress[task_id]['error'] = result
                                 self.generation_progress[task_id]['status'] = 'failed'
+                            stream.publish('done', {
+                                'status': 'failed', 'error': result, 'usage': usage.to_dict()
+                            }, final=True)
                             print(f"❌ 后台任务失败: {task_id}")
                             
                     except Exception as e:
@@ -924,6 +1227,9 @@ class UniversityFlaskAPI:
                         if task_id in self.generation_progress:
                             self.generation_progress[task_id]['error'] = str(e)
                             self.generation_progress[task_id]['status'] = 'failed'
+                        stream.publish('done', {
+                            'status': 'failed', 'error': str(e), 'usage': usage.to_dict()
+                        }, final=True)
                 
                 # 启动后台线程
                 import threading
@@ -972,10 +1278,33 @@ class UniversityFlaskAPI:
                 print(f"❌ 获取模板列表错误: {str(e)}")
                 return jsonify({'error': str(e)}), 500
         
-        # 获取生成进度
+        # 任务进度事件流（Server-Sent Events，支持 Last-Event-ID 断线续传）
+        @self.app.route('/api/progress/<task_id>/events', methods=['GET'])
+        def stream_progress_events(task_id):
+            """推送后台任务（批量生成/高级生成）的增量进度事件"""
+            stream = self.progress_events.get(task_id, owner=self._get_session_key())
+            if stream is None:
+                return jsonify({'error': '任务不存在'}), 404
+            
+            cursor = request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or 0
+            try:
+                cursor = int(cursor)
+            except ValueError:
+                cursor = 0
+            
+            return Response(
+                self.progress_events.iter_sse(stream, cursor),
+                mimetype='text/event-stream',
+                headers={
+                    'Cache-Control': 'no-cache',
+                    'X-Accel-Buffering': 'no'  # 关闭nginx缓冲，保证事件实时送达
+                }
+            )
+        
+        # 获取生成进度（轮询接口，建议改用 /api/progress/<task_id>/events）
         @self.app.route('/api/advanced-generate/progress/<task_id>', methods=['GET'])
         def get_generation_progress(task_id):
-            """获取生成进度"""
+            """获取生成进度，?since=<事件ID> 只返回该事件之后的日志"""
             try:
                 if not hasattr(self, 'generation_progress'):
                     print(f"⚠️ generation_progress 不存在")
@@ -986,13 +1315,26 @@ class UniversityFlaskAPI:
                     print(f"   现有任务: {list(self.generation_progress.keys())}")
                     return jsonify({'error': '任务不存在'}), 404
                 
-                progress_data = self.generation_progress[task_id]
+                # 与事件流接口一致：只返回当前用户自己任务的进度和日志，其他用户的任务按不存在处理
+                stream = self.progress_events.get(task_id, owner=self._get_session_key())
+                if stream is None and self.progress_events.get(task_id) is not None:
+                    return jsonify({'error': '任务不存在'}), 404
+                
+                progress_data = dict(self.generation_progress[task_id])
+                if stream is not None:
+                    since = request.args.get('since', 0, type=int)
+                    events, _ = stream.read(since)
+                    progress_data['logs'] = [
+                        {'id': event_id, 'time': data.get('time'), 'message': data.get('message')}
+                        for event_id, event, data in events if event == 'progress'
+                    ]
+                    progress_data['last_event_id'] = stream.last_event_id
                 # 打印调试信息（每5次请求打印一次，避免刷屏）
                 if not hasattr(self, '_progress_query_count'):
                     self._progress_query_count = {}
                 self._progress_query_count[task_id] = self._progress_query_count.get(task_id, 0) + 1
                 if self._progress_query_count[task_id] % 5 == 1:
-                    print(f"📊 [查询 #{self._progress_query_count[task_id]}] 进度: {progress_data['progress']}%, 状态: {progress_data['status']}, 日志数: {len(progress_data['logs'])}")
+                    print(f"📊 [查询 #{self._progress_query_count[task_id]}] 进度: {progress_data['progress']}%, 状态: {progress_data['status']}")
                 
                 return jsonify(progress_data)
             except Exception as e:
@@ -1064,15 +1406,23 @@ class UniversityFlaskAPI:
         @require_auth
         def get_status():
             try:
+                service = self._get_service()
                 return jsonify({
                     'success': True,
                     'status': {
-                        'agent_initialized': self.service.agent is not None,
-                        'template_uploaded': self.service.state.template_uploaded,
-                        'course_outline_generated': self.service.state.course_outline is not None,
-                        'lessons_generated': len(self.service.state.lesson_plans),
-                        'requirements': self.service.state.requirements
-                    }
+                        'agent_initialized': service.agent is not None,
+                        'template_uploaded': service.state.template_uploaded,
+                        'course_outline_generated': service.state.course_outline is not None,
+                        'lessons_generated': len(service.state.lesson_plans),
+                        'requirements': service.state.requirements
+                    },
+                    'llm_cache': llm_cache.stats() if (llm_cache := get_llm_cache()) else None,
+                    'llm_circuit_breakers': circuit_breaker_stats(),
+                    'llm_rate_limits': rate_limiter_stats(),
+                    'sessions': self.sessions.stats(),
+                    'jobs': self.jobs.stats(),
+                    'token_usage': get_usage_tracker().model_usage(),
+                    'latency': latency_stats()
                 })
                 
             except Exception as e:
@@ -1083,10 +1433,11 @@ class UniversityFlaskAPI:
         @require_auth
         def get_conversation_history():
             try:
-                if not self.service.agent:
+                service = self._get_service()
+                if not service.agent:
                     return jsonify({'error': '请先初始化智能体'}), 400
                 
-                history = self.service.agent.get_conversation_history()
+                history = service.agent.get_conversation_history()
                 return jsonify({
                     'success': True,
                     'history': history
@@ -1100,10 +1451,11 @@ class UniversityFlaskAPI:
         @require_auth
         def clear_conversation():
             try:
-                if not self.service.agent:
+                service = self._get_service()
+                if not service.agent:
                     return jsonify({'error': '请先初始化智能体'}), 400
                 
-                self.service.agent.clear_conversation_history()
+                service.agent.clear_conversation_history()
                 return jsonify({
                     'success': True,
                     'message': '对话历史已清空'
@@ -1117,7 +1469,8 @@ class UniversityFlaskAPI:
         @require_auth
         def reset_state():
             try:
-                self.service.reset_state()
+                service = self._get_service()
+                self.sessions.reset(g.session_key)
                 return jsonify({
                     'success': True,
                     'message': '状态已重置'
@@ -0,0 +1,146 @@
+"""
+生产环境服务器 - EduAgent智教创想
+Production WSGI server launcher
+
+使用多进程/多线程WSGI服务器替代Werkzeug开发服务器：
+- Linux/macOS: gunicorn（gthread worker，支持多进程 + 多线程、keep-alive、优雅退出）
+- Windows 或未安装gunicorn: waitress（单进程多线程）
+
+会话、后台任务队列和进度事件（SSE）都保存在进程内存中，因此默认只允许单个
+worker进程；扩容时增加线程数，或在配置了粘性路由/共享后端后设置 SERVER_SHARED_STATE。
+
+应用实例统一通过 create_app() 创建。
+"""
+
+import signal
+import sys
+from typing import Optional
+
+from config.settings import (
+    SERVER_WORKERS, SERVER_THREADS, SERVER_KEEPALIVE,
+    SERVER_GRACEFUL_TIMEOUT, SERVER_TIMEOUT, SERVER_SHARED_STATE
+)
+
+try:
+    from gunicorn.app.base import BaseApplication
+    GUNICORN_AVAILABLE = True
+except ImportError:
+    GUNICORN_AVAILABLE = False
+
+try:
+    import waitress
+    WAITRESS_AVAILABLE = True
+except ImportError:
+    WAITRESS_AVAILABLE = False
+
+
+if GUNICORN_AVAILABLE:
+    class GunicornApplication(BaseApplication):
+        """在代码中嵌入gunicorn，每个worker进程内调用create_app()"""
+
+        def __init__(self, options: dict):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                if key in self.cfg.settings and value is not None:
+                    self.cfg.set(key.lower(), value)
+
+        def load(self):
+            from interface.flask_app import create_app
+            return create_app()
+
+
+def get_server_backend() -> Optional[str]:
+    """获取可用的生产服务器类型"""
+    if GUNICORN_AVAILABLE and sys.platform != 'win32':
+        return 'gunicorn'
+    if WAITRESS_AVAILABLE:
+        return 'waitress'
+    return None
+
+
+def run_production_server(host: str = '0.0.0.0', port: int = 5025,
+                          workers: int = None, threads: int = None,
+                          keep_alive: int = None, graceful_timeout: int = None,
+                          timeout: int = None):
+    """
+    以生产模式启动服务
+
+    Args:
+        host: 监听地址
+        port: 监听端口
+        workers: worker进程数（仅gunicorn）
+        threads: 每个worker的线程数
+        keep_alive: 空闲keep-alive连接保持秒数（waitress对应channel_timeout）
+        graceful_timeout: 收到退出信号后等待在途请求完成的秒数
+        timeout: 单个请求的最长处理时间（秒，仅gunicorn；waitress没有单请求超时）
+
+    Raises:
+        RuntimeError: 未安装生产服务器，或 workers > 1 但未设置 SERVER_SHARED_STATE
+    """
+    workers = workers or SERVER_WORKERS
+    threads = threads or SERVER_THREADS
+    keep_alive = SERVER_KEEPALIVE if keep_alive is None else keep_alive
+    graceful_timeout = SERVER_GRACEFUL_TIMEOUT if graceful_timeout is None else graceful_timeout
+    timeout = SERVER_TIMEOUT if timeout is None else timeout
+
+    backend = get_server_backend()
+    if backend is None:
+        raise RuntimeError("未安装生产服务器，请执行: pip install gunicorn（Linux/macOS）或 pip install waitress")
+    if backend == 'gunicorn' and workers > 1 and not SERVER_SHARED_STATE:
+        # 任务提交、进度订阅和结果查询可能落到不同进程，导致任务“不存在”
+        raise RuntimeError(
+            f"workers={workers}：会话、任务队列和进度事件保存在进程内存中，多进程之间不共享。"
+            "请使用单进程并增加线程数；若已配置粘性路由或共享后端，设置 SERVER_SHARED_STATE=true"
+        )
+
+    print(f"🏭 生产模式启动: {backend}")
+    print(f"   - 监听地址: {host}:{port}")
+    if backend == 'gunicorn':
+        print(f"   - 进程数: {workers}，每进程线程数: {threads}")
+        print(f"   - Keep-Alive: {keep_alive}s，优雅退出超时: {graceful_timeout}s，请求超时: {timeout}s")
+    else:
+        print(f"   - 进程数: 1，线程数: {threads}")
+        print(f"   - 空闲连接超时: {keep_alive}s，优雅退出超时: {graceful_timeout}s，请求超时: 无（waitress不支持）")
+
+    if backend == 'gunicorn':
+        options = {
+            'bind': f'{host}:{port}',
+            'workers': workers,
+            'worker_class': 'gthread',
+            'threads': threads,
+            'keepalive': keep_alive,
+            'graceful_timeout': graceful_timeout,
+            'timeout': timeout,
+            'accesslog': '-',
+        }
+        GunicornApplication(options).run()
+        return
+
+    # waitress：单进程多线程，收到SIGTERM时停止接收新连接，并等待在途请求完成。
+    # channel_timeout是空闲连接的关闭时间（对应keep-alive）；waitress没有单请求超时，
+    # 长时间运行的工作应提交到后台任务队列
+    from interface.flask_app import create_app
+    app = create_app()
+    server = waitress.create_server(
+        app,
+        host=host,
+        port=port,
+        threads=threads,
+        channel_timeout=keep_alive,
+    )
+
+    def request_shutdown(signum, frame):
+        print("\n🛑 收到退出信号，正在关闭服务器...")
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, request_shutdown)
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.task_dispatcher.shutdown(cancel_pending=False, timeout=graceful_timeout)
+        server.close()
@@ -15,11 +15,19 @@ sys.path.insert(0, str(project_root))
 def main():
     """启动服务器"""
     try:
-        from interface.flask_app import UniversityFlaskAPI
+        from config.settings import SERVER_MODE
         
         print("🚀 启动EduAgent智教创想...")
         print("=" * 60)
         
+        # 生产模式（环境变量 SERVER_MODE=production）
+        if SERVER_MODE == 'production':
+            from interface.production_server import run_production_server
+            run_production_server(host='0.0.0.0', port=5025)
+            return
+        
+        from interface.flask_app import UniversityFlaskAPI
+        
         # 创建API实例
         api = UniversityFlaskAPI()
         
@@ -218,6 +218,127 @@ class LessonPlanningApp {
         }
     }
 
+    // 提交批量生成教案任务，通过SSE接收进度，结束后获取结果
+    async runLessonGenerationJob(additionalRequirements, onProgress = null) {
+        const submitted = await this.apiCall('/generate-all-lessons', 'POST', {
+            additional_requirements: additionalRequirements || ''
+        });
+        const jobId = submitted.job_id;
+        this.currentJobId = jobId;
+
+        try {
+            return await this.waitForJob(jobId, onProgress);
+        } finally {
+            this.currentJobId = null;
+        }
+    }
+
+    // 提交模板解析任务并等待结果，返回 {success, message, template_structure}
+    async runTemplateParseJob(onProgress = null) {
+        const submitted = await this.apiCall('/parse-template', 'POST', {});
+        const result = await this.waitForJob(submitted.job_id, onProgress);
+        return { success: true, ...result };
+    }
+
+    // 通过SSE接收后台任务进度，结束后获取任务结果
+    async waitForJob(jobId, onProgress = null) {
+        await new Promise((resolve) => {
+            const events = new EventSource(`${this.apiBaseUrl}/progress/${jobId}/events`);
+            const handleProgress = (event) => {
+                const data = JSON.parse(event.data);
+                if (onProgress && data.total !== undefined) {
+                    onProgress(data);
+                }
+            };
+            events.addEventListener('progress', handleProgress);
+            events.addEventListener('snapshot', handleProgress);
+            events.addEventListener('done', () => {
+                events.close();
+                resolve();
+            });
+            events.onerror = () => {
+                // 事件流不可用（如已被清理）时，直接以任务状态为准
+                if (events.readyState === EventSource.CLOSED) {
+                    resolve();
+                }
+            };
+        });
+
+        // 事件流结束后查询一次任务结果；若仍未结束则退回轮询
+        while (true) {
+            const { job } = await this.apiCall(`/jobs/${jobId}`, 'GET');
+            if (job.status === 'completed') {
+                return job.result;
+            }
+            if (job.status === 'failed') {
+                throw new Error(job.error || '任务执行失败');
+            }
+            if (job.status === 'cancelled') {
+                throw new Error('任务已取消');
+            }
+            if (onProgress && job.progress) {
+                onProgress(job.progress);
+            }
+            await new Promise(resolve => setTimeout(resolve, 1000));
+        }
+    }
+
+    // 取消正在进行的批量生成任务
+    async cancelLessonGenerationJob() {
+        if (!this.currentJobId) return;
+        try {
+            await this.apiCall(`/jobs/${this.currentJobId}/cancel`, 'POST');
+        } catch (error) {
+            console.error('取消任务失败:', error);
+        }
+    }
+
+    // 调用SSE流式接口：逐段回调文本，返回done事件的数据
+    async apiStream(endpoint, data, onToken) {
+        const response = await this.apiRequest(`${this.apiBaseUrl}${endpoint}`, {
+            method: 'POST',
+            body: JSON.stringify(data)
+        });
+        if (!response.ok) {
+            const result = await response.json().catch(() => ({}));
+            throw new Error(result.error || `HTTP ${response.status}`);
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            // 事件之间以空行分隔
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) >= 0) {
+                const rawEvent = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+
+                let eventType = 'message';
+                let payload = '';
+                rawEvent.split('\n').forEach(line => {
+                    if (line.startsWith('event: ')) eventType = line.slice(7);
+                    else if (line.startsWith('data: ')) payload += line.slice(6);
+                });
+                if (!payload) continue;
+
+                const eventData = JSON.parse(payload);
+                if (eventType === 'token') {
+                    onToken(eventData.text);
+                } else if (eventType === 'done') {
+                    return eventData;
+                } else if (eventType === 'error') {
+                    throw new Error(eventData.error);
+                }
+            }
+        }
+        throw new Error('连接已中断');
+    }
+
     // 状态管理
     async checkApiStatus() {
         try {
@@ -365,7 +486,7 @@ class LessonPlanningApp {
             if (!this.templateParsed) {
                 this.showLoading('🔄 **步骤 1/3**：正在解析模板结构...');
                 
-                const parseResult = await this.apiCall('/parse-template', 'POST', {});
+                const parseResult = await this.runTemplateParseJob();
                 
                 if (parseResult.success) {
                     this.templateParsed = true;
@@ -412,47 +533,27 @@ ${outline.course_objectives ? Object.values(outline.course_objectives).flat().sl
             // 步骤3：生成具体教案（带进度显示）
             this.showLoading('🔄 **步骤 3/3**：正在批量生成教案...\n⏱️ 这可能需要几分钟，请耐心等待');
             
-            // 启动进度轮询
-            const progressInterval = setInterval(async () => {
-                try {
-                    const progress = await this.apiCall('/lesson-generation-progress', 'GET');
+            const lessonsResult = await this.runLessonGenerationJob(
+                this.courseSettings.requirements || '',
+                (progress) => {
                     if (progress.current > 0 && progress.total > 0) {
                         this.updateLoadingProgress(
                             `🔄 **步骤 3/3**：正在生成教案 ${progress.current}/${progress.total}\n${progress.message || ''}`
                         );
                     }
-                } catch (error) {
-                    console.error('进度查询失败:', error);
                 }
-            }, 1000); // 每秒查询一次
+            );
             
-            try {
-                const lessonsResult = await this.apiCall('/generate-all-lessons', 'POST', {
-                    additional_requirements: this.courseSettings.requirements || ''
-                });
-                
-                // 停止进度轮询
-                clearInterval(progressInterval);
-                
-                if (lessonsResult.success) {
-                    this.updateLoadingToComplete('✅ **步骤 3/3**：教案生成完成');
-                    
-                    // 显示生成结果
-                    this.addMessage('assistant', `🎉 **生成成功**！
+            this.updateLoadingToComplete('✅ **步骤 3/3**：教案生成完成');
+            
+            // 显示生成结果
+            this.addMessage('assistant', `🎉 **生成成功**！
 - 共生成：${lessonsResult.total_count} 个教案
 - 格式：Word 文档
 
 💾 **下一步**：
 点击右上角的导出按钮下载教案文件。`);
-                    this.showNotification(`成功生成${lessonsResult.total_count}个教案`, 'success');
-                } else {
-                    this.hideLoading();
-                    throw new Error('教案生成失败：' + lessonsResult.error);
-                }
-            } catch (error) {
-                clearInterval(progressInterval);
-                throw error;
-            }
+            this.showNotification(`成功生成${lessonsResult.total_count}个教案`, 'success');
             
         } catch (error) {
             this.addMessage('assistant', `❌ **生成失败**：${error.message}
@@ -487,7 +588,7 @@ ${outline.course_objectives ? Object.values(outline.course_objectives).flat().sl
                 this.showLoading('📄 步骤 1/3：正在解析模板结构...');
                 this.addMessage('assistant', '🔄 开始解析模板...');
                 
-                const parseResult = await this.apiCall('/parse-template', 'POST', {});
+                const parseResult = await this.runTemplateParseJob();
                 
                 if (parseResult.success) {
                     this.templateParsed = true;
@@ -540,7 +641,7 @@ ${outline.course_objectives ? Object.values(outline.course_objectives).flat().sl
                 this.showLoading('📄 步骤 1/2：正在解析模板结构...');
                 this.addMessage('assistant', '🔄 开始解析模板...');
                 
-                const parseResult = await this.apiCall('/parse-template', 'POST', {});
+                const parseResult = await this.runTemplateParseJob();
                 
                 if (parseResult.success) {
                     this.templateParsed = true;
@@ -558,17 +659,15 @@ ${outline.course_objectives ? Object.values(outline.course_objectives).flat().sl
             this.showLoading('📝 步骤 2/2：正在生成教案，请稍候...');
             this.addMessage('assistant', '🔄 开始批量生成教案...\n这可能需要几分钟时间，请耐心等待。');
             
-            const result = await this.apiCall('/generate-all-lessons', 'POST', {
-                additional_requirements: additionalRequirements
+            const result = await this.runLessonGenerationJob(additionalRequirements, (progress) => {
+                if (progress.total > 0) {
+                    this.updateLoadingProgress(`📝 步骤 2/2：正在生成教案 ${progress.current}/${progress.total}...`);
+                }
             });
             
-            if (result.success) {
-                this.showNotification(`成功生成${result.total_count}个教案`, 'success');
-                this.addMessage('assistant', `✅ 教案生成完成！\n\n共生成 ${result.total_count} 个教案\n您可以点击右上角的导出按钮下载。`);
-                return result.lesson_plans;
-            } else {
-                throw new Error(result.error);
-            }
+            this.showNotification(`成功生成${result.total_count}个教案`, 'success');
+            this.addMessage('assistant', `✅ 教案生成完成！\n\n共生成 ${result.total_count} 个教案\n您可以点击右上角的导出按钮下载。`);
+            return result.lesson_plans;
         } catch (error) {
             this.showNotification(`教案生成失败: ${error.message}`, 'error');
             this.addMessage('assistant', `❌ 错误：${error.message}`);
@@ -708,14 +807,18 @@ ${outline.course_objectives ? Object.values(outline.course_objectives).flat().sl
                 return;
             }
             
-            // 如果不是教案相关命令，进行普通对话
-            const chatResult = await this.apiCall('/chat', 'POST', { message });
-            
-            if (chatResult.success) {
-                this.addMessage('assistant', chatResult.response);
-            } else {
-                throw new Error(chatResult.error);
-            }
+            // 如果不是教案相关命令，进行普通对话（流式显示回复）
+            let replyElement = null;
+            let replyText = '';
+            await this.apiStream('/chat/stream', { message }, (text) => {
+                if (!replyElement) {
+                    this.hideTypingIndicator();
+                    replyElement = this.addMessage('assistant', '');
+                }
+                replyText += text;
+                replyElement.textContent = replyText;
+                this.scrollToBottom();
+            });
             
         } catch (error) {
             this.addMessage('assistant', `抱歉，处理您的请求时出现了错误：${error.message}`);
@@ -812,6 +915,8 @@ ${outline.course_objectives ? Object.values(outline.course_objectives).flat().sl
         requestAnimationFrame(() => {
             messagesContainer.scrollTop = messagesContainer.scrollHeight;
         });
+        
+        return messageText;
     }
 
     showTypingIndicator() {
@@ -0,0 +1,31 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# 与启动脚本一致：以项目根目录作为导入路径
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+class FakeClock:
+    """Stand-in for time.time / time.monotonic that only moves when ``now`` is changed"""
+
+    def __init__(self, now: float):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def fake_clock(monkeypatch):
+    """
+    Factory patching ``module.time.<attr>`` with a FakeClock
+
+    Usage: ``clock = fake_clock(llm_policy, 'time')``, then ``clock.now += 60``.
+    """
+    def patch(module, attr: str = 'time', start: float = 1000.0) -> FakeClock:
+        clock = FakeClock(start)
+        monkeypatch.setattr(module.time, attr, clock)
+        return clock
+    return patch
@@ -0,0 +1,93 @@
+import zipfile
+
+import pytest
+
+from utils.docx_scanner import scan_docx_placeholders
+
+NAMESPACES = (
+    'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main" '
+    'xmlns:mc="http://schemas.openxmlformats.org/markup-compatibility/2006"'
+)
+
+
+def paragraph(*runs):
+    return '<w:p>' + ''.join(f'<w:r><w:t xml:space="preserve">{text}</w:t></w:r>' for text in runs) + '</w:p>'
+
+
+def part(body):
+    return f'<?xml version="1.0" encoding="UTF-8"?><w:document {NAMESPACES}><w:body>{body}</w:body></w:document>'
+
+
+def header(body):
+    return f'<?xml version="1.0" encoding="UTF-8"?><w:hdr {NAMESPACES}>{body}</w:hdr>'
+
+
+def textbox(body):
+    return (f'<w:p><w:r><w:drawing><w:txbxContent>{body}</w:txbxContent></w:drawing></w:r></w:p>')
+
+
+def make_docx(path, document, **parts):
+    with zipfile.ZipFile(path, 'w') as zf:
+        zf.writestr('word/document.xml', document)
+        for name, xml in parts.items():
+            zf.writestr(f'word/{name}.xml', xml)
+    return str(path)
+
+
+def test_finds_placeholders_in_paragraphs_and_tables(tmp_path):
+    table = ('<w:tbl><w:tr><w:tc>' + paragraph('课程：') + '</w:tc><w:tc>' + paragraph('{{course_name}}') +
+             '</w:tc></w:tr><w:tr><w:tc>' + paragraph('{{ teacher }}') + '</w:tc></w:tr></w:tbl>')
+    path = make_docx(tmp_path / 't.docx', part(paragraph('标题 {{title}}') + table))
+
+    scan = scan_docx_placeholders(path)
+    assert scan['tags'] == ['title', 'course_name', 'teacher']
+    title, course, teacher = scan['locations']
+    assert title == {'tag': 'title', 'raw': 'title', 'part': 'word/document.xml', 'paragraph': 0}
+    assert (course['table'], course['row'], course['cell']) == (0, 0, 1)
+    assert (teacher['table'], teacher['row'], teacher['cell']) == (0, 1, 0)
+    assert teacher['raw'] == ' teacher '
+
+
+def test_joins_placeholders_split_across_runs(tmp_path):
+    path = make_docx(tmp_path / 't.docx', part(paragraph('{{cour', 'se_na', 'me}}') + paragraph('{', '{x}}')))
+    assert scan_docx_placeholders(path)['tags'] == ['course_name', 'x']
+
+
+def test_document_part_comes_before_headers_and_footers(tmp_path):
+    path = make_docx(
+        tmp_path / 't.docx', part(paragraph('{{body}}')),
+        footer1=header(paragraph('{{footer}}')), header1=header(paragraph('{{header}}'))
+    )
+    scan = scan_docx_placeholders(path)
+    assert scan['tags'] == ['body', 'header', 'footer']
+    assert [location['part'] for location in scan['locations']] == [
+        'word/document.xml', 'word/header1.xml', 'word/footer1.xml'
+    ]
+
+
+def test_skips_text_boxes_and_alternate_content_fallback(tmp_path):
+    alternate = (
+        '<w:p><w:r><mc:AlternateContent>'
+        '<mc:Choice Requires="wps"><w:drawing><w:txbxContent>' + paragraph('{{boxed}}') +
+        '</w:txbxContent></w:drawing></mc:Choice>'
+        '<mc:Fallback><w:pict>' + paragraph('{{boxed}}') + '</w:pict></mc:Fallback>'
+        '</mc:AlternateContent></w:r><w:r><w:t>{{after}}</w:t></w:r></w:p>'
+    )
+    body = paragraph('{{before}}') + textbox(paragraph('{{in_box}}')) + alternate
+    scan = scan_docx_placeholders(make_docx(tmp_path / 't.docx', part(body)))
+
+    assert scan['tags'] == ['before', 'after']
+    # 文本框内的段落不计入段落序号
+    assert [location['paragraph'] for location in scan['locations']] == [0, 2]
+
+
+def test_rejects_files_that_are_not_docx(tmp_path):
+    path = tmp_path / 'old.doc'
+    path.write_bytes(b'\xd0\xcf\x11\xe0 not a zip')
+    with pytest.raises(ValueError):
+        scan_docx_placeholders(str(path))
+
+    with zipfile.ZipFile(tmp_path / 'empty.docx', 'w') as zf:
+        zf.writestr('[Content_Types].xml', '<Types/>')
+    with pytest.raises(ValueError):
+        scan_docx_placeholders(str(tmp_path / 'empty.docx'))
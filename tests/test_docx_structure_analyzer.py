@@ -0,0 +1,147 @@
+import pytest
+from docx import Document
+
+from utils.docx_structure_analyzer import analyze_docx_structure
+
+
+class TemplateBuilder:
+    """Builds a lesson plan template: cover paragraphs followed by one 4-column table"""
+
+    def __init__(self, *cover):
+        self.document = Document()
+        for text in cover:
+            self.document.add_paragraph(text)
+        self.table = None
+
+    def row(self, *cells):
+        if self.table is None:
+            self.table = self.document.add_table(rows=0, cols=4)
+        row = self.table.add_row().cells
+        if len(cells) == 1:
+            # 整行合并：分节标题 / 教学阶段
+            row[0].merge(row[3]).text = cells[0]
+        else:
+            for cell, text in zip(row, cells):
+                cell.text = text
+        return self
+
+    def save(self, tmp_path, name='template.docx'):
+        path = tmp_path / name
+        self.document.save(path)
+        return str(path)
+
+
+def full_template():
+    return (TemplateBuilder('某某大学教案', '2025-2026学年第一学期', '课程名称：{{course_name}}  授课教师：')
+            .row('授课时间', '年 月 日 第 周 星期 第 节', '', '')
+            .row('教学目标', '知识目标', '', '')
+            .row('教学目标', '能力目标', '', '')
+            .row('教学目标', '思政目标', '', '')
+            .row('教学重点', '描述', '解决措施', '')
+            .row('教学难点', '描述', '解决措施', '')
+            .row('教学方法', '教法', '学法', '')
+            .row('教学资源', '如：PPT、视频', '', '')
+            .row('教学内容及过程')
+            .row('教学环节', '教学内容', '教师活动', '学生活动')
+            .row('课前预习')
+            .row('自主学习（10分钟）', '', '', '')
+            .row('课中实施')
+            .row('导入（5分钟）', '', '', '')
+            .row('新授（30分钟）', '', '', '')
+            .row('……', '', '', '')
+            .row('教学反思')
+            .row('目标达成', '', '', ''))
+
+
+def test_full_template_is_recognized_with_full_confidence(tmp_path):
+    result = analyze_docx_structure(full_template().save(tmp_path))
+
+    assert result['confidence'] == 1.0
+    signals = result['signals']
+    assert signals['rows'] == signals['rows_recognized'] == 18
+    assert (signals['phases'], signals['stages'], signals['process_columns']) == (2, 3, 3)
+
+    structure = result['template_structure']
+    assert structure['template_metadata']['institution'] == '某某大学'
+    assert structure['template_metadata']['analysis_method'] == 'structure'
+    assert structure['cover_page']['basic_fields'] == ['课程名称', '授课教师']
+
+    main_table = structure['main_table_structure']
+    assert main_table['header_section']['time_info'] == ['年月日', '第几周', '星期几', '第几节']
+    objectives = main_table['teaching_objectives_section']
+    assert list(objectives['objective_categories'].values()) == ['知识目标', '能力目标', '思政目标']
+    assert objectives['has_ideological_elements'] is True
+    key_points = main_table['key_difficult_section']['teaching_key_points']
+    assert key_points['has_description'] and key_points['has_solution']
+
+    process = main_table['teaching_process_section']
+    assert process['section_name'] == '教学内容及过程'
+    assert process['phase_1']['phase_name'] == '课前预习'
+    assert process['phase_2']['stages'] == [
+        {'stage_name': '导入', 'time_minutes': '5分钟', 'columns': ['教学内容', '教师活动', '学生活动']},
+        {'stage_name': '新授', 'time_minutes': '30分钟', 'columns': ['教学内容', '教师活动', '学生活动']},
+    ]
+    assert main_table['teaching_reflection_section']['sub_sections'] == [{'name': '目标达成'}]
+
+
+def test_process_without_phase_rows_becomes_a_single_phase(tmp_path):
+    builder = (TemplateBuilder()
+               .row('教学目标', '知识目标', '', '')
+               .row('教学重点', '', '', '')
+               .row('教学方法', '', '', '')
+               .row('教学过程')
+               .row('教学环节', '时间', '教学内容', '师生活动')
+               .row('导入', '5分钟', '', '')
+               .row('新授', '30分钟', '', ''))
+    result = analyze_docx_structure(builder.save(tmp_path))
+
+    process = result['template_structure']['main_table_structure']['teaching_process_section']
+    assert process['phase_1']['phase_name'] == '教学过程'
+    assert [stage['stage_name'] for stage in process['phase_1']['stages']] == ['导入', '新授']
+    assert result['confidence'] == 1.0
+
+
+def test_unrecognized_rows_are_reported_as_other_fields(tmp_path):
+    builder = TemplateBuilder().row('备注', '', '', '').row('审核意见', '', '', '')
+    result = analyze_docx_structure(builder.save(tmp_path))
+
+    assert result['signals']['rows_recognized'] == 0
+    assert result['template_structure']['main_table_structure']['other_fields'] == ['备注', '审核意见']
+    assert result['confidence'] == 0.0
+
+
+def test_confidence_is_capped_without_teaching_stages(tmp_path):
+    builder = (TemplateBuilder()
+               .row('教学目标', '知识目标', '', '')
+               .row('教学重点', '', '', '')
+               .row('教学难点', '', '', '')
+               .row('教学方法', '', '', '')
+               .row('教学资源', '', '', ''))
+    result = analyze_docx_structure(builder.save(tmp_path))
+
+    assert result['signals']['rows_recognized'] == result['signals']['rows'] == 5
+    # 行全部识别、三个部分齐全（0.4 + 0.45），但没有教学环节时最多0.5
+    assert result['confidence'] == 0.5
+
+
+def test_partial_template_is_scored_by_coverage_and_sections(tmp_path):
+    builder = (TemplateBuilder()
+               .row('教学目标', '知识目标', '', '')
+               .row('备注', '', '', '')
+               .row('教学过程')
+               .row('教学环节', '教学内容', '教师活动', '学生活动')
+               .row('导入（5分钟）', '', '', ''))
+    result = analyze_docx_structure(builder.save(tmp_path))
+
+    # 行识别 4/5，关键部分 2/4（教学目标、教学过程）
+    assert result['confidence'] == pytest.approx(round(0.4 * 4 / 5 + 0.6 * 2 / 4, 2))
+
+
+def test_document_without_tables_has_zero_confidence(tmp_path):
+    builder = TemplateBuilder('教案', '课程名称：', '授课教师：')
+    result = analyze_docx_structure(builder.save(tmp_path))
+
+    assert result['confidence'] == 0.0
+    assert result['signals']['tables'] == 0
+    assert result['template_structure']['main_table_structure'] == {}
+    assert result['template_structure']['cover_page']['basic_fields'] == ['课程名称', '授课教师']
@@ -0,0 +1,174 @@
+import asyncio
+
+import pytest
+
+from utils import llm_policy
+from utils.llm_policy import (
+    CircuitBreaker, CircuitOpenError, LLMTimeoutError, ResilientChatModel, provider_request_timeout
+)
+
+POLICY = {
+    'timeout': 0.05,
+    'max_retries': 2,
+    'backoff_base': 0.0,
+    'backoff_max': 0.0,
+    'breaker_threshold': 3,
+    'breaker_reset': 60,
+}
+
+
+@pytest.fixture
+def clock(fake_clock):
+    return fake_clock(llm_policy, 'time')
+
+
+class FakeModel:
+    """Returns (or raises) the scripted results in order"""
+
+    model_name = 'fake-model'
+
+    def __init__(self, *results, delay=0.0):
+        self.results = list(results)
+        self.delay = delay
+        self.calls = 0
+
+    async def ainvoke(self, messages, **kwargs):
+        self.calls += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def make_model(*results, delay=0.0, breaker=None):
+    model = FakeModel(*results, delay=delay)
+    breaker = breaker or CircuitBreaker('fake-model', failure_threshold=3, reset_timeout=60)
+    return model, ResilientChatModel(model, policy=POLICY, breaker=breaker)
+
+
+# ---------------------------------------------------------------- CircuitBreaker
+
+def test_breaker_opens_after_threshold(clock):
+    breaker = CircuitBreaker('m', failure_threshold=3, reset_timeout=60)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    assert breaker.stats()['rejected'] == 1
+
+
+def test_breaker_success_resets_failure_count(clock):
+    breaker = CircuitBreaker('m', failure_threshold=2, reset_timeout=60)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_breaker_half_open_lets_a_single_trial_through(clock):
+    breaker = CircuitBreaker('m', failure_threshold=1, reset_timeout=60)
+    breaker.record_failure()
+    clock.now += 59
+    assert not breaker.allow()
+
+    clock.now += 1
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # 试探调用进行中，其余调用继续被拒绝
+    assert not breaker.allow()
+    assert not breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+    assert breaker.allow()
+
+
+def test_breaker_failed_trial_reopens(clock):
+    breaker = CircuitBreaker('m', failure_threshold=1, reset_timeout=60)
+    breaker.record_failure()
+    clock.now += 60
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    # 重新计时后再放行一次试探
+    clock.now += 60
+    assert breaker.allow()
+    assert not breaker.allow()
+
+
+def test_breaker_released_trial_lets_next_caller_try(clock):
+    breaker = CircuitBreaker('m', failure_threshold=1, reset_timeout=60)
+    breaker.record_failure()
+    clock.now += 60
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()
+
+
+# ---------------------------------------------------------------- ResilientChatModel
+
+def test_retries_retryable_errors_then_succeeds():
+    model, resilient = make_model(ConnectionError('reset'), RuntimeError('HTTP 503'), 'ok')
+    assert asyncio.run(resilient.ainvoke([])) == 'ok'
+    assert model.calls == 3
+    assert resilient.breaker.state == CircuitBreaker.CLOSED
+    assert resilient.breaker.failures == 0
+
+
+def test_gives_up_after_max_retries():
+    model, resilient = make_model(*[ConnectionError('reset')] * 3)
+    with pytest.raises(ConnectionError):
+        asyncio.run(resilient.ainvoke([]))
+    assert model.calls == POLICY['max_retries'] + 1
+
+
+def test_non_retryable_error_is_raised_immediately():
+    model, resilient = make_model(ValueError('invalid parameter'), 'ok')
+    with pytest.raises(ValueError):
+        asyncio.run(resilient.ainvoke([]))
+    assert model.calls == 1
+    assert resilient.breaker.failures == 0
+
+
+def test_attempt_deadline_raises_timeout_error():
+    model, resilient = make_model('late', 'late', 'late', delay=1.0)
+    with pytest.raises(LLMTimeoutError):
+        asyncio.run(resilient.ainvoke([]))
+    assert model.calls == POLICY['max_retries'] + 1
+
+
+def test_open_breaker_rejects_without_calling_the_model():
+    breaker = CircuitBreaker('fake-model', failure_threshold=1, reset_timeout=60)
+    breaker.record_failure()
+    model, resilient = make_model('ok', breaker=breaker)
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(resilient.ainvoke([]))
+    assert model.calls == 0
+
+
+def test_half_open_trial_released_on_non_retryable_error(clock):
+    breaker = CircuitBreaker('fake-model', failure_threshold=1, reset_timeout=60)
+    breaker.record_failure()
+    clock.now += 60
+    model, resilient = make_model(ValueError('invalid parameter'), 'ok', breaker=breaker)
+    with pytest.raises(ValueError):
+        asyncio.run(resilient.ainvoke([]))
+    # 没有结论的试探调用不会让熔断器一直拒绝
+    assert asyncio.run(resilient.ainvoke([])) == 'ok'
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_provider_request_timeout_follows_call_policy():
+    assert provider_request_timeout('qwen-vl-plus') == 180
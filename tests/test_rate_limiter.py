@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from utils import rate_limiter
+from utils.rate_limiter import ModelRateLimiter, TokenBucket
+
+
+@pytest.fixture
+def clock(fake_clock):
+    return fake_clock(rate_limiter, 'monotonic')
+
+
+def test_bucket_starts_full(clock):
+    bucket = TokenBucket(60)
+    for _ in range(60):
+        assert bucket.reserve(1) == 0.0
+    # 每秒补充1个，第61个请求需等待1秒
+    assert bucket.reserve(1) == pytest.approx(1.0)
+
+
+def test_waiters_queue_behind_earlier_debt(clock):
+    bucket = TokenBucket(60)
+    bucket.reserve(60)
+    assert bucket.reserve(1) == pytest.approx(1.0)
+    assert bucket.reserve(1) == pytest.approx(2.0)
+    assert bucket.reserve(3) == pytest.approx(5.0)
+
+
+def test_bucket_refills_over_time_up_to_capacity(clock):
+    bucket = TokenBucket(60)
+    bucket.reserve(60)
+    clock.now += 30
+    assert bucket.reserve(30) == 0.0
+    assert bucket.reserve(1) == pytest.approx(1.0)
+
+    clock.now += 3600
+    bucket.reserve(0)
+    assert bucket.tokens == pytest.approx(60)
+
+
+def test_oversized_reservation_is_capped_at_capacity(clock):
+    bucket = TokenBucket(600)
+    # 超过容量的请求按整桶计，不会永远等待
+    assert bucket.reserve(10000) == 0.0
+    assert bucket.reserve(10) == pytest.approx(1.0)
+
+
+def test_adjust_corrects_an_estimate(clock):
+    bucket = TokenBucket(600)
+    bucket.reserve(500)
+    bucket.adjust(-400)    # 实际用量比预估少400
+    assert bucket.tokens == pytest.approx(500)
+    bucket.adjust(1000)    # 实际用量比预估多1000
+    assert bucket.reserve(0) == pytest.approx(50.0)
+    bucket.adjust(-10000)
+    assert bucket.tokens == pytest.approx(600)
+
+
+def test_slot_corrects_token_bucket_with_reported_usage(clock):
+    limiter = ModelRateLimiter('m', rpm=60, tpm=1000)
+
+    async def call():
+        async with limiter.slot(400) as usage:
+            usage['total_tokens'] = 100
+
+    asyncio.run(call())
+    assert limiter.tokens.tokens == pytest.approx(900)
+    assert limiter.requests.tokens == pytest.approx(59)
+    stats = limiter.stats()
+    assert (stats['acquired'], stats['in_flight'], stats['queue_depth'], stats['throttled']) == (1, 0, 0, 0)
+
+
+def test_slot_limits_concurrency():
+    limiter = ModelRateLimiter('m', max_concurrency=2)
+    peak = 0
+
+    async def call():
+        nonlocal peak
+        async with limiter.slot(1):
+            peak = max(peak, limiter.in_flight)
+            await asyncio.sleep(0.01)
+
+    async def main():
+        await asyncio.gather(*(call() for _ in range(6)))
+
+    asyncio.run(main())
+    assert peak == 2
+    assert limiter.stats()['acquired'] == 6
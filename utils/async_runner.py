@@ -0,0 +1,126 @@
+"""Shared background event loop for running coroutines from synchronous code"""
+
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import AsyncIterator, Iterator
+
+from config.settings import ASYNC_LOOP_EXECUTOR_WORKERS
+
+
+async def _run_with_context(coro, context: contextvars.Context):
+    """Apply the submitting thread's context variables inside the loop task, then run the coroutine"""
+    for var, value in context.items():
+        var.set(value)
+    return await coro
+
+
+class BackgroundEventLoop:
+    """
+    A long-lived asyncio loop running in a daemon thread
+
+    Flask handlers and worker threads submit coroutines here instead of
+    creating and closing a loop per call, so loop-bound resources (the
+    default executor used by ChatTongyi.ainvoke, HTTP clients and their
+    connection pools) are created once and reused across requests.
+    Coroutines must not block: wrap CPU or file work in asyncio.to_thread.
+    """
+
+    def __init__(self, executor_workers: int = None):
+        self.executor_workers = executor_workers or ASYNC_LOOP_EXECUTOR_WORKERS
+        self._loop = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self) -> asyncio.AbstractEventLoop:
+        # gunicorn fork后子进程不会继承运行中的线程，需要按进程重新启动
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid() or not self._thread.is_alive():
+                loop = asyncio.new_event_loop()
+                loop.set_default_executor(ThreadPoolExecutor(
+                    max_workers=self.executor_workers, thread_name_prefix='async-io'
+                ))
+                ready = threading.Event()
+
+                def run():
+                    asyncio.set_event_loop(loop)
+                    loop.call_soon(ready.set)
+                    loop.run_forever()
+
+                thread = threading.Thread(target=run, name='async-loop', daemon=True)
+                thread.start()
+                ready.wait()
+                self._loop, self._thread, self._pid = loop, thread, os.getpid()
+                print(f"🔁 后台事件循环已启动 (pid={self._pid})")
+            return self._loop
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return self._ensure_started()
+
+    def submit(self, coro) -> Future:
+        """
+        Schedule a coroutine on the loop; cancelling the returned future cancels the task
+
+        Context variables of the calling thread (e.g. the token usage scope)
+        are carried over to the task.
+        """
+        return asyncio.run_coroutine_threadsafe(
+            _run_with_context(coro, contextvars.copy_context()), self._ensure_started()
+        )
+
+    def run(self, coro, timeout: float = None):
+        """
+        Run a coroutine on the loop and block until it finishes
+
+        Raises:
+            RuntimeError: when called from the loop thread itself (it would
+                          wait forever for a task that can never run); async
+                          code must await the coroutine instead
+        """
+        if self._thread is not None and threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError("BackgroundEventLoop.run() called from the event loop thread; "
+                               "await the coroutine instead")
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except BaseException:
+            future.cancel()
+            raise
+
+    def iter_async(self, agen: AsyncIterator) -> Iterator:
+        """Iterate an async generator from synchronous code (e.g. a streaming response)"""
+        try:
+            while True:
+                try:
+                    yield self.run(agen.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            # 客户端断开时关闭生成器，使其finally逻辑在事件循环中执行
+            self.run(agen.aclose())
+
+    def stop(self):
+        """Stop the loop thread (used on shutdown)"""
+        with self._lock:
+            if self._loop is not None and self._loop.is_running():
+                self._loop.call_soon_threadsafe(self._loop.stop)
+                self._thread.join(timeout=5)
+            self._loop = None
+
+
+_default_runner = BackgroundEventLoop()
+
+
+def get_event_loop_runner() -> BackgroundEventLoop:
+    """Return the process-wide background event loop"""
+    return _default_runner
+
+
+def run_async(coro, timeout: float = None):
+    """Run a coroutine on the shared background loop and return its result"""
+    return _default_runner.run(coro, timeout)
@@ -0,0 +1,120 @@
+"""
+Fast {{placeholder}} discovery by streaming the XML parts of a .docx
+
+Reads word/document.xml and the header/footer parts straight from the zip
+archive with an incremental parser instead of building a python-docx or
+docxtpl object model. Text of all runs in a paragraph is joined before
+matching, so placeholders that Word split across several runs (spell check,
+formatting changes, revisions) are still found.
+
+Text boxes (w:txbxContent) and the mc:Fallback copy of alternate content are
+skipped: the template fillers only fill body, table, header and footer
+paragraphs, and the fallback would count every placeholder a second time.
+"""
+
+import re
+import zipfile
+from typing import Dict, Iterator, List
+from xml.etree.ElementTree import iterparse
+
+W_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+MC_NS = '{http://schemas.openxmlformats.org/markup-compatibility/2006}'
+_P, _T, _TBL, _TR, _TC = (W_NS + name for name in ('p', 't', 'tbl', 'tr', 'tc'))
+_SKIPPED = {W_NS + 'txbxContent', MC_NS + 'Fallback'}
+
+PLACEHOLDER_PATTERN = re.compile(r'\{\{([^{}]+)\}\}')
+_HEADER_FOOTER_PART = re.compile(r'^word/(header|footer)\d*\.xml$')
+
+
+def docx_text_parts(zf: zipfile.ZipFile) -> List[str]:
+    """Return the main document part followed by header and footer parts"""
+    names = zf.namelist()
+    if 'word/document.xml' not in names:
+        raise ValueError("不是有效的.docx文件: 缺少word/document.xml")
+    parts = [n for n in names if _HEADER_FOOTER_PART.match(n)]
+    return ['word/document.xml'] + sorted(parts, key=lambda n: (not n.startswith('word/header'), n))
+
+
+def _scan_part(stream, part: str) -> Iterator[Dict]:
+    """Yield one location dict per placeholder found in a part"""
+    paragraphs = []   # 嵌套段落各自累积文本
+    tables = []       # 嵌套表格的 {table,row,cell} 游标
+    table_count = 0
+    paragraph_count = 0
+    skipped = 0       # 位于文本框 / mc:Fallback 内的层数
+
+    for event, elem in iterparse(stream, events=('start', 'end')):
+        tag = elem.tag
+        if tag in _SKIPPED:
+            skipped += 1 if event == 'start' else -1
+            continue
+        if skipped:
+            continue
+        if event == 'start':
+            if tag == _P:
+                paragraphs.append((paragraph_count, []))
+                paragraph_count += 1
+            elif tag == _TBL:
+                tables.append({'table': table_count, 'row': -1, 'cell': -1})
+                table_count += 1
+            elif tag == _TR and tables:
+                tables[-1]['row'] += 1
+                tables[-1]['cell'] = -1
+            elif tag == _TC and tables:
+                tables[-1]['cell'] += 1
+            continue
+
+        if tag == _T:
+            if paragraphs and elem.text:
+                paragraphs[-1][1].append(elem.text)
+        elif tag == _P:
+            index, texts = paragraphs.pop()
+            text = ''.join(texts)
+            if '{{' in text:
+                for match in PLACEHOLDER_PATTERN.finditer(text):
+                    location = {
+                        'tag': match.group(1).strip(),
+                        'raw': match.group(1),
+                        'part': part,
+                        'paragraph': index
+                    }
+                    if tables:
+                        location.update(tables[-1])
+                    yield location
+            # 段落处理完即释放其子元素，大文档也只占用少量内存
+            elem.clear()
+        elif tag == _TBL:
+            tables.pop()
+
+
+def scan_docx_placeholders(docx_path: str) -> Dict:
+    """
+    Find all {{...}} placeholders of a .docx file
+
+    Args:
+        docx_path: Path of the .docx file
+
+    Returns:
+        {
+            'tags': placeholder names (stripped) in order of first appearance,
+            'locations': [{'tag', 'raw', 'part', 'paragraph', and for cells
+                           'table', 'row', 'cell'}, ...]
+        }
+        ``raw`` is the text between the braces as written (including spaces);
+        ``paragraph`` counts the paragraphs of the part in document order
+        (text boxes and mc:Fallback content are not scanned).
+
+    Raises:
+        ValueError: The file is not a valid .docx archive
+    """
+    try:
+        with zipfile.ZipFile(docx_path, 'r') as zf:
+            locations = []
+            for part in docx_text_parts(zf):
+                with zf.open(part) as stream:
+                    locations.extend(_scan_part(stream, part))
+    except zipfile.BadZipFile:
+        raise ValueError("不是有效的.docx文件: 文件可能是旧的.doc格式或已损坏")
+
+    tags = list(dict.fromkeys(location['tag'] for location in locations))
+    return {'tags': tags, 'locations': locations}
@@ -0,0 +1,295 @@
+"""
+Structural (non-visual) template analysis for .docx lesson plan templates
+
+Builds the same template schema the vision model returns (cover_page,
+main_table_structure, ...) directly from the document's paragraphs and
+tables: row labels, horizontally merged cells, full-width section rows and
+column header rows. A confidence score tells the caller whether the result
+can be used as-is or the vision model should be consulted.
+"""
+
+import re
+from typing import Dict, List, Optional
+
+from utils.word_tag_inserter import WordTagInserter
+
+_PLACEHOLDER = re.compile(r'\{\{[^{}]*\}\}')
+_COVER_LABEL = re.compile(r'([一-龥A-Za-z][一-龥A-Za-z 　\t]{0,15}?)\s*[：:]')
+_STAGE_TIME = re.compile(r'[（(]\s*([\dXx一二三四五六七八九十]+)\s*分钟\s*[)）]')
+_ELLIPSIS = re.compile(r'^[.…。·、\s]*$')
+
+# 教学过程表格的常见列名，用于识别列标题行
+_PROCESS_COLUMN_WORDS = ('教学内容', '教师活动', '学生活动', '设计意图', '教学环节', '时间', '环节')
+_PROCESS_SECTION_WORDS = ('教学内容及过程', '教学过程', '教学内容与过程', '教学设计')
+_REFLECTION_WORDS = ('教学反思', '课后反思', '反思')
+_TIME_UNITS = (('年', '年月日'), ('周', '第几周'), ('星期', '星期几'), ('节', '第几节'))
+
+
+def _normalize(text: str) -> str:
+    """Strip placeholders and all whitespace (labels like "学    分" become "学分")"""
+    return re.sub(r'\s+', '', _PLACEHOLDER.sub('', text or ''))
+
+
+def _row_cells(row: List[Dict]) -> List[str]:
+    """Texts of the distinct cells of a row (horizontally merged cells counted once)"""
+    return [cell['text'] for cell in row if not cell['is_merged']]
+
+
+def _is_column_header(cells: List[str]) -> bool:
+    names = [_normalize(text) for text in cells]
+    hits = sum(1 for name in names if any(word == name or word in name for word in _PROCESS_COLUMN_WORDS))
+    return len(names) >= 3 and hits >= max(2, len(names) - 1)
+
+
+def _split_stage_label(label: str) -> Dict:
+    match = _STAGE_TIME.search(label)
+    if not match:
+        return {'stage_name': _normalize(label)}
+    return {
+        'stage_name': _normalize(label[:match.start()] + label[match.end():]),
+        'time_minutes': f"{match.group(1).upper()}分钟"
+    }
+
+
+def _cover_fields(paragraphs: List[str]) -> List[str]:
+    fields = []
+    for text in paragraphs:
+        for match in _COVER_LABEL.finditer(text):
+            name = _normalize(match.group(1))
+            if name and name not in fields:
+                fields.append(name)
+    return fields
+
+
+def _template_metadata(paragraphs: List[str]) -> Dict:
+    metadata = {'institution': '', 'template_type': '', 'academic_year': ''}
+    for text in paragraphs:
+        name = _normalize(text)
+        if not name:
+            continue
+        if not metadata['template_type'] and len(name) <= 12 and '：' not in text and ':' not in text:
+            metadata['template_type'] = name
+        if not metadata['academic_year'] and ('学年' in name or '学期' in name):
+            metadata['academic_year'] = name
+        match = re.search(r'[一-龥]{2,20}?(大学|学院|学校)', name)
+        if not metadata['institution'] and match:
+            metadata['institution'] = match.group(0)
+    return metadata
+
+
+class _TableWalker:
+    """Walks the rows of the main table and fills in the main_table_structure sections"""
+
+    def __init__(self):
+        self.header_section = {}
+        self.objectives = {}
+        self.key_difficult = {}
+        self.method_resource = {}
+        self.process = {}
+        self.reflection = {}
+        self.other_fields = []
+        self.rows_total = 0
+        self.rows_recognized = 0
+        self._area = None          # None / 'process' / 'reflection'
+        self._phase = None
+        self._columns = []
+
+    def walk(self, table: Dict):
+        for row in table['cells']:
+            cells = _row_cells(row)
+            if not any(_normalize(text) for text in cells):
+                continue
+            self.rows_total += 1
+            if self._walk_row(cells):
+                self.rows_recognized += 1
+
+    def _walk_row(self, cells: List[str]) -> bool:
+        label = _normalize(cells[0])
+        values = cells[1:]
+
+        # 整行合并的单元格是分节标题（教学内容及过程、课前预习、教学反思……）
+        if len(cells) == 1:
+            return self._section_row(label)
+
+        if self._area == 'process':
+            if _is_column_header(cells):
+                self._columns = [_normalize(text) for text in cells[1:]]
+                if self._phase is not None:
+                    self._phase['columns'] = self._columns
+                return True
+            if _ELLIPSIS.match(label):
+                return True
+            if self._phase is None:
+                # 没有分阶段的模板：整个教学过程作为一个阶段
+                self._start_phase(self.process['section_name'])
+            stage = _split_stage_label(cells[0])
+            stage['columns'] = list(self._columns)
+            examples = {column: text.strip() for column, text in zip(self._columns, values)
+                        if _normalize(text)}
+            if examples:
+                stage['examples'] = examples
+            self._phase['stages'].append(stage)
+            return True
+
+        if self._area == 'reflection':
+            self.reflection.setdefault('sub_sections', []).append({'name': label})
+            return True
+
+        return self._field_row(label, values)
+
+    def _section_row(self, label: str) -> bool:
+        if any(word in label for word in _PROCESS_SECTION_WORDS):
+            self._area = 'process'
+            self.process['section_name'] = label
+            return True
+        if any(word in label for word in _REFLECTION_WORDS):
+            self._area = 'reflection'
+            self.reflection = {'section_name': label, 'sub_sections': []}
+            return True
+        if self._area == 'process':
+            self._start_phase(label)
+            return True
+        self.other_fields.append(label)
+        return False
+
+    def _start_phase(self, name: str):
+        index = len([k for k in self.process if k.startswith('phase_')]) + 1
+        self._phase = {'phase_name': name, 'columns': list(self._columns), 'stages': []}
+        self.process[f'phase_{index}'] = self._phase
+
+    def _field_row(self, label: str, values: List[str]) -> bool:
+        names = [_normalize(text) for text in values]
+
+        if '授课时间' in label or label == '时间':
+            text = ''.join(values)
+            units = [field for unit, field in _TIME_UNITS if unit in text]
+            self.header_section['time_info'] = units or [label]
+            return True
+        if '章节' in label and '目标' not in label:
+            self.header_section['chapter_info'] = [label]
+            return True
+
+        if '目标' in label:
+            self.objectives.setdefault('section_name', label)
+            category = names[0] if names and names[0] else ''
+            categories = self.objectives.setdefault('objective_categories', {}) if category else {}
+            if category and category not in categories.values():
+                categories[f'category_{len(categories) + 1}'] = category
+            if '思政' in category:
+                self.objectives['has_ideological_elements'] = True
+            return True
+        if '思政' in label:
+            self.objectives['has_ideological_elements'] = True
+            self.objectives['ideological_section_name'] = label
+            return True
+
+        for word, key in (('重点', 'teaching_key_points'), ('难点', 'teaching_difficult_points')):
+            if word in label:
+                field = self.key_difficult.setdefault(key, {'field_name': label, 'columns': []})
+                # 带“描述/措施”的是表头行，下一行是填写区
+                if any('描述' in name or '措施' in name for name in names):
+                    field['columns'] = [name for name in names if name]
+                field['has_description'] = any('描述' in name for name in field['columns']) or not field['columns']
+                field['has_solution'] = any('措施' in name for name in field['columns'])
+                return True
+
+        if '方法' in label or label in ('教法学法', '教法', '学法'):
+            columns = [name for name in names if name and len(name) <= 6]
+            self.method_resource['teaching_methods'] = {
+                'field_name': label,
+                'has_sub_columns': bool(columns),
+                'columns': columns
+            }
+            return True
+        if '资源' in label or '手段' in label:
+            text = _PLACEHOLDER.sub('', ' '.join(values)).strip()
+            items = [item.strip() for item in re.split(r'[\n；;、]', re.sub(r'^如[：:]', '', text)) if item.strip()]
+            self.method_resource['teaching_resources'] = {
+                'field_name': label,
+                'example_items': items
+            }
+            return True
+
+        self.other_fields.append(label)
+        return False
+
+
+def analyze_docx_structure(docx_path: str, structure: Dict = None) -> Optional[Dict]:
+    """
+    Build the template schema of a .docx template from its tables and paragraphs
+
+    Args:
+        docx_path: Path of the .docx template
+        structure: Output of WordTagInserter.extract_document_structure, read
+                   from ``docx_path`` when omitted
+
+    Returns:
+        {'template_structure': schema in the format of the VLM analysis,
+         'confidence': 0.0 - 1.0,
+         'signals': what was recognized (for logging)}
+        or None if the document cannot be read
+    """
+    structure = structure or WordTagInserter().extract_document_structure(docx_path)
+    if not structure:
+        return None
+
+    elements = structure.get('elements', [])
+    tables = [element for element in elements if element['type'] == 'table']
+    first_table = next((i for i, element in enumerate(elements) if element['type'] == 'table'), len(elements))
+    cover_paragraphs = [element['text'] for element in elements[:first_table]
+                        if element['type'] == 'paragraph' and element['text'].strip()]
+
+    walker = _TableWalker()
+    for table in tables:
+        walker.walk(table)
+
+    main_table = {}
+    if walker.header_section:
+        main_table['header_section'] = walker.header_section
+    if walker.objectives:
+        main_table['teaching_objectives_section'] = walker.objectives
+    if walker.key_difficult:
+        main_table['key_difficult_section'] = walker.key_difficult
+    if walker.method_resource:
+        main_table['method_resource_section'] = walker.method_resource
+    if walker.process:
+        main_table['teaching_process_section'] = walker.process
+    if walker.reflection:
+        main_table['teaching_reflection_section'] = walker.reflection
+    if walker.other_fields:
+        main_table['other_fields'] = walker.other_fields
+
+    phases = [v for k, v in walker.process.items() if k.startswith('phase_')]
+    stages = sum(len(phase['stages']) for phase in phases)
+    signals = {
+        'tables': len(tables),
+        'rows': walker.rows_total,
+        'rows_recognized': walker.rows_recognized,
+        'cover_fields': len(_cover_fields(cover_paragraphs)),
+        'objective_categories': len(walker.objectives.get('objective_categories', {})),
+        'key_difficult': len(walker.key_difficult),
+        'phases': len(phases),
+        'stages': stages,
+        'process_columns': len(walker._columns)
+    }
+
+    # 置信度：表格行的识别比例 + 关键部分（目标、重难点、方法资源、教学过程）是否齐全
+    coverage = walker.rows_recognized / walker.rows_total if walker.rows_total else 0.0
+    sections = sum([
+        'section_name' in walker.objectives,
+        signals['key_difficult'] > 0,
+        bool(walker.method_resource),
+        stages > 0 and signals['process_columns'] >= 2
+    ]) / 4
+    confidence = round(0.4 * coverage + 0.6 * sections, 2)
+    if stages == 0:
+        # 没有识别出教学过程环节时，结构化结果不足以指导教案生成
+        confidence = min(confidence, 0.5)
+
+    template_structure = {
+        'template_metadata': dict(_template_metadata(cover_paragraphs),
+                                  analysis_method='structure', confidence=confidence),
+        'cover_page': {'basic_fields': _cover_fields(cover_paragraphs)},
+        'main_table_structure': main_table
+    }
+    return {'template_structure': template_structure, 'confidence': confidence, 'signals': signals}
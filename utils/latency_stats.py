@@ -0,0 +1,63 @@
+"""Process-wide latency statistics of alternative code paths (e.g. VLM analysis modes)"""
+
+import threading
+from typing import Dict
+
+
+class LatencyStats:
+    """Call count, success count and latency of each variant of one operation"""
+
+    def __init__(self):
+        self._variants: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def record(self, variant: str, seconds: float, success: bool = True):
+        with self._lock:
+            stats = self._variants.setdefault(variant, {
+                'calls': 0, 'succeeded': 0, 'total_seconds': 0.0,
+                'min_seconds': None, 'max_seconds': 0.0, 'last_seconds': None
+            })
+            stats['calls'] += 1
+            stats['succeeded'] += 1 if success else 0
+            stats['total_seconds'] += seconds
+            stats['min_seconds'] = seconds if stats['min_seconds'] is None else min(stats['min_seconds'], seconds)
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+            stats['last_seconds'] = seconds
+
+    def stats(self) -> Dict:
+        with self._lock:
+            result = {}
+            for variant, stats in self._variants.items():
+                result[variant] = {
+                    'calls': stats['calls'],
+                    'succeeded': stats['succeeded'],
+                    'success_rate': round(stats['succeeded'] / stats['calls'], 3),
+                    'avg_seconds': round(stats['total_seconds'] / stats['calls'], 3),
+                    'min_seconds': round(stats['min_seconds'], 3),
+                    'max_seconds': round(stats['max_seconds'], 3),
+                    'last_seconds': round(stats['last_seconds'], 3)
+                }
+            return result
+
+
+_operations: Dict[str, LatencyStats] = {}
+_operations_lock = threading.Lock()
+
+
+def get_latency_stats(operation: str) -> LatencyStats:
+    """Return the process-wide statistics of an operation, creating them on first use"""
+    with _operations_lock:
+        stats = _operations.get(operation)
+        if stats is None:
+            stats = _operations[operation] = LatencyStats()
+        return stats
+
+
+def record_latency(operation: str, variant: str, seconds: float, success: bool = True):
+    get_latency_stats(operation).record(variant, seconds, success)
+
+
+def latency_stats() -> Dict:
+    with _operations_lock:
+        operations = dict(_operations)
+    return {operation: stats.stats() for operation, stats in operations.items()}
@@ -3,9 +3,43 @@
 import datetime
 import tempfile
 import os
+import io
 import json
+from concurrent.futures.process import BrokenProcessPool
 from typing import Dict, List, Tuple, Any, Optional, Union
 
+from config.settings import EXPORT_RENDER_WORKERS
+from utils.process_pool import get_process_pool, reset_process_pool
+
+
+def render_template_to_bytes(template_path: str, data: Dict) -> bytes:
+    """用docxtpl渲染一份教案，返回docx文件内容（在渲染进程池中执行，须为模块级函数）"""
+    from utils.template_filler import load_docx_template
+    
+    # 预编译模板缓存在每个渲染进程内常驻，同一模板只解析和编译一次
+    doc = load_docx_template(template_path)
+    doc.render(data)
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+def render_lessons(template_path: str, lesson_plans: List[Dict]) -> List[bytes]:
+    """
+    并行渲染多份教案，按输入顺序返回各自的docx内容
+    
+    进程池不可用（未启用或子进程异常退出）时在当前进程中逐个渲染。
+    """
+    pool = get_process_pool('export', EXPORT_RENDER_WORKERS) if len(lesson_plans) > 1 else None
+    if pool is not None:
+        try:
+            return list(pool.map(render_template_to_bytes,
+                                 [template_path] * len(lesson_plans), lesson_plans))
+        except BrokenProcessPool as e:
+            print(f"⚠️  渲染进程池异常，改为逐个渲染: {e}")
+            reset_process_pool('export')
+    return [render_template_to_bytes(template_path, data) for data in lesson_plans]
+
 
 class LessonExporter:
     """Export lesson plans to various document formats"""
@@ -110,42 +144,37 @@ class LessonExporter:
             else:
                 # 方案1：合并成一个文档（按课次）
                 from docx import Document
-                from docxtpl import DocxTemplate
-                import shutil
+                from docx.oxml.ns import qn
                 
                 filename = f"all_lesson_plans_{timestamp}.docx"
                 output_path = os.path.join(exports_dir, filename)
                 
-                # 复制第一个教案作为基础
-                first_output = os.path.join(exports_dir, f"temp_lesson_1.docx")
-                filler.fill_template(template_path, first_output, lesson_plans[0])
+                # 各课次在进程池中并行渲染，中间结果保存在内存中
+                rendered = render_lessons(template_path, lesson_plans)
                 
-                # 加载第一个文档
-                combined_doc = Document(first_output)
+                # 以第一个教案为基础，一次性追加其余教案的正文
+                combined_doc = Document(io.BytesIO(rendered[0]))
+                body = combined_doc.element.body
+                # 正文内容须位于文档末尾的节属性(sectPr)之前
+                section_props = body.sectPr
                 
-                # 为后续教案添加分页和内容
-                for i, lesson_data in enumerate(lesson_plans[1:], 2):
-                    # 生成单个教案
-                    temp_output = os.path.join(exports_dir, f"temp_lesson_{i}.docx")
-                    filler.fill_template(template_path, temp_output, lesson_data)
-                    
+                for lesson_bytes in rendered[1:]:
                     # 添加分页
                     combined_doc.add_page_break()
                     
-                    # 读取新教案内容并添加
-                    lesson_doc = Document(temp_output)
-                    for element in lesson_doc.element.body:
-                        combined_doc.element.body.append(element)
-                    
-                    # 删除临时文件
-                    os.remove(temp_output)
+                    lesson_doc = Document(io.BytesIO(lesson_bytes))
+                    for element in list(lesson_doc.element.body):
+                        # 每份教案自带的节属性不复制，整个文档沿用第一份的页面设置
+                        if element.tag == qn('w:sectPr'):
+                            continue
+                        if section_props is not None:
+                            section_props.addprevious(element)
+                        else:
+                            body.append(element)
                 
                 # 保存合并文档
                 combined_doc.save(output_path)
                 
-                # 删除第一个临时文件
-                os.remove(first_output)
-                
                 print(f"✅ {len(lesson_plans)} 个教案合并填充成功: {output_path}")
                 return output_path, True
                 
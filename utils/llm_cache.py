@@ -0,0 +1,286 @@
+"""LLM response cache - serves repeated chat model calls from a local cache"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from config.settings import (
+    LLM_CACHE_BACKEND, LLM_CACHE_TTL, LLM_CACHE_MAX_ENTRIES, LLM_CACHE_PATH
+)
+
+
+def _normalize_content(content: Any) -> Any:
+    """Normalize message content so cosmetic whitespace differences share a key"""
+    if isinstance(content, str):
+        return "\n".join(line.strip() for line in content.strip().splitlines())
+    if isinstance(content, list):
+        return [_normalize_content(item) for item in content]
+    if isinstance(content, dict):
+        return {k: _normalize_content(v) for k, v in content.items()}
+    return content
+
+
+def make_cache_key(model_name: str, messages: List, **params) -> str:
+    """
+    Build a deterministic cache key from the model name and message list
+
+    Args:
+        model_name: Model identifier, e.g. "qwen-plus"
+        messages: LangChain message objects (or plain strings)
+        params: Extra call parameters that affect the output
+
+    Returns:
+        SHA-256 hex digest
+    """
+    if isinstance(messages, str):
+        messages = [messages]
+    normalized = []
+    for message in messages:
+        if isinstance(message, str):
+            normalized.append(["human", _normalize_content(message)])
+        else:
+            normalized.append([getattr(message, 'type', type(message).__name__),
+                               _normalize_content(message.content)])
+    payload = json.dumps(
+        {'model': model_name, 'messages': normalized, 'params': params},
+        ensure_ascii=False, sort_keys=True, default=str
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class MemoryCacheBackend:
+    """In-process LRU cache with TTL"""
+
+    def __init__(self, max_entries: int = 1000, ttl: float = 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            expires_at, value = item
+            if self.ttl and expires_at < time.time():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Dict):
+        with self._lock:
+            self._data[key] = (time.time() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict:
+        return {
+            'backend': 'memory',
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._data),
+            'max_entries': self.max_entries
+        }
+
+
+class SQLiteCacheBackend:
+    """On-disk cache in a SQLite database with TTL and LRU eviction"""
+
+    def __init__(self, db_path: str, max_entries: int = 10000, ttl: float = 7 * 24 * 3600):
+        self.db_path = str(db_path)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache (accessed_at)"
+        )
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[Dict]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            value, expires_at = row
+            if self.ttl and expires_at < now:
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+            self.hits += 1
+            return json.loads(value)
+
+    def set(self, key: str, value: Dict):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now + self.ttl, now)
+            )
+            self._conn.execute("DELETE FROM llm_cache WHERE expires_at < ?", (now,))
+            count = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            overflow = count - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM llm_cache WHERE key IN ("
+                    "SELECT key FROM llm_cache ORDER BY accessed_at ASC LIMIT ?)",
+                    (overflow,)
+                )
+                self.evictions += overflow
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+            self._conn.commit()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        return {
+            'backend': 'sqlite',
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': entries,
+            'max_entries': self.max_entries
+        }
+
+
+class CachedChatModel:
+    """
+    Wraps a chat model so identical requests are answered from the cache
+
+    ``invoke``/``ainvoke`` and ``astream`` are cached (a cached stream is
+    replayed as a single chunk); every other attribute is delegated to the
+    wrapped model unchanged.
+    """
+
+    def __init__(self, model, backend):
+        self.model = model
+        self.backend = backend
+
+    @property
+    def model_name(self) -> str:
+        return getattr(self.model, 'model_name', type(self.model).__name__)
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def _lookup(self, key: str) -> Optional[AIMessage]:
+        value = self.backend.get(key)
+        if value is None:
+            return None
+        metadata = dict(value.get('response_metadata') or {})
+        metadata['cache_hit'] = True
+        return AIMessage(content=value['content'], response_metadata=metadata)
+
+    def _store(self, key: str, response):
+        content = getattr(response, 'content', None)
+        if not content:
+            return
+        try:
+            self.backend.set(key, {
+                'content': content,
+                'response_metadata': getattr(response, 'response_metadata', {}) or {}
+            })
+        except Exception as e:
+            print(f"⚠️  LLM缓存写入失败: {e}")
+
+    def invoke(self, messages, **kwargs):
+        key = make_cache_key(self.model_name, messages, **kwargs)
+        cached = self._lookup(key)
+        if cached is not None:
+            return cached
+        response = self.model.invoke(messages, **kwargs)
+        self._store(key, response)
+        return response
+
+    async def ainvoke(self, messages, **kwargs):
+        key = make_cache_key(self.model_name, messages, **kwargs)
+        cached = self._lookup(key)
+        if cached is not None:
+            return cached
+        response = await self.model.ainvoke(messages, **kwargs)
+        self._store(key, response)
+        return response
+
+    async def astream(self, messages, **kwargs):
+        key = make_cache_key(self.model_name, messages, **kwargs)
+        cached = self._lookup(key)
+        if cached is not None:
+            yield AIMessageChunk(content=cached.content, response_metadata=cached.response_metadata)
+            return
+        parts = []
+        async for chunk in self.model.astream(messages, **kwargs):
+            if isinstance(chunk.content, str):
+                parts.append(chunk.content)
+            yield chunk
+        # 只缓存完整结束的流，中途取消时不写入
+        self._store(key, AIMessage(content="".join(parts)))
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_llm_cache():
+    """
+    Return the process-wide cache backend configured in settings
+
+    Returns:
+        A cache backend, or None when LLM_CACHE_BACKEND is "none"
+    """
+    global _default_cache
+    if LLM_CACHE_BACKEND == 'none':
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            if LLM_CACHE_BACKEND == 'sqlite':
+                _default_cache = SQLiteCacheBackend(
+                    LLM_CACHE_PATH, max_entries=LLM_CACHE_MAX_ENTRIES, ttl=LLM_CACHE_TTL
+                )
+            else:
+                _default_cache = MemoryCacheBackend(
+                    max_entries=LLM_CACHE_MAX_ENTRIES, ttl=LLM_CACHE_TTL
+                )
+        return _default_cache
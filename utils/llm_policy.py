@@ -0,0 +1,325 @@
+"""LLM call policy - deadlines, retries with backoff and a circuit breaker per model"""
+
+import asyncio
+import math
+import random
+import threading
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import Dict
+
+from config.settings import LLM_CALL_POLICY_DEFAULT, LLM_CALL_POLICIES, LLM_BUDGET_FALLBACK_MODELS
+from utils.async_runner import run_async
+from utils.rate_limiter import ModelRateLimiter, get_rate_limiter, expected_completion_tokens
+from utils.token_counter import estimate_tokens, extract_token_usage
+from utils.token_usage import TokenBudgetExceededError, current_scope, record_usage
+
+
+class LLMTimeoutError(TimeoutError):
+    """A single model call exceeded its deadline"""
+
+
+class CircuitOpenError(RuntimeError):
+    """The model's circuit breaker is open; the call was rejected without contacting the provider"""
+
+
+# 可重试的服务端错误特征（DashScope 429限流、5xx、网络异常等）
+RETRYABLE_MARKERS = (
+    'timeout', 'timed out', 'connection', 'throttl', 'rate limit', 'too many requests',
+    '429', '500', '502', '503', '504', 'internalerror', 'serviceunavailable', 'temporarily'
+)
+
+
+def is_retryable(error: Exception) -> bool:
+    """Return True for transient errors worth retrying (timeouts, throttling, 5xx, network)"""
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    status = getattr(getattr(error, 'response', None), 'status_code', None)
+    if status is not None:
+        return status == 429 or status >= 500
+    message = f"{type(error).__name__} {error}".lower()
+    return any(marker in message for marker in RETRYABLE_MARKERS)
+
+
+def get_call_policy(model_name: str) -> Dict:
+    """Merge the default call policy with the per-model overrides from settings"""
+    policy = dict(LLM_CALL_POLICY_DEFAULT)
+    policy.update(LLM_CALL_POLICIES.get(model_name, {}))
+    return policy
+
+
+def provider_request_timeout(model_name: str) -> int:
+    """
+    HTTP timeout (seconds) to configure on the provider client
+
+    ChatTongyi.ainvoke runs the blocking SDK call in the event loop's
+    executor; cancelling the coroutine on a deadline does not stop that
+    thread. Giving the SDK request the same deadline makes the thread
+    return instead of staying busy until the provider answers.
+    """
+    return math.ceil(get_call_policy(model_name)['timeout'])
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker
+
+    After ``failure_threshold`` retryable failures in a row the breaker opens
+    and calls fail fast with CircuitOpenError. After ``reset_timeout`` seconds
+    one trial call is let through (half-open) and all other callers are
+    rejected until it finishes; success closes the breaker, failure opens it
+    again, and a trial that ends without a verdict (cancelled, non-retryable
+    error) is released with ``release``.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 60):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.rejected = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.OPEN and time.time() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            if self.state != self.CLOSED:
+                self.rejected += 1
+                return False
+            return True
+
+    def release(self):
+        """End a half-open trial call that produced neither a success nor a failure"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                print(f"✅ 熔断器恢复: {self.name}")
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._trial_in_flight = False
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    print(f"⚡ 熔断器打开: {self.name}（连续失败{self.failures}次），{self.reset_timeout}s内快速失败")
+                self.state = self.OPEN
+                self.opened_at = time.time()
+
+    def stats(self) -> Dict:
+        return {
+            'state': self.state,
+            'consecutive_failures': self.failures,
+            'rejected': self.rejected
+        }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(model_name: str) -> CircuitBreaker:
+    """Return the process-wide circuit breaker of a model"""
+    with _breakers_lock:
+        breaker = _breakers.get(model_name)
+        if breaker is None:
+            policy = get_call_policy(model_name)
+            breaker = CircuitBreaker(
+                model_name,
+                failure_threshold=policy['breaker_threshold'],
+                reset_timeout=policy['breaker_reset']
+            )
+            _breakers[model_name] = breaker
+        return breaker
+
+
+def circuit_breaker_stats() -> Dict:
+    with _breakers_lock:
+        return {name: breaker.stats() for name, breaker in _breakers.items()}
+
+
+class ResilientChatModel:
+    """
+    Wraps a chat model with the configured call policy
+
+    Every call gets a deadline (``timeout``); retryable errors are retried up
+    to ``max_retries`` times with exponential backoff and full jitter; the
+    model's circuit breaker rejects calls during provider outages. Each
+    attempt first waits for the model's rate limiter (RPM/TPM/concurrency);
+    the deadline only covers the provider call, not the queueing. Sync
+    ``invoke`` runs on the shared background loop so it gets the same
+    deadline handling and must not be called from inside a coroutine.
+
+    Provider-reported token usage is recorded for the current usage scope.
+    Once the scope's budget is used up, further calls either fail with
+    TokenBudgetExceededError or are sent to the fallback model configured in
+    LLM_BUDGET_FALLBACK_MODELS (``on_exceed="downgrade"``).
+    """
+
+    def __init__(self, model, policy: Dict = None, breaker: CircuitBreaker = None,
+                 limiter: ModelRateLimiter = None):
+        self.model = model
+        self.policy = policy or get_call_policy(self.model_name)
+        self.breaker = breaker or get_circuit_breaker(self.model_name)
+        self.limiter = limiter or get_rate_limiter(self.model_name)
+        self._fallback = None
+        self._is_fallback = False
+
+    @property
+    def model_name(self) -> str:
+        return getattr(self.model, 'model_name', type(self.model).__name__)
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def _backoff(self, attempt: int) -> float:
+        cap = min(self.policy['backoff_max'], self.policy['backoff_base'] * (2 ** attempt))
+        return random.uniform(0, cap)
+
+    @asynccontextmanager
+    async def _rate_limit(self, messages):
+        """Hold a rate-limiter slot for one attempt (no-op without a limiter)"""
+        if self.limiter is None:
+            yield {}
+            return
+        estimated = estimate_tokens(messages) + expected_completion_tokens(self.model_name)
+        async with self.limiter.slot(estimated) as usage:
+            yield usage
+
+    def _budget_target(self) -> 'ResilientChatModel':
+        """Return the model to call under the current usage scope's budget"""
+        scope = current_scope()
+        # 降级后的模型不再检查预算，超出部分由降级模型继续完成
+        if self._is_fallback or scope is None or not scope.exceeded:
+            return self
+        fallback = LLM_BUDGET_FALLBACK_MODELS.get(self.model_name)
+        if scope.on_exceed == 'downgrade' and fallback and hasattr(self.model, 'model_copy'):
+            if self._fallback is None:
+                update = {'model_name': fallback}
+                if isinstance(getattr(self.model, 'model_kwargs', None), dict):
+                    update['model_kwargs'] = dict(self.model.model_kwargs,
+                                                  request_timeout=provider_request_timeout(fallback))
+                self._fallback = ResilientChatModel(self.model.model_copy(update=update))
+                self._fallback._is_fallback = True
+            if not scope.downgraded:
+                print(f"💰 任务 {scope.job_id} 已用 {scope.total_tokens} tokens，超出预算，降级到 {fallback}")
+                scope.downgraded = True
+            return self._fallback
+        raise TokenBudgetExceededError(
+            f"已超出token预算（已用 {scope.total_tokens} / 预算 {scope.budget}）"
+        )
+
+    def _check_breaker(self):
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"模型 {self.model_name} 暂时不可用（熔断中），请稍后重试")
+
+    async def _retry(self, attempt: int, error: Exception):
+        """Record a failed attempt; re-raise it if it should not be retried"""
+        if isinstance(error, asyncio.TimeoutError):
+            error = LLMTimeoutError(f"模型 {self.model_name} 调用超时（{self.policy['timeout']}s）")
+        if not is_retryable(error):
+            self.breaker.release()
+            raise error
+        self.breaker.record_failure()
+        # 重试次数用尽或熔断器已打开时，直接抛出本次的真实错误
+        if attempt >= self.policy['max_retries'] or self.breaker.state == CircuitBreaker.OPEN:
+            raise error
+        delay = self._backoff(attempt)
+        print(f"🔁 {self.model_name} 调用失败（{error}），{delay:.1f}s后第{attempt + 1}次重试")
+        await asyncio.sleep(delay)
+
+    async def ainvoke(self, messages, **kwargs):
+        target = self._budget_target()
+        if target is not self:
+            return await target.ainvoke(messages, **kwargs)
+        attempt = 0
+        while True:
+            self._check_breaker()
+            try:
+                async with self._rate_limit(messages) as usage:
+                    response = await asyncio.wait_for(
+                        self.model.ainvoke(messages, **kwargs), timeout=self.policy['timeout']
+                    )
+                    usage.update(extract_token_usage(response) or {})
+            except asyncio.CancelledError:
+                self.breaker.release()
+                raise
+            except Exception as e:
+                await self._retry(attempt, e)
+                attempt += 1
+                continue
+            self.breaker.record_success()
+            record_usage(self.model_name, usage)
+            return response
+
+    def invoke(self, messages, **kwargs):
+        return run_async(self.ainvoke(messages, **kwargs))
+
+    async def astream(self, messages, **kwargs):
+        """Stream chunks; retries are only attempted before the first chunk is yielded"""
+        target = self._budget_target()
+        if target is not self:
+            async for chunk in target.astream(messages, **kwargs):
+                yield chunk
+            return
+        attempt = 0
+        while True:
+            self._check_breaker()
+            # 限流槽位在整个流式输出期间保持占用
+            stack = AsyncExitStack()
+            usage = await stack.enter_async_context(self._rate_limit(messages))
+            stream = self.model.astream(messages, **kwargs).__aiter__()
+            try:
+                first = await asyncio.wait_for(stream.__anext__(), timeout=self.policy['timeout'])
+            except StopAsyncIteration:
+                await stack.aclose()
+                self.breaker.record_success()
+                return
+            except BaseException as e:
+                await stream.aclose()
+                await stack.aclose()
+                if not isinstance(e, Exception):
+                    self.breaker.release()
+                    raise
+                await self._retry(attempt, e)
+                attempt += 1
+                continue
+            break
+
+        self.breaker.record_success()
+        last = first
+        try:
+            yield first
+            while True:
+                try:
+                    # 流式输出中每个片段之间同样受截止时间约束
+                    chunk = await asyncio.wait_for(stream.__anext__(), timeout=self.policy['timeout'])
+                except StopAsyncIteration:
+                    return
+                except asyncio.TimeoutError:
+                    self.breaker.record_failure()
+                    raise LLMTimeoutError(f"模型 {self.model_name} 流式输出超时（{self.policy['timeout']}s）")
+                last = chunk
+                yield chunk
+        finally:
+            await stream.aclose()
+            # 用量信息在最后一个片段中返回
+            usage.update(extract_token_usage(last) or {})
+            record_usage(self.model_name, usage)
+            await stack.aclose()
@@ -0,0 +1,42 @@
+"""Persistent process pools for CPU-bound document work (rendering, rasterization)"""
+
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
+
+_pools: Dict[str, ProcessPoolExecutor] = {}
+_pools_lock = threading.Lock()
+
+
+def get_process_pool(name: str, max_workers: int) -> Optional[ProcessPoolExecutor]:
+    """
+    Return the named process pool, creating it on first use
+
+    Workers are started with the spawn method: the web process runs several
+    threads (event loop, job workers), and forking could copy locks held by
+    them. Pools stay alive so per-process caches (compiled templates,
+    imported libraries) are reused across calls.
+
+    Returns:
+        None when ``max_workers`` is 1 or less (callers run the work in-process)
+    """
+    if max_workers <= 1:
+        return None
+    with _pools_lock:
+        pool = _pools.get(name)
+        if pool is None:
+            pool = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            _pools[name] = pool
+        return pool
+
+
+def reset_process_pool(name: str):
+    """Drop a pool (e.g. after BrokenProcessPool); the next call creates a new one"""
+    with _pools_lock:
+        pool = _pools.pop(name, None)
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
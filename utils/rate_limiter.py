@@ -0,0 +1,186 @@
+"""Client-side rate limiting per model (requests/tokens per minute and concurrency)"""
+
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+from config.settings import LLM_RATE_LIMIT_ENABLED, LLM_RATE_LIMITS, LLM_EXPECTED_COMPLETION_TOKENS
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at ``per_minute / 60`` per second
+
+    Reservations may drive the balance negative; the returned delay tells the
+    caller how long to wait until its share has been refilled. Because later
+    reservations queue behind the debt of earlier ones, waiters are served in
+    FIFO order without holding a lock while sleeping.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Take ``amount`` tokens and return the seconds to wait before using them"""
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def adjust(self, delta: float):
+        """Correct an earlier reservation by ``delta`` tokens (positive = more were used)"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - delta)
+
+
+class ModelRateLimiter:
+    """
+    Requests-per-minute, tokens-per-minute and concurrency limits of one model
+
+    Token reservations use an estimate of prompt plus expected completion
+    tokens and are corrected with the usage the provider reports afterwards.
+    """
+
+    def __init__(self, model_name: str, rpm: int = None, tpm: int = None,
+                 max_concurrency: int = None):
+        self.model_name = model_name
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.max_concurrency = max_concurrency
+        self._lock = threading.Lock()
+        self._semaphores: Dict[int, asyncio.Semaphore] = {}
+        # 指标
+        self.waiting = 0
+        self.max_waiting = 0
+        self.in_flight = 0
+        self.acquired = 0
+        self.throttled = 0
+        self.total_wait = 0.0
+
+    def _semaphore(self) -> Optional[asyncio.Semaphore]:
+        if not self.max_concurrency:
+            return None
+        # asyncio.Semaphore绑定事件循环，按循环分别创建（fork后会启动新的循环）
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            semaphore = self._semaphores.get(id(loop))
+            if semaphore is None:
+                semaphore = asyncio.Semaphore(self.max_concurrency)
+                self._semaphores = {id(loop): semaphore}
+            return semaphore
+
+    @asynccontextmanager
+    async def slot(self, estimated_tokens: int):
+        """
+        Wait for rate-limit budget and a concurrency slot for one call
+
+        Yields a dict; set ``usage['total_tokens']`` to the provider-reported
+        usage so the token bucket can be corrected.
+        """
+        start = time.monotonic()
+        with self._lock:
+            delay = 0.0
+            if self.requests is not None:
+                delay = max(delay, self.requests.reserve(1))
+            if self.tokens is not None:
+                delay = max(delay, self.tokens.reserve(estimated_tokens))
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+            if delay > 0:
+                self.throttled += 1
+
+        semaphore = None
+        try:
+            if delay > 0:
+                await asyncio.sleep(delay)
+            semaphore = self._semaphore()
+            if semaphore is not None:
+                await semaphore.acquire()
+        except BaseException:
+            with self._lock:
+                self.waiting -= 1
+            raise
+
+        waited = time.monotonic() - start
+        if delay > 1:
+            print(f"⏳ {self.model_name} 触发限流，排队 {waited:.1f}s")
+        with self._lock:
+            self.waiting -= 1
+            self.in_flight += 1
+            self.acquired += 1
+            self.total_wait += waited
+
+        usage = {}
+        try:
+            yield usage
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                if self.tokens is not None and usage.get('total_tokens'):
+                    self.tokens.adjust(usage['total_tokens'] - estimated_tokens)
+            if semaphore is not None:
+                semaphore.release()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'rpm': self.requests.capacity if self.requests else None,
+                'tpm': self.tokens.capacity if self.tokens else None,
+                'max_concurrency': self.max_concurrency,
+                'queue_depth': self.waiting,
+                'max_queue_depth': self.max_waiting,
+                'in_flight': self.in_flight,
+                'acquired': self.acquired,
+                'throttled': self.throttled,
+                'avg_wait_seconds': round(self.total_wait / self.acquired, 3) if self.acquired else 0.0
+            }
+
+
+_limiters: Dict[str, ModelRateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(model_name: str) -> Optional[ModelRateLimiter]:
+    """
+    Return the process-wide limiter of a model
+
+    Returns:
+        None when rate limiting is disabled or no limits are configured for the model
+    """
+    if not LLM_RATE_LIMIT_ENABLED:
+        return None
+    limits = LLM_RATE_LIMITS.get(model_name)
+    if not limits:
+        return None
+    with _limiters_lock:
+        limiter = _limiters.get(model_name)
+        if limiter is None:
+            limiter = ModelRateLimiter(
+                model_name,
+                rpm=limits.get('rpm'),
+                tpm=limits.get('tpm'),
+                max_concurrency=limits.get('max_concurrency')
+            )
+            _limiters[model_name] = limiter
+        return limiter
+
+
+def rate_limiter_stats() -> Dict:
+    with _limiters_lock:
+        return {name: limiter.stats() for name, limiter in _limiters.items()}
+
+
+def expected_completion_tokens(model_name: str) -> int:
+    """Completion tokens reserved per call before the real usage is known"""
+    return (LLM_RATE_LIMITS.get(model_name) or {}).get(
+        'expected_completion_tokens', LLM_EXPECTED_COMPLETION_TOKENS
+    )
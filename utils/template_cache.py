@@ -0,0 +1,123 @@
+"""Template analysis cache - persists template parsing results keyed by file content"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+from config.settings import TEMPLATE_CACHE_DIR, TEMPLATE_CACHE_MAX_BYTES
+
+
+class TemplateAnalysisCache:
+    """
+    Content-addressed on-disk cache for template analysis results
+
+    Entries are keyed by the SHA-256 of the template file plus the analysis
+    prompt version, so re-uploads of the same document (under any filename)
+    skip conversion and VLM calls, while prompt changes invalidate old entries.
+    Each entry is one JSON file; the directory is kept under ``max_bytes`` by
+    evicting the least recently used entries (mtime is refreshed on every hit).
+    """
+
+    def __init__(self, cache_dir: str = None, max_bytes: int = None):
+        self.cache_dir = Path(cache_dir or TEMPLATE_CACHE_DIR)
+        self.max_bytes = TEMPLATE_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def file_digest(file_path: str) -> str:
+        """Compute the SHA-256 hex digest of a file"""
+        sha256 = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    def _entry_path(self, digest: str, prompt_version: str) -> Path:
+        return self.cache_dir / f"{digest}_{prompt_version}.json"
+
+    def get(self, digest: str, prompt_version: str) -> Optional[Dict]:
+        """
+        Look up a cached analysis result
+
+        Returns:
+            The cached entry dict, or None on a miss
+        """
+        path = self._entry_path(digest, prompt_version)
+        with self._lock:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    entry = json.load(f)
+                os.utime(path, None)  # 刷新LRU时间
+                self.hits += 1
+                return entry
+            except (FileNotFoundError, json.JSONDecodeError):
+                self.misses += 1
+                return None
+
+    def put(self, digest: str, prompt_version: str, entry: Dict):
+        """Store an analysis result and evict old entries if over the size limit"""
+        path = self._entry_path(digest, prompt_version)
+        payload = dict(entry)
+        payload.setdefault('cached_at', time.time())
+        with self._lock:
+            # 先写临时文件再替换，避免并发读取到半写入的条目
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(payload, f, ensure_ascii=False)
+                os.replace(tmp_path, path)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            self._evict()
+
+    def _evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes"""
+        entries = []
+        total = 0
+        for path in self.cache_dir.glob('*.json'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        entries.sort()
+        while entries and total > self.max_bytes:
+            _, size, path = entries.pop(0)
+            try:
+                path.unlink()
+                total -= size
+                print(f"🧹 模板缓存淘汰: {path.name}")
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        """Remove all cached entries"""
+        with self._lock:
+            for path in self.cache_dir.glob('*.json'):
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+
+    def stats(self) -> Dict:
+        """Return hit/miss counters and current size"""
+        files = list(self.cache_dir.glob('*.json'))
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(files),
+            'bytes': sum(p.stat().st_size for p in files if p.exists()),
+            'max_bytes': self.max_bytes
+        }
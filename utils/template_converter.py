@@ -2,8 +2,18 @@
 
 import tempfile
 import os
+import shutil
+import time
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
 from pathlib import Path
-from typing import List
+from typing import Iterator, List
+
+from config.settings import (
+    TEMPLATE_RENDER_WORKERS, TEMPLATE_RENDER_DPI,
+    TEMPLATE_RENDER_DIR, TEMPLATE_RENDER_DIR_MAX_AGE
+)
+from utils.process_pool import get_process_pool, reset_process_pool
 
 # Import handling for optional dependencies
 try:
@@ -22,54 +32,128 @@ except ImportError:
     DOC_CONVERSION_AVAILABLE = False
 
 
+def _save_pages(doc, pages: range, output_dir: str, dpi: int) -> List[str]:
+    """Save the given pages of a loaded Aspose document as PNG files"""
+    save_options = aw.saving.ImageSaveOptions(aw.SaveFormat.PNG)
+    save_options.horizontal_resolution = dpi
+    save_options.vertical_resolution = dpi
+    save_options.scale = 1.0
+    
+    image_paths = []
+    for page_index in pages:
+        save_options.page_set = aw.saving.PageSet([page_index])
+        output_path = os.path.join(output_dir, f"template_page_{page_index + 1}.png")
+        doc.save(output_path, save_options)
+        image_paths.append(output_path)
+    return image_paths
+
+
+def render_page_range(file_path: str, start: int, stop: int, output_dir: str, dpi: int) -> List[str]:
+    """渲染第 start ~ stop-1 页（在渲染进程池中执行，须为模块级函数）"""
+    # 每个进程各自加载文档，Aspose文档对象不能跨进程传递
+    doc = aw.Document(file_path)
+    return _save_pages(doc, range(start, stop), output_dir, dpi)
+
+
+def _split_pages(page_count: int, parts: int) -> List[range]:
+    """Split pages into at most ``parts`` contiguous ranges of near-equal size"""
+    parts = max(1, min(parts, page_count))
+    size, extra = divmod(page_count, parts)
+    ranges, start = [], 0
+    for i in range(parts):
+        stop = start + size + (1 if i < extra else 0)
+        ranges.append(range(start, stop))
+        start = stop
+    return ranges
+
+
 class TemplateConverter:
     """Template document converter for handling DOC/DOCX to image conversion"""
     
     @staticmethod
-    def convert_to_images(file_path: str) -> List[str]:
+    def convert_to_images(file_path: str, output_dir: str = None) -> List[str]:
         """
         Convert DOC/DOCX template files to images for parsing
         
         Args:
             file_path: Path to the template file
+            output_dir: Directory for the images; a new temporary directory
+                        is created when omitted (the caller must remove it,
+                        prefer ``render_job_dir`` which cleans up itself)
             
         Returns:
             List of image file paths
         """
         try:
+            if output_dir is None:
+                output_dir = tempfile.mkdtemp()
             if ASPOSE_AVAILABLE:
-                return TemplateConverter._convert_with_aspose(file_path)
+                return TemplateConverter._convert_with_aspose(file_path, output_dir)
             elif DOC_CONVERSION_AVAILABLE:
-                return TemplateConverter._convert_with_docx2python(file_path)
+                return TemplateConverter._convert_with_docx2python(file_path, output_dir)
             else:
-                return TemplateConverter._convert_with_simple_render(file_path)
+                return TemplateConverter._convert_with_simple_render(file_path, output_dir)
         except Exception as e:
             print(f"Template conversion error: {e}")
             return []
     
     @staticmethod
-    def _convert_with_aspose(file_path: str) -> List[str]:
+    @contextmanager
+    def render_job_dir(job_id: str = None) -> Iterator[str]:
+        """
+        Per-job directory for rendered pages, removed when the block exits
+        
+        Also removes directories left behind by interrupted jobs that are
+        older than TEMPLATE_RENDER_DIR_MAX_AGE.
+        """
+        TemplateConverter._purge_stale_render_dirs()
+        prefix = f"{job_id}_" if job_id else "render_"
+        job_dir = tempfile.mkdtemp(prefix=prefix, dir=str(TEMPLATE_RENDER_DIR))
+        try:
+            yield job_dir
+        finally:
+            shutil.rmtree(job_dir, ignore_errors=True)
+    
+    @staticmethod
+    def _purge_stale_render_dirs():
+        cutoff = time.time() - TEMPLATE_RENDER_DIR_MAX_AGE
+        try:
+            entries = list(os.scandir(TEMPLATE_RENDER_DIR))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            try:
+                if entry.is_dir() and entry.stat().st_mtime < cutoff:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+            except OSError:
+                continue
+    
+    @staticmethod
+    def _convert_with_aspose(file_path: str, output_dir: str) -> List[str]:
         """Convert using Aspose.Words (best quality)"""
         try:
             # Load document
             doc = aw.Document(file_path)
+            page_count = doc.page_count
             
-            # Create save options for high-quality images
-            save_options = aw.saving.ImageSaveOptions(aw.SaveFormat.PNG)
-            save_options.horizontal_resolution = 300
-            save_options.vertical_resolution = 300
-            save_options.scale = 1.0
-            
-            # Convert each page
-            image_paths = []
-            temp_dir = tempfile.mkdtemp()
-            
-            for page_index in range(doc.page_count):
-                save_options.page_set = aw.saving.PageSet([page_index])
-                output_path = os.path.join(temp_dir, f"template_page_{page_index + 1}.png")
-                doc.save(output_path, save_options)
-                image_paths.append(output_path)
+            # 多页模板按页码区间分给渲染进程并行输出，结果按页码顺序拼接
+            pool = get_process_pool('template_render', TEMPLATE_RENDER_WORKERS) if page_count > 1 else None
+            if pool is not None:
+                try:
+                    futures = [
+                        pool.submit(render_page_range, file_path, pages.start, pages.stop,
+                                    output_dir, TEMPLATE_RENDER_DPI)
+                        for pages in _split_pages(page_count, TEMPLATE_RENDER_WORKERS)
+                    ]
+                    image_paths = [path for future in futures for path in future.result()]
+                    print(f"✅ Aspose conversion successful: {len(image_paths)} pages "
+                          f"({len(futures)} workers)")
+                    return image_paths
+                except BrokenProcessPool as e:
+                    print(f"⚠️  渲染进程池异常，改为逐页渲染: {e}")
+                    reset_process_pool('template_render')
             
+            image_paths = _save_pages(doc, range(page_count), output_dir, TEMPLATE_RENDER_DPI)
             print(f"✅ Aspose conversion successful: {len(image_paths)} pages")
             return image_paths
         except Exception as e:
@@ -77,13 +161,12 @@ class TemplateConverter:
             return []
     
     @staticmethod
-    def _convert_with_docx2python(file_path: str) -> List[str]:
+    def _convert_with_docx2python(file_path: str, output_dir: str) -> List[str]:
         """Convert using docx2python (medium quality)"""
         try:
             content = docx2python(file_path)
             
             image_paths = []
-            temp_dir = tempfile.mkdtemp()
             
             # Render document content as image
             fig, ax = plt.subplots(figsize=(8.5, 11))  # A4 paper size
@@ -103,7 +186,7 @@ class TemplateConverter:
                    family='monospace')
             
             # Save image
-            output_path = os.path.join(temp_dir, "template_page_1.png")
+            output_path = os.path.join(output_dir, "template_page_1.png")
             plt.tight_layout()
             plt.savefig(output_path, dpi=300, bbox_inches='tight', 
                        facecolor='white', edgecolor='none')
@@ -117,7 +200,7 @@ class TemplateConverter:
             return []
     
     @staticmethod
-    def _convert_with_simple_render(file_path: str) -> List[str]:
+    def _convert_with_simple_render(file_path: str, output_dir: str) -> List[str]:
         """Simple text rendering method (fallback)"""
         try:
             text_content = ""
@@ -160,8 +243,6 @@ class TemplateConverter:
             # Create simple text image using PIL
             from PIL import Image, ImageDraw, ImageFont
             
-            temp_dir = tempfile.mkdtemp()
-            
             # Create blank image (A4 proportions)
             img_width, img_height = 850, 1100
             img = Image.new('RGB', (img_width, img_height), color='white')
@@ -219,7 +300,7 @@ class TemplateConverter:
                          font=font, fill='gray')
             
             # Save image
-            output_path = os.path.join(temp_dir, "template_simple.png")
+            output_path = os.path.join(output_dir, "template_simple.png")
             img.save(output_path, quality=95)
             
             print(f"⚠️ 使用简单渲染模式: 1 page")
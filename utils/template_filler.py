@@ -7,12 +7,127 @@ Template Filler - Advanced Feature
 """
 
 from pathlib import Path
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Tuple
+from collections import OrderedDict
 from docxtpl import DocxTemplate
 from docx import Document
 from docx.oxml import OxmlElement
 from docx.oxml.ns import qn
+from jinja2 import Environment
+import io
 import json
+import os
+import re
+import threading
+
+from config.settings import DOCX_TEMPLATE_CACHE_SIZE
+from utils.docx_scanner import scan_docx_placeholders
+
+
+class _PrecompiledEnvironment:
+    """
+    传给docxtpl.render_xml_part的jinja_env替身：相同源码的模板只编译一次
+    
+    docxtpl自身的预处理和渲染后处理保持不变，仅跳过重复的Jinja编译。
+    """
+    
+    def __init__(self):
+        self._env = Environment()
+        self._templates = {}
+        self._lock = threading.Lock()
+    
+    def from_string(self, source: str):
+        template = self._templates.get(source)
+        if template is None:
+            template = self._env.from_string(source)
+            with self._lock:
+                self._templates[source] = template
+        return template
+
+
+class CompiledDocxTemplate:
+    """
+    一个模板文件的预处理结果：文件内容、patch_xml处理后的正文/页眉/页脚XML、已编译的Jinja模板
+    
+    每次渲染从内存中的文件内容加载新的文档对象，正文和页眉页脚直接使用缓存的XML渲染，
+    不再重复读取磁盘、序列化并清洗XML、编译Jinja模板。
+    """
+    
+    def __init__(self, template_path: str):
+        with open(template_path, 'rb') as f:
+            self.template_bytes = f.read()
+        
+        tpl = DocxTemplate(io.BytesIO(self.template_bytes))
+        tpl.init_docx()
+        self.body_xml = tpl.patch_xml(tpl.get_xml())
+        # 页眉页脚: relKey -> (清洗后的XML, 原编码)
+        self.part_xml: Dict[str, Tuple[str, str]] = {}
+        for uri in (DocxTemplate.HEADER_URI, DocxTemplate.FOOTER_URI):
+            for rel_key, part in tpl.get_headers_footers(uri):
+                xml = tpl.get_part_xml(part)
+                self.part_xml[rel_key] = (tpl.patch_xml(xml), tpl.get_headers_footers_encoding(xml))
+        self.env = _PrecompiledEnvironment()
+    
+    def new_document(self) -> 'CachedDocxTemplate':
+        """返回可渲染一次的模板对象"""
+        return CachedDocxTemplate(self)
+
+
+class CachedDocxTemplate(DocxTemplate):
+    """使用CompiledDocxTemplate缓存结果渲染的DocxTemplate（指定jinja_env时退回docxtpl默认流程）"""
+    
+    def __init__(self, compiled: CompiledDocxTemplate):
+        super().__init__(io.BytesIO(compiled.template_bytes))
+        self.compiled = compiled
+    
+    def init_docx(self, reload: bool = True):
+        if not self.docx or (self.is_rendered and reload):
+            self.docx = Document(io.BytesIO(self.compiled.template_bytes))
+            self.is_rendered = False
+    
+    def build_xml(self, context, jinja_env=None):
+        if jinja_env is not None:
+            return super().build_xml(context, jinja_env)
+        return self.render_xml_part(self.compiled.body_xml, self.docx._part, context, self.compiled.env)
+    
+    def build_headers_footers_xml(self, context, uri, jinja_env=None):
+        if jinja_env is not None:
+            yield from super().build_headers_footers_xml(context, uri, jinja_env)
+            return
+        for rel_key, part in self.get_headers_footers(uri):
+            xml, encoding = self.compiled.part_xml[rel_key]
+            yield rel_key, self.render_xml_part(xml, part, context, self.compiled.env).encode(encoding)
+
+
+_compiled_templates: 'OrderedDict[str, Tuple[Tuple[int, int], CompiledDocxTemplate]]' = OrderedDict()
+_compiled_templates_lock = threading.Lock()
+
+
+def load_docx_template(template_path: str) -> DocxTemplate:
+    """
+    返回用于渲染一份文档的DocxTemplate，同一模板的解析和编译结果在进程内复用
+    
+    缓存按绝对路径索引，文件修改时间或大小变化时重新解析。
+    """
+    if DOCX_TEMPLATE_CACHE_SIZE <= 0:
+        return DocxTemplate(template_path)
+    
+    path = os.path.abspath(template_path)
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    with _compiled_templates_lock:
+        entry = _compiled_templates.get(path)
+        if entry is not None and entry[0] == version:
+            _compiled_templates.move_to_end(path)
+            return entry[1].new_document()
+    
+    compiled = CompiledDocxTemplate(path)
+    with _compiled_templates_lock:
+        _compiled_templates[path] = (version, compiled)
+        _compiled_templates.move_to_end(path)
+        while len(_compiled_templates) > DOCX_TEMPLATE_CACHE_SIZE:
+            _compiled_templates.popitem(last=False)
+    return compiled.new_document()
 
 
 class WordTemplateFiller:
@@ -326,8 +441,8 @@ class WordTemplateFiller:
             bool: 是否成功
         """
         try:
-            # 加载模板
-            doc = DocxTemplate(template_path)
+            # 加载模板（同一模板的解析与编译结果会被复用）
+            doc = load_docx_template(template_path)
             
             # 填充数据
             doc.render(data)
@@ -444,34 +559,31 @@ class WordTemplateFiller:
             template_path: 模板文件路径
             
         Returns:
-            dict: 包含找到的标签和未识别的标签
+            dict: 包含找到的标签、未识别的标签以及各标签出现的次数
         """
         try:
-            # 先检查文件是否是有效的docx
-            from pathlib import Path
-            import zipfile
-            
-            file_path = Path(template_path)
-            
-            # 检查是否为有效的ZIP文件（docx本质是zip）
-            try:
-                with zipfile.ZipFile(file_path, 'r') as zip_ref:
-                    # 检查关键文件
-                    if 'word/document.xml' not in zip_ref.namelist():
-                        raise ValueError("不是有效的.docx文件: 缺少word/document.xml")
-            except zipfile.BadZipFile:
-                raise ValueError("不是有效的.docx文件: 文件可能是旧的.doc格式或已损坏")
-            
-            doc = DocxTemplate(template_path)
-            
-            # 获取模板中的所有变量
-            undeclared_vars = doc.undeclared_template_variables
+            # 直接流式扫描docx中的XML（正文、页眉、页脚），无需构建完整的文档对象；
+            # 文件不是有效的docx时抛出ValueError
+            scan = scan_docx_placeholders(template_path)
+            
+            # 取表达式开头的变量名（与Jinja2一致：{{ a.b }}、{{ a|filter }} 对应变量 a）；
+            # 逐处位置只在本函数内统计，返回结果会写入模板缓存和接口响应
+            template_vars = []
+            tag_counts = {}
+            for location in scan['locations']:
+                match = re.match(r'[^\W\d]\w*', location['tag'])
+                if not match:
+                    continue
+                var = match.group(0)
+                if var not in tag_counts:
+                    template_vars.append(var)
+                tag_counts[var] = tag_counts.get(var, 0) + 1
             
             # 分类标签
             recognized_tags = []
             unrecognized_tags = []
             
-            for var in undeclared_vars:
+            for var in template_vars:
                 if var in self.supported_tags:
                     recognized_tags.append(var)
                 else:
@@ -479,10 +591,11 @@ class WordTemplateFiller:
             
             return {
                 'success': True,
-                'has_tags': len(undeclared_vars) > 0,
+                'has_tags': len(template_vars) > 0,
                 'recognized_tags': recognized_tags,
                 'unrecognized_tags': unrecognized_tags,
-                'total_tags': len(undeclared_vars)
+                'total_tags': len(template_vars),
+                'tag_counts': tag_counts
             }
             
         except Exception as e:
@@ -0,0 +1,80 @@
+"""Token estimation and usage extraction for chat model calls"""
+
+import re
+from typing import Dict, Optional
+
+# 中日韩字符约1个token/字，其余文本约4个字符/token（与通义千问分词器的经验比例接近）
+_CJK_PATTERN = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]')
+
+# 图片输入按固定token数估算（qwen-vl 单张图片约数百到一千余token）
+IMAGE_TOKEN_ESTIMATE = 1200
+
+
+def estimate_text_tokens(text: str) -> int:
+    """Roughly estimate the number of tokens of a text"""
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def estimate_tokens(messages) -> int:
+    """
+    Estimate prompt tokens of a chat model input
+
+    Args:
+        messages: A string or a list of LangChain messages / strings; multimodal
+                  content lists are supported (images count as a fixed estimate)
+    """
+    if isinstance(messages, str):
+        messages = [messages]
+    total = 0
+    for message in messages:
+        content = message if isinstance(message, str) else getattr(message, 'content', '')
+        total += 4  # 每条消息的角色与分隔符开销
+        if isinstance(content, str):
+            total += estimate_text_tokens(content)
+            continue
+        for part in content or []:
+            if isinstance(part, str):
+                total += estimate_text_tokens(part)
+            elif isinstance(part, dict):
+                if 'image' in part or 'image_url' in part or part.get('type') == 'image_url':
+                    total += IMAGE_TOKEN_ESTIMATE
+                else:
+                    total += estimate_text_tokens(str(part.get('text', '')))
+    return total
+
+
+def extract_token_usage(response) -> Optional[Dict[str, int]]:
+    """
+    Read token usage reported by the provider
+
+    Supports DashScope's ``response_metadata['token_usage']`` (input_tokens /
+    output_tokens) and LangChain's standard ``usage_metadata``. Prompt tokens
+    served from the provider's context cache are reported as ``cached_tokens``
+    (``prompt_tokens_details.cached_tokens`` / ``input_token_details.cache_read``).
+
+    Returns:
+        {'prompt_tokens', 'completion_tokens', 'total_tokens', 'cached_tokens'}
+        or None if the response carries no usage information
+    """
+    usage = getattr(response, 'usage_metadata', None)
+    if usage:
+        prompt = usage.get('input_tokens', 0)
+        completion = usage.get('output_tokens', 0)
+        cached = (usage.get('input_token_details') or {}).get('cache_read', 0)
+        return {'prompt_tokens': prompt, 'completion_tokens': completion,
+                'total_tokens': usage.get('total_tokens', prompt + completion),
+                'cached_tokens': cached or 0}
+
+    metadata = getattr(response, 'response_metadata', None) or {}
+    usage = metadata.get('token_usage')
+    if not usage:
+        return None
+    prompt = usage.get('input_tokens', usage.get('prompt_tokens', 0))
+    completion = usage.get('output_tokens', usage.get('completion_tokens', 0))
+    details = usage.get('prompt_tokens_details') or usage.get('input_tokens_details') or {}
+    return {'prompt_tokens': prompt, 'completion_tokens': completion,
+            'total_tokens': usage.get('total_tokens', prompt + completion),
+            'cached_tokens': details.get('cached_tokens', 0) or 0}
@@ -0,0 +1,149 @@
+"""Token usage accounting per job, per user and per model"""
+
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from config.settings import JOB_BUDGET_ACTION
+
+
+class TokenBudgetExceededError(RuntimeError):
+    """The token budget of the current job has been used up"""
+
+
+def _empty_totals() -> Dict[str, int]:
+    # cached_tokens: 命中服务端上下文缓存的提示词token数；cache_hit_calls: 命中缓存的调用次数
+    return {'calls': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0,
+            'cached_tokens': 0, 'cache_hit_calls': 0}
+
+
+def _add(totals: Dict[str, int], usage: Dict[str, int]):
+    totals['calls'] += 1
+    for key in ('prompt_tokens', 'completion_tokens', 'total_tokens', 'cached_tokens'):
+        totals[key] += usage.get(key, 0)
+    if usage.get('cached_tokens'):
+        totals['cache_hit_calls'] += 1
+
+
+def sum_totals(by_model: Dict[str, Dict[str, int]]) -> Dict[str, int]:
+    """Add up per-model totals"""
+    total = _empty_totals()
+    for totals in by_model.values():
+        for key in total:
+            total[key] += totals.get(key, 0)
+    return total
+
+
+class UsageScope:
+    """
+    Token usage of one unit of work (a job, a task or a single request)
+
+    Args:
+        job_id: Job or task id the usage belongs to
+        user: Session key of the user who triggered the work
+        budget: Maximum total tokens; 0 or None means unlimited
+        on_exceed: "abort" to fail further calls, "downgrade" to switch to the
+                   fallback model configured in LLM_BUDGET_FALLBACK_MODELS
+    """
+
+    def __init__(self, job_id: str = None, user: str = None, budget: int = None,
+                 on_exceed: str = None):
+        self.job_id = job_id
+        self.user = user
+        self.budget = budget or 0
+        self.on_exceed = on_exceed or JOB_BUDGET_ACTION
+        self.by_model: Dict[str, Dict[str, int]] = {}
+        self.downgraded = False
+        self._lock = threading.Lock()
+
+    @property
+    def total_tokens(self) -> int:
+        return sum(totals['total_tokens'] for totals in self.by_model.values())
+
+    @property
+    def exceeded(self) -> bool:
+        return bool(self.budget) and self.total_tokens >= self.budget
+
+    def add(self, model_name: str, usage: Dict[str, int]):
+        with self._lock:
+            _add(self.by_model.setdefault(model_name, _empty_totals()), usage)
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            by_model = {model: dict(totals) for model, totals in self.by_model.items()}
+        return {
+            'total': sum_totals(by_model),
+            'by_model': by_model,
+            'budget': self.budget or None,
+            'budget_action': self.on_exceed,
+            'budget_exceeded': self.exceeded,
+            'downgraded': self.downgraded
+        }
+
+
+_current_scope: ContextVar[Optional[UsageScope]] = ContextVar('llm_usage_scope', default=None)
+
+
+def current_scope() -> Optional[UsageScope]:
+    return _current_scope.get()
+
+
+@contextmanager
+def usage_scope(scope: Optional[UsageScope]):
+    """Attribute LLM calls made in this context (including coroutines submitted to the shared loop) to ``scope``"""
+    token = _current_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _current_scope.reset(token)
+
+
+def set_usage_scope(scope: Optional[UsageScope]):
+    """Set the scope without a with-block; returns a token for reset_usage_scope()"""
+    return _current_scope.set(scope)
+
+
+def reset_usage_scope(token):
+    _current_scope.reset(token)
+
+
+class UsageTracker:
+    """Process-wide token totals per model and per user"""
+
+    def __init__(self):
+        self.by_model: Dict[str, Dict[str, int]] = {}
+        self.by_user: Dict[str, Dict[str, Dict[str, int]]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, model_name: str, usage: Dict[str, int], user: str = None):
+        with self._lock:
+            _add(self.by_model.setdefault(model_name, _empty_totals()), usage)
+            if user:
+                user_models = self.by_user.setdefault(user, {})
+                _add(user_models.setdefault(model_name, _empty_totals()), usage)
+
+    def user_usage(self, user: str) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {model: dict(totals) for model, totals in self.by_user.get(user, {}).items()}
+
+    def model_usage(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {model: dict(totals) for model, totals in self.by_model.items()}
+
+
+_tracker = UsageTracker()
+
+
+def get_usage_tracker() -> UsageTracker:
+    return _tracker
+
+
+def record_usage(model_name: str, usage: Optional[Dict[str, int]]):
+    """Add provider-reported usage to the process totals and the current scope"""
+    if not usage:
+        return
+    scope = current_scope()
+    _tracker.record(model_name, usage, user=scope.user if scope else None)
+    if scope is not None:
+        scope.add(model_name, usage)
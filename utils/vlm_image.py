@@ -0,0 +1,116 @@
+"""Image preparation for vision model requests - downscale and re-encode page images"""
+
+import base64
+import io
+import math
+from pathlib import Path
+from typing import Dict, List
+
+from config.settings import VLM_IMAGE_MAX_PIXELS, VLM_IMAGE_FORMAT, VLM_IMAGE_QUALITY
+
+# Import handling for optional dependencies
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+_MIME_TYPES = {
+    '.png': 'image/png', '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg',
+    '.bmp': 'image/bmp', '.gif': 'image/gif', '.webp': 'image/webp'
+}
+
+
+def _data_url(data: bytes, mime_type: str) -> str:
+    return f"data:{mime_type};base64,{base64.b64encode(data).decode()}"
+
+
+def _encode(image: 'Image.Image', image_format: str, quality: int):
+    """Encode an image; returns (bytes, mime type)"""
+    buffer = io.BytesIO()
+    if image_format == 'png':
+        image.convert('L').save(buffer, format='PNG', optimize=True)
+        return buffer.getvalue(), 'image/png'
+    if image.mode not in ('RGB', 'L'):
+        # 透明背景按白色合成，避免JPEG把透明区域变成黑色
+        background = Image.new('RGB', image.size, 'white')
+        rgba = image.convert('RGBA')
+        background.paste(rgba, mask=rgba.split()[-1])
+        image = background
+    if image_format == 'webp':
+        image.save(buffer, format='WEBP', quality=quality, method=4)
+        return buffer.getvalue(), 'image/webp'
+    image.save(buffer, format='JPEG', quality=quality, optimize=True)
+    return buffer.getvalue(), 'image/jpeg'
+
+
+def prepare_vlm_image(image_path: str, max_pixels: int = None, image_format: str = None,
+                      quality: int = None) -> Dict:
+    """
+    Downscale an image to the vision model's input resolution and encode it as a data URL
+
+    Args:
+        image_path: Path of the page image
+        max_pixels: Pixel budget (width * height); defaults to VLM_IMAGE_MAX_PIXELS
+        image_format: 'jpeg', 'webp', 'png' (grayscale) or 'original';
+                      defaults to VLM_IMAGE_FORMAT
+        quality: JPEG/WebP quality; defaults to VLM_IMAGE_QUALITY
+
+    Returns:
+        {'data_url', 'size' (width, height or None), 'bytes', 'original_bytes'}
+        The original file is used unchanged when Pillow is missing, when the
+        format is 'original', or when re-encoding would not make it smaller.
+    """
+    max_pixels = max_pixels or VLM_IMAGE_MAX_PIXELS
+    image_format = (image_format or VLM_IMAGE_FORMAT).lower()
+    quality = quality or VLM_IMAGE_QUALITY
+
+    with open(image_path, 'rb') as f:
+        original = f.read()
+    original_mime = _MIME_TYPES.get(Path(image_path).suffix.lower(), 'image/png')
+    result = {'data_url': None, 'size': None, 'bytes': len(original), 'original_bytes': len(original)}
+
+    if not PIL_AVAILABLE or image_format == 'original':
+        result['data_url'] = _data_url(original, original_mime)
+        return result
+
+    with Image.open(io.BytesIO(original)) as image:
+        image.load()
+        width, height = image.size
+        if width * height > max_pixels:
+            scale = math.sqrt(max_pixels / (width * height))
+            size = (max(1, int(width * scale)), max(1, int(height * scale)))
+            image = image.resize(size, Image.LANCZOS)
+        encoded, mime_type = _encode(image, image_format, quality)
+        result['size'] = image.size
+
+    if len(encoded) >= len(original):
+        # 重新编码没有变小（如已压缩过的小截图、大片空白的页面）时上传原图
+        result['data_url'] = _data_url(original, original_mime)
+        result['size'] = (width, height)
+        return result
+
+    result['data_url'] = _data_url(encoded, mime_type)
+    result['bytes'] = len(encoded)
+    return result
+
+
+def prepare_vlm_images(image_paths: List[str]) -> List[Dict]:
+    """
+    Prepare page images for a vision model request, skipping unreadable files
+
+    Returns:
+        [{'page': 1-based page number, 'data_url', 'size', 'bytes', 'original_bytes'}, ...]
+    """
+    pages = []
+    for i, image_path in enumerate(image_paths):
+        try:
+            prepared = prepare_vlm_image(image_path)
+        except Exception as e:
+            print(f"读取第 {i+1} 页图片失败: {e}")
+            continue
+        prepared['page'] = i + 1
+        pages.append(prepared)
+        print(f"成功读取第 {i+1} 页图片 ({prepared['original_bytes'] / 1024:.0f} KB → "
+              f"{prepared['bytes'] / 1024:.0f} KB)")
+    return pages
@@ -28,6 +28,8 @@ Examples:
   python web_main.py --port 8080        Run on custom port
   python web_main.py --host 127.0.0.1   Run on localhost only
   python web_main.py --debug            Enable debug mode
+  python web_main.py --production --threads 16
+                                        Run with a production WSGI server
         """
     )
     
@@ -51,6 +53,40 @@ Examples:
         help='Enable debug mode'
     )
     
+    parser.add_argument(
+        '--production',
+        action='store_true',
+        help='Run with a production WSGI server (gunicorn, or waitress on Windows)'
+    )
+    
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=None,
+        help='Number of worker processes in production mode (default: SERVER_WORKERS)'
+    )
+    
+    parser.add_argument(
+        '--threads',
+        type=int,
+        default=None,
+        help='Threads per worker in production mode (default: SERVER_THREADS)'
+    )
+    
+    parser.add_argument(
+        '--keep-alive',
+        type=int,
+        default=None,
+        help='Keep-alive seconds in production mode (default: SERVER_KEEPALIVE)'
+    )
+    
+    parser.add_argument(
+        '--graceful-timeout',
+        type=int,
+        default=None,
+        help='Seconds to finish in-flight requests on shutdown (default: SERVER_GRACEFUL_TIMEOUT)'
+    )
+    
     return parser.parse_args()
 
 
@@ -157,6 +193,20 @@ def main():
     # Create and start API
     print("🚀 Starting complete system...")
     try:
+        if args.production:
+            # 生产模式：由WSGI服务器在各worker中调用create_app()
+            from interface.production_server import run_production_server
+            print_system_info(args.host, args.port, False)
+            run_production_server(
+                host=args.host,
+                port=args.port,
+                workers=args.workers,
+                threads=args.threads,
+                keep_alive=args.keep_alive,
+                graceful_timeout=args.graceful_timeout
+            )
+            return
+        
         api = UniversityFlaskAPI()
         print_system_info(args.host, args.port, args.debug)
         api.run(host=args.host, port=args.port, debug=args.debug)